@@ -0,0 +1,46 @@
+import re
+import time
+
+from app.services.metrics import HTTP_REQUEST_SECONDS, start_trace, finish_trace
+
+TRACE_HEADER = b"x-trace-id"
+# Caller-supplied trace ids are only accepted in this shape, so they are safe to echo and to use as keys
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class TraceMiddleware:
+    """Times every HTTP request and records its stages under a trace id returned in the X-Trace-Id header.
+
+    A plain ASGI middleware, so the trace stays current while a streamed
+    response body is produced. A valid X-Trace-Id sent by the caller is reused.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        requested = dict(scope["headers"]).get(TRACE_HEADER, b"").decode("latin-1")
+        trace, token = start_trace(requested if TRACE_ID_PATTERN.match(requested) else None)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    message["headers"] = [*message.get("headers", []), (TRACE_HEADER, trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            finish_trace(trace, token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope["method"], getattr(route, "path", "unmatched"), str(status)
+            )
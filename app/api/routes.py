@@ -1,68 +1,196 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import List
+import os
+import json
+import uuid
+import asyncio
 
-from app.services.document_processor import DocumentProcessor
-from app.services.vector_store import VectorStore
-from app.services.query_processor import QueryProcessor
-from app.models.models import DocumentList, QueryResponse, QueryRequest
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+
+from app.services.document_processor import FileTooLargeError
+from app.services.executors import PoolSaturatedError
+from app.services.metrics import get_trace
+from app.services.registry import (
+    get_document_processor, get_query_processor,
+    get_io_pool, get_ingestion_queue, start_ingestion_worker, get_document_index, get_maintenance, pool_stats,
+    embedding_cache_stats, answer_cache_stats, context_budget_stats, context_tokenizer, parsing_stats,
+    llm_gateway_stats
+)
+from app.config import REINGEST_BY_FILENAME
+from app.models.models import (
+    DocumentList, QueryResponse, QueryRequest, IngestBatch, IngestJob, DeleteDocumentsRequest,
+    DeleteDocumentsResponse
+)
 
 router = APIRouter()
-document_processor = DocumentProcessor()
-vector_store = VectorStore()
-query_processor = QueryProcessor()
 
-@router.post("/documents/upload", response_model=DocumentList)
-async def upload_documents(files: List[UploadFile] = File(...)):
+
+def _saturated(e):
+    return HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+
+
+async def _service(getter):
+    # Services are built on first use when not preloaded; loading models and stores must not block the event loop
+    return await asyncio.to_thread(getter)
+
+
+def _enqueue_upload(batch_id, filename, file_path, unique_id, sha256, size, replace_doc_id=None):
+    """Queue a saved upload, skipping files whose content is already indexed."""
+    document_index = get_document_index()
+    ingestion_queue = get_ingestion_queue()
+
+    duplicate = document_index.find_by_sha256(sha256)
+    if duplicate is not None:
+        os.remove(file_path)
+        return ingestion_queue.enqueue(
+            batch_id, filename, duplicate["path"], duplicate["doc_id"], sha256, size, status="duplicate"
+        )
+
+    # A new version of a document is re-ingested under the same document id
+    if replace_doc_id is None and REINGEST_BY_FILENAME:
+        previous = document_index.find_by_filename(filename)
+        replace_doc_id = previous["doc_id"] if previous else None
+    return ingestion_queue.enqueue(batch_id, filename, file_path, replace_doc_id or unique_id, sha256, size)
+
+
+@router.post("/documents/upload", response_model=IngestBatch, status_code=202)
+async def upload_documents(files: List[UploadFile] = File(...), replace_doc_id: Optional[str] = Form(None)):
+    """
+    Save uploaded files and queue them for background ingestion.
+
+    With replace_doc_id, the single uploaded file is a new version of that document.
+    """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
 
-    processed_docs = []
+    document_processor = await _service(get_document_processor)
+    io_pool = get_io_pool()
+    batch_id = str(uuid.uuid4())
+
+    if replace_doc_id:
+        if len(files) != 1:
+            raise HTTPException(status_code=400, detail="replace_doc_id needs exactly one file")
+        try:
+            document_index = await _service(get_document_index)
+            previous = await io_pool.run(document_index.get_document, replace_doc_id)
+        except PoolSaturatedError as e:
+            raise _saturated(e)
+        if previous is None:
+            raise HTTPException(status_code=404, detail=f"Document {replace_doc_id} not found")
 
+    jobs = []
     for file in files:
         try:
-            doc, chunks = document_processor.process_document(file)
-            vector_store.add_documents(chunks)
-
-            processed_docs.append({
-                "id": doc["id"],
-                "filename": doc["filename"],
-                "path": doc["path"],
-                "processed_path": doc["processed_path"]
-            })
+            # Streamed to disk in blocks; the hash is computed on the way
+            file_path, unique_id, sha256, size = await io_pool.run(document_processor.save_uploaded_file, file)
+            jobs.append(await io_pool.run(
+                _enqueue_upload, batch_id, file.filename, file_path, unique_id, sha256, size, replace_doc_id or None
+            ))
+        except PoolSaturatedError as e:
+            raise _saturated(e)
+        except FileTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error processing {file.filename}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error saving {file.filename}: {str(e)}")
+
+    (await start_ingestion_worker()).notify()
+    return {"batch_id": batch_id, "jobs": jobs}
+
+
+@router.get("/ingest/batches/{batch_id}", response_model=IngestBatch)
+async def get_ingest_batch(batch_id: str):
+    """
+    Get the status of every file in an upload batch.
+    """
+    ingestion_queue = await _service(get_ingestion_queue)
+    jobs = await get_io_pool().run(ingestion_queue.list_jobs, batch_id=batch_id, limit=10000)
+    if not jobs:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return {"batch_id": batch_id, "jobs": jobs}
 
-    return {"documents": processed_docs}
 
+@router.get("/ingest/jobs/{job_id}", response_model=IngestJob)
+async def get_ingest_job(job_id: str):
+    """
+    Get the status, timings and error of a single ingestion job.
+    """
+    ingestion_queue = await _service(get_ingestion_queue)
+    job = await get_io_pool().run(ingestion_queue.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
 
-# Other routes (get_documents, process_query) remain unchanged
 
+@router.get("/ingest/jobs", response_model=List[IngestJob])
+async def list_ingest_jobs(status: Optional[str] = None, limit: int = 100):
+    """
+    List ingestion jobs, optionally filtered by status (queued, running, done, duplicate, failed).
+    """
+    ingestion_queue = await _service(get_ingestion_queue)
+    return await get_io_pool().run(ingestion_queue.list_jobs, status=status, limit=limit)
 
 
 @router.get("/documents", response_model=DocumentList)
-async def get_documents():
+async def get_documents(limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None):
     """
-    Get all uploaded documents.
+    List ingested documents from the document catalog, most recently ingested first.
+
+    Pass the returned next_cursor as cursor to fetch the following page.
     """
+    document_index = await _service(get_document_index)
     try:
-        collection = vector_store.get_all_documents()
-        
-        # Extract unique document IDs and metadata
-        documents = {}
-        for i, metadata in enumerate(collection["metadatas"]):
-            doc_id = metadata.get("id")
-            if doc_id and doc_id not in documents:
-                documents[doc_id] = {
-                    "id": doc_id,
-                    "filename": metadata.get("filename", "Unknown"),
-                    "path": metadata.get("path", ""),
-                    "processed_path": metadata.get("processed_path", "")
-                }
-        
-        return {"documents": list(documents.values())}
+        rows, next_cursor = await get_io_pool().run(document_index.list_documents, limit, cursor)
+        total = await get_io_pool().run(document_index.document_count)
+    except PoolSaturatedError as e:
+        raise _saturated(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving documents: {str(e)}")
 
+    documents = [{
+        "id": row["doc_id"],
+        "filename": row["filename"],
+        "path": row["path"],
+        "processed_path": row["processed_path"],
+        "size_bytes": row["size_bytes"],
+        "page_count": row["page_count"],
+        "chunk_count": row["chunk_count"],
+        "ingested_at": row["updated_at"]
+    } for row in rows]
+    return {"documents": documents, "total": total, "next_cursor": next_cursor}
+
+
+async def _delete_documents(doc_ids):
+    try:
+        maintenance = await _service(get_maintenance)
+        return await get_io_pool().run(maintenance.delete_documents, doc_ids)
+    except PoolSaturatedError as e:
+        raise _saturated(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting documents: {str(e)}")
+
+
+@router.delete("/documents/{doc_id}", response_model=DeleteDocumentsResponse)
+async def delete_document(doc_id: str):
+    """
+    Delete a document's chunks, files and catalog entry.
+    """
+    result = await _delete_documents([doc_id])
+    if result["busy"]:
+        raise HTTPException(status_code=409, detail=f"Document {doc_id} is being ingested")
+    if result["not_found"]:
+        raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
+    return result
+
+
+@router.post("/documents/delete", response_model=DeleteDocumentsResponse)
+async def delete_documents(request: DeleteDocumentsRequest):
+    """
+    Delete several documents; ids that are unknown or still being ingested are reported, not deleted.
+    """
+    return await _delete_documents(request.document_ids)
+
 
 @router.post("/query", response_model=QueryResponse)
 async def process_query(request: QueryRequest):
@@ -70,23 +198,144 @@ async def process_query(request: QueryRequest):
     Process a query against the documents.
     """
     try:
-        # Process query with themes
-        response = query_processor.process_query_with_themes(request.query)
-        
-        # Filter by document IDs if provided
-        if request.document_ids:
-            response.document_responses = [
-                doc for doc in response.document_responses 
-                if doc.doc_id in request.document_ids
-            ]
-            
-            # Update themes based on filtered documents
-            for theme in response.identified_themes:
-                theme.supporting_documents = [
-                    doc_id for doc_id in theme.supporting_documents 
-                    if doc_id in request.document_ids
-                ]
+        # Process query with themes, scoped to the requested documents
+        query_processor = await _service(get_query_processor)
+        response = await query_processor.aprocess_query_with_themes(
+            request.query, document_ids=request.document_ids
+        )
         
         return response
+    except PoolSaturatedError as e:
+        raise _saturated(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+
+def _sse_payload(data):
+    if isinstance(data, str):
+        return {"text": data}
+    if isinstance(data, list):
+        return [item.model_dump() for item in data]
+    return data.model_dump()
+
+
+async def _sse_events(events):
+    # Each stage result is one "event: <name>" frame with a JSON data line
+    try:
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(_sse_payload(data))}\n\n"
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
\ No newline at end of file
+        yield f"event: error\ndata: {json.dumps({'detail': f'Error processing query: {str(e)}'})}\n\n"
+
+
+@router.post("/query/stream")
+async def stream_query(request: QueryRequest):
+    """
+    Process a query and stream the results as server-sent events.
+
+    Emits a "document" event per document answer as soon as it is extracted, then
+    "themes", then "token" events with pieces of the synthesized answer, and a
+    final "done" event with the complete QueryResponse.
+    """
+    query_processor = await _service(get_query_processor)
+    events = query_processor.astream_query_with_themes(request.query, document_ids=request.document_ids)
+    return StreamingResponse(
+        _sse_events(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/system/pools")
+async def get_pool_stats():
+    """
+    Get queue depth and wait time metrics for the worker pools.
+    """
+    return {"pools": pool_stats()}
+
+
+@router.post("/system/compact")
+async def compact_storage():
+    """
+    Reclaim disk space left by deleted documents in the vector store, keyword index and document index.
+    """
+    try:
+        maintenance = await _service(get_maintenance)
+        return await get_io_pool().run(maintenance.compact)
+    except PoolSaturatedError as e:
+        raise _saturated(e)
+
+
+async def _check_consistency(repair):
+    try:
+        maintenance = await _service(get_maintenance)
+        return await get_io_pool().run(maintenance.check_consistency, repair)
+    except PoolSaturatedError as e:
+        raise _saturated(e)
+
+
+@router.get("/system/consistency")
+async def check_consistency():
+    """
+    Find chunks, files and catalog entries that do not belong together.
+    """
+    return await _check_consistency(False)
+
+
+@router.post("/system/consistency/repair")
+async def repair_consistency():
+    """
+    Run the consistency check and remove the orphaned chunks and files it finds.
+    """
+    return await _check_consistency(True)
+
+
+@router.get("/system/traces/{trace_id}")
+async def get_trace_spans(trace_id: str):
+    """
+    Get the stage timings of a recent request or ingest job by the id from its X-Trace-Id header or its job id.
+    """
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+    return trace
+
+
+@router.get("/system/embedding-cache")
+async def get_embedding_cache_stats():
+    """
+    Get hit and miss counters of the embedding cache.
+    """
+    return {"embedding_cache": embedding_cache_stats()}
+
+
+@router.get("/system/answer-cache")
+async def get_answer_cache_stats():
+    """
+    Get hit and miss counters of the query answer cache.
+    """
+    return {"answer_cache": answer_cache_stats()}
+
+
+@router.get("/system/context-budget")
+async def get_context_budget_stats():
+    """
+    Get prompt tokens before and after context packing, per LLM stage, and the tokenizer they were counted with.
+    """
+    return {"context_budget": context_budget_stats(), "tokenizer": context_tokenizer()}
+
+
+@router.get("/system/parsing")
+async def get_parsing_stats():
+    """
+    Get how often LLM replies were parsed natively, directly, after local repair, by the LLM fixer, or not at all.
+    """
+    return {"parsing": parsing_stats()}
+
+
+@router.get("/system/llm-gateway")
+async def get_llm_gateway_stats():
+    """
+    Get LLM gateway counters: calls, retries, rate-limited replies, failovers, failures, and calls in flight or queued.
+    """
+    return {"llm_gateway": llm_gateway_stats()}
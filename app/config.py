@@ -7,10 +7,13 @@ load_dotenv()
 
 # ========== API Keys ==========
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
+# Point the Groq client at another endpoint, e.g. benchmarks/mock_llm_server.py
+GROQ_API_BASE = os.getenv("GROQ_API_BASE") or None
 
 # ========== Directory Configuration ==========
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / "data"
+# Uploads, processed text and every database live here; benchmarks point it at a scratch directory
+DATA_DIR = Path(os.getenv("DATA_DIR", str(BASE_DIR / "data")))
 UPLOAD_DIR = DATA_DIR / "uploads"
 PROCESSED_DIR = DATA_DIR / "processed"
 DB_DIR = DATA_DIR / "db"
@@ -20,13 +23,178 @@ STATIC_DIR = BASE_DIR / "static"
 for dir_path in [DATA_DIR, UPLOAD_DIR, PROCESSED_DIR, DB_DIR, STATIC_DIR]:
     dir_path.mkdir(parents=True, exist_ok=True)
 
+# ========== Service Startup ==========
+# Build the embedding model, vector store and LLM client during app startup instead of on first request
+PRELOAD_SERVICES = os.getenv("PRELOAD_SERVICES", "true").lower() == "true"
+
+# ========== Worker Pools ==========
+# Process pool for CPU-bound text extraction (PDF parsing, OCR)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+CPU_MAX_PENDING = int(os.getenv("CPU_MAX_PENDING", "32"))
+# Thread pool for blocking I/O (file writes, embedding, Chroma reads/writes)
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+IO_MAX_PENDING = int(os.getenv("IO_MAX_PENDING", "64"))
+
+# ========== Background Ingestion ==========
+INGEST_DB_PATH = DB_DIR / "ingest.db"
+# Number of uploads ingested concurrently by each app process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+# Chunks sent to the vector store per write while a document is being ingested
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+# Seconds an idle worker waits before checking the queue again
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+# Seconds a claimed job stays leased to its process; the worker renews the lease while the process is alive,
+# and jobs whose lease expired (the process died) go back to the queue
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "60"))
+
+# ========== Deduplication ==========
+DOCUMENT_INDEX_PATH = DB_DIR / "documents.db"
+# Treat an upload with the same filename as an existing document as a new version of it, replacing its chunks
+# and original upload; off by default, uploads name the document they replace with replace_doc_id instead
+REINGEST_BY_FILENAME = os.getenv("REINGEST_BY_FILENAME", "false").lower() == "true"
+
 # ========== Vector DB Configuration ==========
 CHROMA_COLLECTION_NAME = "document_collection"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Texts per forward pass of the embedding model
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Spread large embedding batches over a sentence-transformers multi-process pool (CPU only)
+EMBED_MULTI_PROCESS = os.getenv("EMBED_MULTI_PROCESS", "false").lower() == "true"
+# Chunks collected across ingestion jobs before they are embedded and written to Chroma together
+CHROMA_WRITE_BATCH_SIZE = int(os.getenv("CHROMA_WRITE_BATCH_SIZE", "1024"))
+# Longest time (seconds) a partially filled write batch waits for more chunks
+BULK_WRITE_MAX_DELAY = float(os.getenv("BULK_WRITE_MAX_DELAY", "0.5"))
+# The collection is persisted after this many written chunks or seconds, whichever comes first
+PERSIST_EVERY_N_CHUNKS = int(os.getenv("PERSIST_EVERY_N_CHUNKS", "5000"))
+PERSIST_INTERVAL_SECONDS = float(os.getenv("PERSIST_INTERVAL_SECONDS", "30"))
+
+# ========== Vector Index ==========
+# Where chunk vectors live: "chroma", or a local ANN index, "hnswlib" or "faiss" (needs faiss-cpu)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DIR = DB_DIR / "vector_index"
+# HNSW graph degree and build breadth; for Chroma they only apply when the collection is created
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "100"))
+# Candidates explored per query; higher is more accurate and slower
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# Vector encoding of the faiss backend: "float32", "float16" or "int8"
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float32")
+
+# ========== Hybrid Retrieval ==========
+# Fuse dense search with a BM25 keyword index so exact identifiers and rare terms are found
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+KEYWORD_INDEX_PATH = DB_DIR / "keywords.db"
+# Each retriever returns k * HYBRID_CANDIDATES_FACTOR candidates before fusion
+HYBRID_CANDIDATES_FACTOR = int(os.getenv("HYBRID_CANDIDATES_FACTOR", "4"))
+# Rank offset of reciprocal-rank fusion; larger values flatten the difference between ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Re-score the fused candidates with a local cross-encoder
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+
+# ========== Embedding Cache ==========
+# Reuse embeddings of previously seen chunk texts (on disk) and queries (in memory)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = DB_DIR / "embedding_cache"
+EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
+
+# ========== Uploads ==========
+# Uploads are streamed to disk in blocks of this many bytes
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "200")) * 1024 * 1024
+# Files younger than this may be uploads not yet queued, so the consistency check never reports them as orphans
+ORPHAN_FILE_GRACE_SECONDS = float(os.getenv("ORPHAN_FILE_GRACE_SECONDS", "600"))
 
 # ========== Document Processing ==========
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+# OCR the embedded images of PDF pages that have no text layer (scanned pages)
+PDF_OCR_FALLBACK = os.getenv("PDF_OCR_FALLBACK", "true").lower() == "true"
+# Smallest page range handed to one extraction worker when a PDF or TIFF is split across the CPU pool
+EXTRACTION_MIN_PAGES_PER_TASK = int(os.getenv("EXTRACTION_MIN_PAGES_PER_TASK", "10"))
+# Text files are read, and DOCX paragraphs grouped, in blocks of about this many characters that are chunked
+# one at a time like pages
+TEXT_BLOCK_SIZE = int(os.getenv("TEXT_BLOCK_SIZE", "65536"))
 
 # ========== Model Configuration ==========
 LLM_MODEL = "llama-3.3-70b-versatile"  # Hosted on Groq
 LLM_TEMPERATURE = 0.0
+
+# ========== LLM Gateway ==========
+# Every LLM call goes through one shared gateway that rate-limits, prioritizes, retries and fails over
+LLM_GATEWAY_ENABLED = os.getenv("LLM_GATEWAY_ENABLED", "true").lower() == "true"
+# Client-side limits, defaulting to Groq's free tier for the default model; 0 disables a limit
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "12000"))
+# Completion tokens assumed for a call until the provider reports its real usage
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "300"))
+# LLM calls in flight across all queries; waiting calls are served synthesis first, then themes, then extraction
+LLM_GATEWAY_MAX_CONCURRENCY = int(os.getenv("LLM_GATEWAY_MAX_CONCURRENCY", "8"))
+# Retries of rate-limited, failed (5xx) or unreachable calls, with jittered exponential backoff honoring Retry-After
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+# Model tried when the primary still fails after its retries (e.g. llama-3.1-8b-instant); empty disables failover
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+# Keep-alive connection pool shared by the primary and fallback models
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", "30"))
+
+# ========== Query Processing ==========
+# Chunks retrieved per query; each distinct document among them costs one extraction call
+QUERY_TOP_K = int(os.getenv("QUERY_TOP_K", "6"))
+# Maximum number of per-document extraction calls in flight for one query
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "5"))
+# Seconds allowed for one LLM attempt through the gateway (excluding queueing and backoff); without the gateway,
+# for one extraction call including any parser repair calls
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+
+# Extract answers for several documents in one LLM call; failed batches fall back to one call per document
+EXTRACTION_BATCH_ENABLED = os.getenv("EXTRACTION_BATCH_ENABLED", "false").lower() == "true"
+EXTRACTION_BATCH_MAX_DOCUMENTS = int(os.getenv("EXTRACTION_BATCH_MAX_DOCUMENTS", "5"))
+# Most context tokens packed into one batched extraction call
+EXTRACTION_BATCH_CONTEXT_TOKENS = int(os.getenv("EXTRACTION_BATCH_CONTEXT_TOKENS", "6000"))
+
+# Ask the chat model for schema-constrained output (tool calling) instead of parsing free text
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT_ENABLED", "true").lower() == "true"
+# Ask the LLM to fix replies that local JSON repair cannot parse (costs one more call)
+LLM_PARSE_FIX_ENABLED = os.getenv("LLM_PARSE_FIX_ENABLED", "true").lower() == "true"
+
+# ========== Themes ==========
+# Find themes by clustering the extracted answers' embeddings locally instead of asking the LLM
+THEME_CLUSTERING_ENABLED = os.getenv("THEME_CLUSTERING_ENABLED", "true").lower() == "true"
+# Answers are grouped while the average cosine similarity between two groups is at least this value
+THEME_SIMILARITY_THRESHOLD = float(os.getenv("THEME_SIMILARITY_THRESHOLD", "0.45"))
+THEME_MAX_THEMES = int(os.getenv("THEME_MAX_THEMES", "5"))
+# Documents a cluster needs to count as a theme
+THEME_MIN_DOCUMENTS = int(os.getenv("THEME_MIN_DOCUMENTS", "2"))
+# Name the clusters with one short LLM call; otherwise they are named after their distinctive keywords
+THEME_LLM_NAMING = os.getenv("THEME_LLM_NAMING", "false").lower() == "true"
+
+# ========== Context Budget ==========
+# tiktoken encoding used to count prompt tokens. tiktoken downloads the encoding file on first use and caches it
+# (TIKTOKEN_CACHE_DIR); when it is not installed or cannot be fetched, tokens are approximated as 4 characters
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+# Most context tokens sent with one document's extraction call, and with the themes / synthesis calls
+EXTRACTION_CONTEXT_TOKENS = int(os.getenv("EXTRACTION_CONTEXT_TOKENS", "2000"))
+SYNTHESIS_CONTEXT_TOKENS = int(os.getenv("SYNTHESIS_CONTEXT_TOKENS", "4000"))
+# Passages whose word-trigram Jaccard similarity to an earlier passage reaches this value are dropped
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+# ========== Answer Cache ==========
+# Reuse query results while the corpus is unchanged; per-document answers survive changes to other documents
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+# Cosine similarity above which a differently worded query reuses a cached response (0 disables)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.97"))
+
+# ========== Metrics & Tracing ==========
+# Record the stage timings of each request and ingest job under a trace id returned in the X-Trace-Id header
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# Most recent traces kept in memory for GET /api/system/traces/{trace_id}
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "1000"))
+# Spans recorded per trace; later spans are only counted in the metrics
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
@@ -1,17 +1,42 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 import os
 
+from app.api.middleware import TraceMiddleware
 from app.api.routes import router
-from app.config import UPLOAD_DIR
+from app.config import UPLOAD_DIR, PRELOAD_SERVICES
+from app.services.metrics import render_metrics
+from app.services.registry import (
+    init_services, shutdown_services, get_ingestion_queue, start_ingestion_worker, stop_ingestion_worker,
+    service_metrics, close_llm_http_client
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model and open the Chroma collection once per worker
+    if PRELOAD_SERVICES:
+        init_services()
+    # Resume any ingestion left unfinished by a previous run; otherwise, without preloading,
+    # the worker (and the models it needs) starts with the first upload
+    if PRELOAD_SERVICES or get_ingestion_queue().active_jobs():
+        await start_ingestion_worker()
+    yield
+    await stop_ingestion_worker()
+    await close_llm_http_client()
+    shutdown_services()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="Document Research & Theme Identification Chatbot",
     description="An interactive chatbot that can perform research across a large set of documents, identify common themes, and provide detailed, cited responses to user queries.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -23,6 +48,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Time every request and return its trace id
+app.add_middleware(TraceMiddleware)
+
 # Include API routes
 app.include_router(router, prefix="/api")
 
@@ -32,6 +60,12 @@ app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 # Serve static frontend files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage timings, queue waits, token counts and service counters in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(service_metrics()), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
     with open("static/index.html", "r") as f:
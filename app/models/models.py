@@ -8,6 +8,10 @@ class DocumentMetadata(BaseModel):
     filename: str
     path: Optional[str] = None
     processed_path: Optional[str] = None
+    size_bytes: Optional[int] = None
+    page_count: Optional[int] = None
+    chunk_count: Optional[int] = None
+    ingested_at: Optional[float] = None
 
 
 class DocumentResponse(BaseModel):
@@ -35,11 +39,51 @@ class QueryResponse(BaseModel):
 
 
 class DocumentList(BaseModel):
-    """List of documents."""
+    """One page of documents."""
     documents: List[DocumentMetadata]
+    total: int
+    next_cursor: Optional[str] = None
+
+
+class DeleteDocumentsRequest(BaseModel):
+    """Request model for deleting several documents."""
+    document_ids: List[str]
+
+
+class DeleteDocumentsResponse(BaseModel):
+    """Outcome of a document delete."""
+    deleted: List[str]
+    not_found: List[str] = []
+    busy: List[str] = []
 
 
 class QueryRequest(BaseModel):
     """Request model for a query."""
     query: str
-    document_ids: Optional[List[str]] = None
\ No newline at end of file
+    document_ids: Optional[List[str]] = None
+
+
+class IngestJob(BaseModel):
+    """Status of one uploaded file in the ingestion queue."""
+    job_id: str
+    batch_id: str
+    filename: str
+    doc_id: str
+    sha256: Optional[str] = None
+    size_bytes: Optional[int] = None
+    status: str
+    attempts: int = 0
+    error: Optional[str] = None
+    chunk_count: Optional[int] = None
+    reused_chunk_count: Optional[int] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    extract_seconds: Optional[float] = None
+    index_seconds: Optional[float] = None
+
+
+class IngestBatch(BaseModel):
+    """Jobs created by a single upload request."""
+    batch_id: str
+    jobs: List[IngestJob]
@@ -0,0 +1,312 @@
+import os
+import json
+import threading
+
+import numpy as np
+
+from app.config import HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, VECTOR_QUANTIZATION
+
+# Capacity added whenever an hnswlib index fills up
+GROWTH_STEP = 10000
+# Most vectors the int8 quantizer ranges are trained on
+TRAIN_SAMPLE_SIZE = 100000
+# Share of added int8 values outside the trained ranges above which compaction is advised
+OUT_OF_RANGE_WARNING = 0.01
+
+
+class HnswlibIndex:
+    """hnswlib HNSW graph over float32 vectors with integer labels, saved to a single file.
+
+    The dimension is taken from the first vectors added, so the index can be
+    created before the embedding model is known.
+    """
+
+    # Stored vectors are exact, so compaction can rebuild from them
+    lossy = False
+
+    def __init__(self, path, space="l2", M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH):
+        self.path = str(path)
+        self.space = space
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.max_label = -1
+        self._index = None
+        self._lock = threading.RLock()
+        if os.path.exists(self.path + ".json"):
+            self._load()
+
+    def _load(self):
+        import hnswlib
+
+        with open(self.path + ".json") as f:
+            meta = json.load(f)
+        self._index = hnswlib.Index(space=meta["space"], dim=meta["dim"])
+        self._index.load_index(self.path, max_elements=meta["max_elements"], allow_replace_deleted=False)
+        self._index.set_ef(self.ef_search)
+        self.max_label = meta["max_label"]
+
+    def _create(self, dim):
+        import hnswlib
+
+        self._index = hnswlib.Index(space=self.space, dim=dim)
+        self._index.init_index(max_elements=GROWTH_STEP, M=self.M, ef_construction=self.ef_construction)
+        self._index.set_ef(self.ef_search)
+
+    def __len__(self):
+        return self._index.get_current_count() if self._index is not None else 0
+
+    def set_ef_search(self, ef_search):
+        self.ef_search = ef_search
+        if self._index is not None:
+            self._index.set_ef(ef_search)
+
+    def add(self, labels, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(labels):
+            return
+        with self._lock:
+            if self._index is None:
+                self._create(vectors.shape[1])
+            needed = self._index.get_current_count() + len(labels)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(needed + GROWTH_STEP)
+            self._index.add_items(vectors, np.asarray(labels, dtype=np.int64))
+            self.max_label = max(self.max_label, int(max(labels)))
+
+    def delete(self, labels):
+        with self._lock:
+            for label in labels:
+                try:
+                    self._index.mark_deleted(int(label))
+                except RuntimeError:
+                    pass  # never added, e.g. lost before the last save
+
+    def search(self, vector, k, allowed=None):
+        """Return (labels, distances) of the k nearest vectors, optionally only among allowed labels."""
+        with self._lock:
+            if self._index is None:
+                return [], []
+            k = min(k, self._index.get_current_count(), len(allowed) if allowed is not None else k)
+            if k <= 0:
+                return [], []
+            query = np.asarray([vector], dtype=np.float32)
+            allowed_filter = (lambda label: label in allowed) if allowed is not None else None
+            try:
+                labels, distances = self._index.knn_query(query, k=k, filter=allowed_filter)
+            except RuntimeError:
+                # Fewer than k live vectors match (deleted or filtered out); ask for what is there
+                labels, distances = self._knn_fewer(query, k, allowed_filter)
+            return labels[0].tolist(), distances[0].tolist()
+
+    def _knn_fewer(self, query, k, allowed_filter):
+        while k > 1:
+            k //= 2
+            try:
+                return self._index.knn_query(query, k=k, filter=allowed_filter)
+            except RuntimeError:
+                continue
+        return np.empty((1, 0), dtype=np.int64), np.empty((1, 0), dtype=np.float32)
+
+    def compact(self, labels, vectors=None):
+        """Rebuild the graph from the vectors of the given live labels, dropping deleted ones."""
+        with self._lock:
+            if self._index is None:
+                return
+            labels = list(labels)
+            if vectors is None and labels:
+                vectors = np.asarray(self._index.get_items(labels), dtype=np.float32)
+            dim = self._index.dim
+            self._index = None
+            self._create(dim)
+            if labels:
+                self.add(labels, vectors)
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if self._index is None:
+                return
+            self._index.save_index(self.path)
+            with open(self.path + ".json", "w") as f:
+                json.dump({
+                    "space": self.space, "dim": self._index.dim,
+                    "max_elements": self._index.get_max_elements(), "max_label": self.max_label
+                }, f)
+
+    def memory_bytes(self):
+        """Rough size of the vectors and graph links held in memory."""
+        if self._index is None:
+            return 0
+        count = self._index.get_max_elements()
+        return count * (self._index.dim * 4 + self.M * 2 * 4 + 8)
+
+
+class FaissIndex:
+    """faiss HNSW index whose vectors can be stored as float32, float16 or int8 (scalar quantized).
+
+    faiss HNSW indexes cannot remove vectors, so deleted labels are only
+    dropped from results; rebuilding the store compacts them away.
+
+    The index is built on the first add, and int8 ranges are trained on a sample
+    of up to TRAIN_SAMPLE_SIZE vectors of that batch. Values added later that
+    fall outside them are clipped; they are counted, and compaction retrains the
+    quantizer on a sample of all live vectors at full precision.
+    """
+
+    def __init__(self, path, space="l2", M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH,
+                 quantization=VECTOR_QUANTIZATION):
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("The faiss vector backend needs the faiss-cpu package: pip install faiss-cpu")
+        if space != "l2":
+            raise ValueError("The faiss backend only supports l2 distance")
+        self.faiss = faiss
+        self.path = str(path)
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.quantization = quantization
+        self.max_label = -1
+        self._deleted = set()
+        self._index = None
+        # Per-dimension ranges the int8 quantizer was trained on, and added values outside them
+        self._trained_range = None
+        self.values_added = 0
+        self.values_out_of_range = 0
+        self._lock = threading.RLock()
+        if os.path.exists(self.path + ".json"):
+            with open(self.path + ".json") as f:
+                meta = json.load(f)
+            self._index = faiss.read_index(self.path)
+            self.max_label = meta["max_label"]
+            self._deleted = set(meta["deleted"])
+            if meta.get("trained_range"):
+                self._trained_range = tuple(np.asarray(bound, dtype=np.float32) for bound in meta["trained_range"])
+                self.values_added = meta.get("values_added", 0)
+                self.values_out_of_range = meta.get("values_out_of_range", 0)
+
+    @property
+    def lossy(self):
+        """Whether stored vectors lose precision, so compaction should be given the original vectors."""
+        return self.quantization != "float32"
+
+    def _create(self, vectors):
+        faiss = self.faiss
+        if self.quantization == "float32":
+            inner = faiss.IndexHNSWFlat(vectors.shape[1], self.M)
+        else:
+            qtype = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}[self.quantization]
+            inner = faiss.IndexHNSWSQ(vectors.shape[1], qtype, self.M)
+            # int8 needs per-dimension ranges, trained on a sample of the vectors at hand
+            if len(vectors) > TRAIN_SAMPLE_SIZE:
+                sample = vectors[np.random.default_rng(0).choice(len(vectors), TRAIN_SAMPLE_SIZE, replace=False)]
+            else:
+                sample = vectors
+            inner.train(sample)
+            if self.quantization == "int8":
+                self._trained_range = (sample.min(axis=0), sample.max(axis=0))
+                self.values_added = self.values_out_of_range = 0
+        inner.hnsw.efConstruction = self.ef_construction
+        self._index = faiss.IndexIDMap2(inner)
+
+    def __len__(self):
+        return self._index.ntotal - len(self._deleted) if self._index is not None else 0
+
+    def set_ef_search(self, ef_search):
+        self.ef_search = ef_search
+
+    def add(self, labels, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(labels):
+            return
+        with self._lock:
+            if self._index is None:
+                self._create(vectors)
+            self._index.add_with_ids(vectors, np.asarray(labels, dtype=np.int64))
+            self.max_label = max(self.max_label, int(max(labels)))
+            if self._trained_range is not None:
+                self._count_out_of_range(vectors)
+
+    def _count_out_of_range(self, vectors):
+        low, high = self._trained_range
+        was_below = self.values_out_of_range <= OUT_OF_RANGE_WARNING * self.values_added
+        self.values_added += vectors.size
+        self.values_out_of_range += int(((vectors < low) | (vectors > high)).sum())
+        if was_below and self.values_out_of_range > OUT_OF_RANGE_WARNING * self.values_added:
+            print(
+                f"{self.values_out_of_range / self.values_added:.1%} of the int8 vector values are outside the "
+                "trained ranges; compact the vector store to retrain them"
+            )
+
+    def delete(self, labels):
+        with self._lock:
+            self._deleted.update(int(label) for label in labels)
+
+    def search(self, vector, k, allowed=None):
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return [], []
+            faiss = self.faiss
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(self.ef_search, k)
+            if allowed is not None:
+                selector = faiss.IDSelectorBatch(np.asarray(sorted(allowed), dtype=np.int64))
+                params.sel = selector
+            # Over-fetch so that deleted labels can be dropped without returning fewer than k
+            fetch = min(k + len(self._deleted), self._index.ntotal)
+            distances, labels = self._index.search(np.asarray([vector], dtype=np.float32), fetch, params=params)
+            results = [
+                (int(label), float(distance)) for label, distance in zip(labels[0], distances[0])
+                if label != -1 and int(label) not in self._deleted
+            ][:k]
+            return [label for label, _ in results], [distance for _, distance in results]
+
+    def compact(self, labels, vectors=None):
+        """Rebuild the index from the vectors of the given live labels, dropping deleted ones.
+
+        A quantized index is retrained on the rebuild; pass the original vectors,
+        as the stored ones have already lost precision (int8 values are clipped).
+        """
+        with self._lock:
+            if self._index is None:
+                return
+            labels = list(labels)
+            if vectors is None and labels:
+                vectors = np.vstack([self._index.reconstruct(int(label)) for label in labels])
+            self._index = None
+            self._deleted = set()
+            self._trained_range = None
+            if labels:
+                self.add(labels, vectors)
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if self._index is None:
+                return
+            self.faiss.write_index(self._index, self.path)
+            with open(self.path + ".json", "w") as f:
+                json.dump({
+                    "max_label": self.max_label, "deleted": sorted(self._deleted),
+                    "trained_range": [bound.tolist() for bound in self._trained_range] if self._trained_range else None,
+                    "values_added": self.values_added, "values_out_of_range": self.values_out_of_range
+                }, f)
+
+    def memory_bytes(self):
+        if self._index is None:
+            return 0
+        bytes_per_value = {"float32": 4, "float16": 2, "int8": 1}[self.quantization]
+        return self._index.ntotal * (self._index.d * bytes_per_value + self.M * 2 * 4 + 8)
+
+
+def create_ann_index(backend, path, **kwargs):
+    """Build the local ANN index for a vector backend name ("hnswlib" or "faiss")."""
+    if backend == "hnswlib":
+        if kwargs.pop("quantization", "float32") != "float32":
+            print("The hnswlib backend stores float32 vectors; quantization needs the faiss backend")
+        return HnswlibIndex(path, **kwargs)
+    if backend == "faiss":
+        return FaissIndex(path, **kwargs)
+    raise ValueError(f"Unknown vector backend: {backend}")
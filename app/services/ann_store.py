@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import closing
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config import VECTOR_INDEX_DIR
+from app.services.ann_index import create_ann_index
+from app.services.metrics import track_stage
+from app.services.vector_store import VectorStore, create_embeddings
+
+
+class AnnVectorStore(VectorStore):
+    """VectorStore backed by a local ANN index (hnswlib or faiss) instead of Chroma.
+
+    Chunk texts and metadata live in SQLite, where each chunk gets an integer
+    label; the ANN index maps labels to vectors. A rewritten chunk gets a new
+    label and its old one is deleted from the index. The index is saved on the
+    same size/time policy as the Chroma collection; labels written after the
+    last save are re-embedded and re-added when the store is opened again.
+    """
+
+    def __init__(self, backend, embeddings=None, index_dir=VECTOR_INDEX_DIR, keyword_index=None, reranker=None,
+                 **index_options):
+        os.makedirs(index_dir, exist_ok=True)
+        self.backend = backend
+        self.embeddings = embeddings or create_embeddings()
+        self.db_path = os.path.join(str(index_dir), "chunks.db")
+        self.index = create_ann_index(backend, os.path.join(str(index_dir), f"{backend}.index"), **index_options)
+        self.keyword_index = keyword_index
+        self.reranker = reranker
+        self._write_lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._unpersisted = 0
+        self._last_persist = time.monotonic()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    label INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    doc_id TEXT,
+                    text TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc_id)")
+        self._recover()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _recover(self):
+        """Re-add chunks written after the index was last saved."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT label, text FROM chunks WHERE label > ? ORDER BY label", (self.index.max_label,)
+            ).fetchall()
+        if rows:
+            print(f"Re-indexing {len(rows)} chunks written after the last {self.backend} index save")
+            self.index.add([label for label, _ in rows], self.embeddings.embed_documents([text for _, text in rows]))
+            self.index.save()
+
+    def add_documents(self, documents, ids=None):
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in documents]
+        self.upsert_documents(documents, ids)
+        return ids
+
+    def upsert_documents(self, documents, ids):
+        """Embed documents in one model call and write them to SQLite and the ANN index."""
+        try:
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            with track_stage("ingest", "embed"):
+                vectors = self.embeddings.embed_documents(texts)
+            with self._write_lock, track_stage("ingest", "vector_write"):
+                stale = self._labels_for(ids)
+                labels = []
+                with closing(self._connect()) as conn, conn:
+                    self._delete_rows(conn, ids)
+                    for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                        cursor = conn.execute(
+                            "INSERT INTO chunks (chunk_id, doc_id, text, metadata) VALUES (?, ?, ?, ?)",
+                            (chunk_id, metadata.get("id"), text, json.dumps(metadata))
+                        )
+                        labels.append(cursor.lastrowid)
+                self.index.delete(stale)
+                self.index.add(labels, vectors)
+            if self.keyword_index is not None:
+                with track_stage("ingest", "keyword_write"):
+                    self.keyword_index.upsert(ids, texts, metadatas)
+            self._maybe_persist(len(documents))
+        except Exception as e:
+            print(f"Error upserting documents to vector store: {e}")
+            raise
+
+    def _labels_for(self, ids):
+        labels = []
+        ids = list(ids)
+        with closing(self._connect()) as conn:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                labels.extend(label for (label,) in conn.execute(
+                    f"SELECT label FROM chunks WHERE chunk_id IN ({placeholders})", batch
+                ))
+        return labels
+
+    @staticmethod
+    def _delete_rows(conn, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+
+    def persist(self):
+        """Save the ANN index to disk."""
+        with self._persist_lock:
+            self._unpersisted = 0
+            self._last_persist = time.monotonic()
+        with self._write_lock:
+            self.index.save()
+
+    def delete_document(self, doc_id):
+        with self._write_lock, closing(self._connect()) as conn, conn:
+            labels = [label for (label,) in conn.execute("SELECT label FROM chunks WHERE doc_id = ?", (doc_id,))]
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            self.index.delete(labels)
+        if self.keyword_index is not None:
+            self.keyword_index.delete_document(doc_id)
+
+    def delete_documents(self, doc_ids):
+        for doc_id in doc_ids:
+            self.delete_document(doc_id)
+
+    def delete_chunks(self, ids):
+        if not ids:
+            return
+        with self._write_lock:
+            labels = self._labels_for(ids)
+            with closing(self._connect()) as conn, conn:
+                self._delete_rows(conn, ids)
+            self.index.delete(labels)
+        if self.keyword_index is not None:
+            self.keyword_index.delete(ids)
+
+    def chunk_refs(self, page_size=1000):
+        with closing(self._connect()) as conn:
+            yield from conn.execute("SELECT chunk_id, doc_id FROM chunks")
+
+    def chunk_metadata(self, page_size=1000):
+        with closing(self._connect()) as conn:
+            for chunk_id, metadata in conn.execute("SELECT chunk_id, metadata FROM chunks"):
+                yield chunk_id, json.loads(metadata)
+
+    def compact(self):
+        """Rebuild the ANN index from the live chunks only and vacuum the chunk table.
+
+        A quantized index is rebuilt from re-embedded chunk texts (mostly embedding
+        cache hits), so its quantizer is retrained on full-precision vectors.
+        """
+        with self._write_lock:
+            with closing(self._connect()) as conn:
+                rows = conn.execute("SELECT label, text FROM chunks ORDER BY label").fetchall()
+            labels = [label for label, _ in rows]
+            vectors = None
+            if self.index.lossy and rows:
+                vectors = np.asarray(self.embeddings.embed_documents([text for _, text in rows]), dtype=np.float32)
+            self.index.compact(labels, vectors)
+            with closing(self._connect()) as conn:
+                conn.execute("VACUUM")
+        with self._persist_lock:
+            self._unpersisted = 0
+            self._last_persist = time.monotonic()
+        if self.keyword_index is not None:
+            self.keyword_index.compact()
+
+    def sync_keyword_index(self, page_size=1000):
+        count, last = 0, 0
+        while True:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT label, chunk_id, text, metadata FROM chunks WHERE label > ? ORDER BY label LIMIT ?",
+                    (last, page_size)
+                ).fetchall()
+            if not rows:
+                return count
+            self.keyword_index.upsert(
+                [row[1] for row in rows], [row[2] for row in rows], [json.loads(row[3]) for row in rows]
+            )
+            count += len(rows)
+            last = rows[-1][0]
+
+    def _nearest(self, query, k, document_ids):
+        """Return (chunk_id, Document, distance) for the k nearest chunks, nearest first."""
+        allowed = None
+        with track_stage("query", "embed_query"):
+            vector = self.embeddings.embed_query(query)
+        with closing(self._connect()) as conn, track_stage("query", "vector_search"):
+            if document_ids:
+                placeholders = ",".join("?" * len(document_ids))
+                allowed = {label for (label,) in conn.execute(
+                    f"SELECT label FROM chunks WHERE doc_id IN ({placeholders})", list(document_ids)
+                )}
+            labels, distances = self.index.search(vector, k, allowed)
+            if not labels:
+                return []
+            placeholders = ",".join("?" * len(labels))
+            rows = {row[0]: row for row in conn.execute(
+                f"SELECT label, chunk_id, text, metadata FROM chunks WHERE label IN ({placeholders})", labels
+            )}
+        return [
+            (rows[label][1], Document(page_content=rows[label][2], metadata=json.loads(rows[label][3])), distance)
+            for label, distance in zip(labels, distances) if label in rows
+        ]
+
+    def _scored_search(self, query, k, document_ids):
+        return [(document, distance) for _, document, distance in self._nearest(query, k, document_ids)]
+
+    def _dense_search(self, query, k, document_ids):
+        return [(chunk_id, document) for chunk_id, document, _ in self._nearest(query, k, document_ids)]
+
+    def get_all_documents(self):
+        try:
+            with closing(self._connect()) as conn:
+                rows = conn.execute("SELECT chunk_id, text, metadata FROM chunks ORDER BY label").fetchall()
+            return {
+                "ids": [row[0] for row in rows],
+                "documents": [row[1] for row in rows],
+                "metadatas": [json.loads(row[2]) for row in rows],
+            }
+        except Exception as e:
+            print(f"Error retrieving documents: {e}")
+            return {"ids": [], "documents": [], "metadatas": []}
@@ -0,0 +1,161 @@
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.config import ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_SIMILARITY
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants share a key."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+
+
+def _digest(*parts):
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def _scope_key(document_ids):
+    return ",".join(sorted(document_ids)) if document_ids else "*"
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """Return the live (key, value) pairs."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires, value) in self._entries.items() if expires >= now]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AnswerCache:
+    """Caches query results in front of QueryProcessor, whole responses and individual stages.
+
+    - Full responses are keyed by the normalized query, the document scope and the
+      corpus version, which changes on every ingest. With a query embedding, a
+      near-duplicate query (cosine similarity >= similarity_threshold) over the
+      same scope and version is also served from the cache.
+    - Per-document extractions are keyed by query, document id, the document's
+      content hash and a digest of the packed chunks sent to the LLM, so an
+      unchanged document's answer is reused after other documents changed, but
+      not for a different set of retrieved chunks (another scope or top_k).
+    - Themes and the synthesized answer are keyed by the query and the exact set
+      of document answers they were built from.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY):
+        self.similarity_threshold = similarity_threshold
+        self.responses = TTLCache(max_entries, ttl)
+        self.extractions = TTLCache(max_entries * 10, ttl)
+        self.stages = TTLCache(max_entries * 2, ttl)
+        self.semantic_hits = 0
+
+    def response_key(self, query, document_ids, corpus_version):
+        return _digest(normalize_query(query), _scope_key(document_ids), str(corpus_version))
+
+    def get_response(self, query, document_ids, corpus_version, query_vector=None):
+        """Return a cached response for this query or a near-duplicate of it, or None."""
+        entry = self.responses.get(self.response_key(query, document_ids, corpus_version))
+        if entry is not None:
+            return entry["response"].model_copy(deep=True)
+        if query_vector is None or not self.similarity_threshold:
+            return None
+
+        # Near-duplicate lookup over responses for the same scope and corpus version
+        scope = _scope_key(document_ids)
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        best, best_score = None, self.similarity_threshold
+        for _, candidate in self.responses.items():
+            if candidate["scope"] != scope or candidate["version"] != corpus_version or candidate["vector"] is None:
+                continue
+            score = float(np.dot(candidate["vector"], query_vector))
+            if score >= best_score:
+                best, best_score = candidate, score
+        if best is None:
+            return None
+        self.semantic_hits += 1
+        return best["response"].model_copy(deep=True)
+
+    def put_response(self, query, document_ids, corpus_version, response, query_vector=None):
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+        self.responses.put(self.response_key(query, document_ids, corpus_version), {
+            "scope": _scope_key(document_ids),
+            "version": corpus_version,
+            "vector": vector,
+            "response": response.model_copy(deep=True),
+        })
+
+    def _extraction_key(self, query, doc_id, doc_version, chunks):
+        return _digest(normalize_query(query), doc_id, doc_version, json.dumps(list(chunks)))
+
+    def get_extraction(self, query, doc_id, doc_version, chunks):
+        """Return the cached answer of a document version for the query and these packed chunks, or None."""
+        if not doc_version:
+            return None
+        response = self.extractions.get(self._extraction_key(query, doc_id, doc_version, chunks))
+        return response.model_copy() if response is not None else None
+
+    def put_extraction(self, query, doc_id, doc_version, chunks, response):
+        if doc_version:
+            self.extractions.put(self._extraction_key(query, doc_id, doc_version, chunks), response.model_copy())
+
+    def _stage_key(self, stage, query, *inputs):
+        payload = json.dumps([[item.model_dump() for item in items] for items in inputs], sort_keys=True)
+        return _digest(stage, normalize_query(query), payload)
+
+    def get_stage(self, stage, query, *inputs):
+        """Return the cached output of a stage (themes, synthesis) computed from the same inputs."""
+        return self.stages.get(self._stage_key(stage, query, *inputs))
+
+    def put_stage(self, stage, query, *inputs, value):
+        self.stages.put(self._stage_key(stage, query, *inputs), value)
+
+    def stats(self):
+        return {
+            "responses": {"entries": len(self.responses), "hits": self.responses.hits,
+                          "misses": self.responses.misses, "semantic_hits": self.semantic_hits},
+            "extractions": {"entries": len(self.extractions), "hits": self.extractions.hits,
+                            "misses": self.extractions.misses},
+            "stages": {"entries": len(self.stages), "hits": self.stages.hits, "misses": self.stages.misses},
+        }
@@ -0,0 +1,110 @@
+import asyncio
+
+from app.config import CHROMA_WRITE_BATCH_SIZE, BULK_WRITE_MAX_DELAY
+from app.services.executors import PoolSaturatedError
+
+
+class BulkWriter:
+    """Collects chunks from concurrent ingestion jobs and writes them to the vector store in large batches.
+
+    Each add() returns a future that resolves once those chunks are embedded and
+    stored. A batch is written when it reaches batch_size chunks or when it has
+    waited max_delay seconds, so a multi-file upload turns into a few large
+    embedding calls and Chroma writes instead of one small write per file.
+    If a combined write fails, each job's chunks are written again on their
+    own, so a bad chunk or a transient error only fails the jobs it affects.
+    """
+
+    def __init__(self, vector_store, io_pool, batch_size=CHROMA_WRITE_BATCH_SIZE, max_delay=BULK_WRITE_MAX_DELAY):
+        self.vector_store = vector_store
+        self.io_pool = io_pool
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._chunks = []
+        self._ids = []
+        self._futures = []
+        # Number of chunks each queued future covers, in order
+        self._sizes = []
+        self._flush_lock = None
+        self._timer = None
+
+    async def add(self, chunks, ids):
+        """Queue chunks for writing and return a future for their completion.
+
+        When the pending batch is full the caller waits for it to be written,
+        which keeps the number of chunks held in memory bounded.
+        """
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        future = loop.create_future()
+        self._chunks.extend(chunks)
+        self._ids.extend(ids)
+        self._futures.append(future)
+        self._sizes.append(len(ids))
+
+        if len(self._chunks) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, lambda: asyncio.ensure_future(self.flush()))
+        return future
+
+    async def flush(self):
+        """Write everything queued so far."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._chunks:
+            return
+
+        chunks, ids, futures, sizes = self._chunks, self._ids, self._futures, self._sizes
+        self._chunks, self._ids, self._futures, self._sizes = [], [], [], []
+
+        async with self._flush_lock:
+            try:
+                await self._write(chunks, ids)
+            except Exception as e:
+                if len(futures) == 1:
+                    self._resolve(futures[0], error=e)
+                else:
+                    await self._write_each(chunks, ids, futures, sizes)
+            else:
+                for future in futures:
+                    self._resolve(future, len(chunks))
+
+    async def _write_each(self, chunks, ids, futures, sizes):
+        """Write each job's chunks on its own after the combined write failed."""
+        start = 0
+        for future, size in zip(futures, sizes):
+            end = start + size
+            try:
+                await self._write(chunks[start:end], ids[start:end])
+            except Exception as e:
+                self._resolve(future, error=e)
+            else:
+                self._resolve(future, size)
+            start = end
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _write(self, chunks, ids):
+        while True:
+            try:
+                return await self.io_pool.run(self.vector_store.upsert_documents, chunks, ids)
+            except PoolSaturatedError:
+                # Chunks already accepted must not be dropped; wait for the pool to drain
+                await asyncio.sleep(self.max_delay)
+
+    async def close(self):
+        """Write any remaining chunks and persist the collection."""
+        if self._flush_lock is not None:
+            await self.flush()
+        await asyncio.to_thread(self.vector_store.persist)
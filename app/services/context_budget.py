@@ -0,0 +1,158 @@
+import re
+import threading
+
+from app.config import (
+    CONTEXT_TOKENIZER, EXTRACTION_CONTEXT_TOKENS, SYNTHESIS_CONTEXT_TOKENS, NEAR_DUPLICATE_THRESHOLD
+)
+
+# Characters per token assumed when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# A passage is only cut to fit the remaining budget if at least this many tokens are left
+MIN_TRUNCATED_TOKENS = 50
+
+
+def _load_encoding(name):
+    if not name:
+        return None
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        print(f"Error loading tokenizer {name}, approximating token counts: {e}")
+        return None
+
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def merge_chunks(documents):
+    """Merge chunks of one document that overlap in the source text into passages.
+
+    Chunks carry the page and the start_index of their text within the page, so
+    chunks split with CHUNK_OVERLAP are stitched back together instead of sending
+    the overlapping text twice. Returns (rank, page, text) tuples in reading order,
+    where rank is the best retrieval rank of the chunks in the passage.
+    """
+    positioned, passages = [], []
+    for rank, document in enumerate(documents):
+        start = document.metadata.get("start_index")
+        if start is None:
+            # Chunks from before start offsets were recorded cannot be merged
+            passages.append([rank, document.metadata.get("page"), None, document.page_content])
+        else:
+            positioned.append((document.metadata.get("page") or 0, start, rank, document))
+
+    positioned.sort(key=lambda item: (item[0], item[1]))
+    current = None
+    for page, start, rank, document in positioned:
+        text = document.page_content
+        if current is not None and current[1] == page and start <= current[2]:
+            end = start + len(text)
+            if end > current[2]:
+                current[3] += text[current[2] - start:]
+                current[2] = end
+            current[0] = min(current[0], rank)
+            continue
+        current = [rank, page, start + len(text), text]
+        passages.append(current)
+    return [(rank, page, text) for rank, page, _, text in passages]
+
+
+def drop_near_duplicates(texts, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Return the indexes of texts to keep, skipping any text too similar to an earlier one."""
+    kept, kept_shingles = [], []
+    for i, text in enumerate(texts):
+        shingles = _shingles(text)
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(i)
+        kept_shingles.append(shingles)
+    return kept
+
+
+class ContextBudget:
+    """Packs retrieved text into LLM prompts under a token budget per stage.
+
+    Overlapping chunks are merged, near-duplicate passages dropped and what is
+    left is cut to the stage's budget, least relevant text first. Token counts
+    before and after packing are kept per stage.
+    """
+
+    def __init__(self, extraction_tokens=EXTRACTION_CONTEXT_TOKENS, synthesis_tokens=SYNTHESIS_CONTEXT_TOKENS,
+                 tokenizer=CONTEXT_TOKENIZER):
+        self.budgets = {"extraction": extraction_tokens, "themes": synthesis_tokens, "synthesis": synthesis_tokens}
+        self.encoding = _load_encoding(tokenizer)
+        # What the token counts in the stats come from
+        self.tokenizer = tokenizer if self.encoding is not None else "approximate"
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def count_tokens(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return -(-len(text) // CHARS_PER_TOKEN)
+
+    def _truncate(self, text, tokens):
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:tokens])
+        return text[:tokens * CHARS_PER_TOKEN]
+
+    def _fit(self, stage, ranked_texts):
+        """Keep texts in rank order until the stage budget is used up; return the kept indexes and texts."""
+        budget = self.budgets[stage]
+        kept, used = {}, 0
+        for i, text in ranked_texts:
+            tokens = self.count_tokens(text)
+            if used + tokens <= budget:
+                kept[i] = text
+                used += tokens
+            elif budget - used >= MIN_TRUNCATED_TOKENS:
+                kept[i] = self._truncate(text, budget - used)
+                used = budget
+            else:
+                break
+        return kept
+
+    def _record(self, stage, tokens_before, tokens_after):
+        with self._lock:
+            stats = self._stats.setdefault(stage, {"calls": 0, "tokens_before": 0, "tokens_sent": 0})
+            stats["calls"] += 1
+            stats["tokens_before"] += tokens_before
+            stats["tokens_sent"] += tokens_after
+
+    def pack_chunks(self, documents):
+        """Turn one document's retrieved chunks (in retrieval order) into page-labelled passages for extraction."""
+        def label(page, text):
+            return f"[Page {page}] {text}" if page else text
+
+        before = sum(self.count_tokens(label(d.metadata.get("page"), d.page_content)) for d in documents)
+        passages = merge_chunks(documents)
+        keep = drop_near_duplicates([text for _, _, text in passages])
+        passages = [passages[i] for i in keep]
+
+        by_rank = sorted(range(len(passages)), key=lambda i: passages[i][0])
+        kept = self._fit("extraction", [(i, label(passages[i][1], passages[i][2])) for i in by_rank])
+        packed = [kept[i] for i in range(len(passages)) if i in kept]
+        self._record("extraction", before, sum(self.count_tokens(text) for text in packed))
+        return packed
+
+    def pack_texts(self, stage, texts):
+        """Drop near-duplicates from texts (most relevant first) and cut them to the stage budget."""
+        before = sum(self.count_tokens(text) for text in texts)
+        keep = drop_near_duplicates(texts)
+        kept = self._fit(stage, [(i, texts[i]) for i in keep])
+        packed = [kept[i] for i in keep if i in kept]
+        self._record(stage, before, sum(self.count_tokens(text) for text in packed))
+        return packed
+
+    def stats(self):
+        with self._lock:
+            return {
+                stage: dict(stats, tokens_saved=stats["tokens_before"] - stats["tokens_sent"])
+                for stage, stats in self._stats.items()
+            }
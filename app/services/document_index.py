@@ -0,0 +1,275 @@
+import os
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+
+from app.config import DOCUMENT_INDEX_PATH
+
+
+class DocumentIndex:
+    """Content-addressed catalog of ingested documents and the hashes of their chunks.
+
+    Documents are looked up by the SHA-256 of the uploaded file, so identical
+    uploads are detected before any extraction or embedding. The chunk hashes
+    let a modified re-upload embed only the chunks that changed. Per-document
+    stats (size, pages, chunks, ingest time) are kept here so documents can be
+    listed without reading the vector store.
+    """
+
+    def __init__(self, db_path=DOCUMENT_INDEX_PATH):
+        self.db_path = str(db_path)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size_bytes INTEGER,
+                    path TEXT,
+                    processed_path TEXT,
+                    page_count INTEGER,
+                    chunk_count INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    doc_id TEXT NOT NULL
+                )
+            """)
+            self._add_stats_columns(conn)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('corpus_version', 0)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'document_count', COUNT(*) FROM documents")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_filename ON documents (filename, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_listing ON documents (updated_at, doc_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc_id)")
+
+    @staticmethod
+    def _add_stats_columns(conn):
+        """Add the page and chunk count columns to indexes created before they existed."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+        if "page_count" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN page_count INTEGER")
+        if "chunk_count" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN chunk_count INTEGER")
+            conn.execute(
+                "UPDATE documents SET chunk_count = (SELECT COUNT(*) FROM chunks WHERE chunks.doc_id = documents.doc_id)"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def find_by_sha256(self, sha256):
+        """Return the document whose file has this content hash, if any."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM documents WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_filename(self, filename):
+        """Return the most recently ingested document with this filename, if any."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT * FROM documents WHERE filename = ? ORDER BY updated_at DESC LIMIT 1", (filename,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_document(self, doc_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return dict(row) if row else None
+
+    def chunk_ids(self, doc_id):
+        """Return the ids of the chunks currently stored for a document."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall()
+        return {row["chunk_id"] for row in rows}
+
+    def corpus_version(self):
+        """Return a counter that changes whenever any document is added, replaced or removed."""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT value FROM meta WHERE key = 'corpus_version'").fetchone()["value"]
+
+    def document_versions(self, doc_ids):
+        """Return {doc_id: sha256} for the given documents that are in the index."""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return {}
+        with closing(self._connect()) as conn:
+            placeholders = ",".join("?" * len(doc_ids))
+            rows = conn.execute(
+                f"SELECT doc_id, sha256 FROM documents WHERE doc_id IN ({placeholders})", doc_ids
+            ).fetchall()
+        return {row["doc_id"]: row["sha256"] for row in rows}
+
+    def document_count(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT value FROM meta WHERE key = 'document_count'").fetchone()["value"]
+
+    def list_documents(self, limit=100, cursor=None):
+        """Return a page of documents, most recently ingested first, and the cursor of the next page.
+
+        The cursor encodes the position of the last document returned, so every
+        page is a range scan of the listing index however deep it is.
+        """
+        with closing(self._connect()) as conn:
+            if cursor:
+                updated_at, doc_id = self._parse_cursor(cursor)
+                rows = conn.execute("""
+                    SELECT * FROM documents WHERE (updated_at, doc_id) < (?, ?)
+                    ORDER BY updated_at DESC, doc_id DESC LIMIT ?
+                """, (updated_at, doc_id, limit + 1)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM documents ORDER BY updated_at DESC, doc_id DESC LIMIT ?", (limit + 1,)
+                ).fetchall()
+        documents = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = documents[-1]
+            next_cursor = f"{last['updated_at']!r}:{last['doc_id']}"
+        return documents, next_cursor
+
+    @staticmethod
+    def _parse_cursor(cursor):
+        updated_at, sep, doc_id = cursor.partition(":")
+        try:
+            if not sep:
+                raise ValueError
+            return float(updated_at), doc_id
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor}")
+
+    def save_document(self, doc, sha256, size_bytes, chunk_ids, page_count=None):
+        """Insert or replace a document, its stats and the full set of its chunk ids in one transaction."""
+        now = time.time()
+        chunk_ids = list(chunk_ids)
+        with closing(self._connect()) as conn, conn:
+            exists = conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc["id"],)).fetchone()
+            conn.execute("""
+                INSERT INTO documents (
+                    doc_id, filename, sha256, size_bytes, path, processed_path, page_count, chunk_count,
+                    created_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET
+                    filename = excluded.filename, sha256 = excluded.sha256, size_bytes = excluded.size_bytes,
+                    path = excluded.path, processed_path = excluded.processed_path,
+                    page_count = excluded.page_count, chunk_count = excluded.chunk_count,
+                    updated_at = excluded.updated_at
+            """, (
+                doc["id"], doc["filename"], sha256, size_bytes, doc["path"], doc["processed_path"],
+                page_count, len(chunk_ids), now, now
+            ))
+            if not exists:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'document_count'")
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc["id"],))
+            conn.executemany(
+                "INSERT INTO chunks (chunk_id, doc_id) VALUES (?, ?)",
+                [(chunk_id, doc["id"]) for chunk_id in chunk_ids]
+            )
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'corpus_version'")
+
+    def delete_documents(self, doc_ids):
+        """Remove documents and their chunk ids in one transaction; return the rows that were removed."""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return []
+        with closing(self._connect()) as conn, conn:
+            placeholders = ",".join("?" * len(doc_ids))
+            rows = [dict(row) for row in conn.execute(
+                f"SELECT * FROM documents WHERE doc_id IN ({placeholders})", doc_ids
+            )]
+            if rows:
+                conn.execute(f"DELETE FROM documents WHERE doc_id IN ({placeholders})", doc_ids)
+                conn.execute(f"DELETE FROM chunks WHERE doc_id IN ({placeholders})", doc_ids)
+                conn.execute("UPDATE meta SET value = value - ? WHERE key = 'document_count'", (len(rows),))
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'corpus_version'")
+        return rows
+
+    def backfilled(self):
+        """Return whether the catalog was already filled in from the vector store (see backfill)."""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone() is not None
+
+    def backfill(self, chunks, exclude=()):
+        """Catalog the documents of stored chunks that have no entry, e.g. ingested before the catalog existed.
+
+        chunks yields (chunk_id, metadata) for every chunk in the vector store;
+        documents in exclude (still being ingested) are skipped. Runs once per
+        catalog, later calls add nothing. Returns the number of documents added.
+        """
+        if self.backfilled():
+            return 0
+        exclude = set(exclude)
+        documents = {}
+        for chunk_id, metadata in chunks:
+            doc_id = (metadata or {}).get("id")
+            if doc_id and doc_id not in exclude:
+                documents.setdefault(doc_id, (metadata, []))[1].append(chunk_id)
+
+        rows = []
+        for doc_id, (metadata, chunk_ids) in documents.items():
+            path = metadata.get("path")
+            sha256, size_bytes, updated_at = "", None, time.time()
+            if path and os.path.exists(path):
+                sha256, size_bytes, updated_at = self._file_hash(path), os.path.getsize(path), os.path.getmtime(path)
+            rows.append((
+                doc_id, metadata.get("filename") or doc_id, sha256, size_bytes, path, metadata.get("processed_path"),
+                len(chunk_ids), updated_at, updated_at
+            ))
+
+        added = 0
+        with closing(self._connect()) as conn, conn:
+            # Taken before re-checking the flag so two processes never backfill the same catalog
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone():
+                return 0
+            for row in rows:
+                inserted = conn.execute("""
+                    INSERT OR IGNORE INTO documents (
+                        doc_id, filename, sha256, size_bytes, path, processed_path, chunk_count, created_at, updated_at
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, row).rowcount
+                if inserted:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO chunks (chunk_id, doc_id) VALUES (?, ?)",
+                        [(chunk_id, row[0]) for chunk_id in documents[row[0]][1]]
+                    )
+                    added += 1
+            if added:
+                conn.execute("UPDATE meta SET value = value + ? WHERE key = 'document_count'", (added,))
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'corpus_version'")
+            conn.execute("INSERT INTO meta (key, value) VALUES ('backfilled', 1)")
+        return added
+
+    @staticmethod
+    def _file_hash(path):
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def all_documents(self):
+        """Return the id, paths and chunk count of every document, for consistency checks."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT doc_id, path, processed_path, chunk_count FROM documents").fetchall()
+        return [dict(row) for row in rows]
+
+    def chunk_refs(self):
+        """Yield (chunk_id, doc_id) for every chunk recorded for a document."""
+        with closing(self._connect()) as conn:
+            yield from conn.execute("SELECT chunk_id, doc_id FROM chunks")
+
+    def vacuum(self):
+        with closing(self._connect()) as conn:
+            conn.execute("VACUUM")
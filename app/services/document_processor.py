@@ -1,98 +1,376 @@
 import os
+import math
 import uuid
+import time
+import asyncio
+import hashlib
 
-import pytesseract
-from PIL import Image
-from pypdf import PdfReader
-import docx
+from app.config import (
+    UPLOAD_DIR, PROCESSED_DIR, CHUNK_SIZE, CHUNK_OVERLAP, PDF_OCR_FALLBACK, EXTRACTION_MIN_PAGES_PER_TASK,
+    UPLOAD_CHUNK_SIZE, MAX_UPLOAD_SIZE, TEXT_BLOCK_SIZE
+)
+from app.services.metrics import track_stage, record_stage
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".tiff", ".tif", ".bmp"]
 
-from app.config import UPLOAD_DIR, PROCESSED_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+# Document fields copied into every chunk's metadata
+CHUNK_METADATA_KEYS = ("id", "filename")
+
+
+class FileTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_SIZE."""
+
+
+class PageChunker:
+    """Splits pages into chunks as they arrive and appends each page to the processed text file.
+
+    Only the current page is held in memory, so documents of any size can be
+    chunked and sent to the vector store incrementally. Formats without pages
+    arrive as consecutive blocks of text; their chunks' start_index is an offset
+    into the whole text so overlapping chunks can still be merged at query time. The text is written to a
+    temporary file that replaces the processed file on commit(), so a failed
+    re-ingest keeps the previous version's text; leaving the context without
+    committing discards it.
+    """
+
+    def __init__(self, text_splitter, doc):
+        self.text_splitter = text_splitter
+        self.doc = doc
+        self.chunk_count = 0
+        self.page_count = None
+        self._seen_hashes = {}
+        self._offset = 0
+        self.temp_path = doc["processed_path"] + ".tmp"
+        self._committed = False
+        self._file = open(self.temp_path, "w", encoding="utf-8")
+
+    def add_page(self, page_number, page_text):
+        """Record one page and return its chunks tagged with the page number."""
+        if page_number is not None:
+            self.page_count = max(self.page_count or 0, page_number)
+        if not page_text.strip():
+            return []
+        with track_stage("ingest", "chunk"):
+            return self._chunk_page(page_number, page_text)
+
+    def _chunk_page(self, page_number, page_text):
+        if page_number is None:
+            self._file.write(page_text)
+        else:
+            self._file.write(f"Page {page_number}:\n{page_text}\n\n")
+
+        # Only what retrieval needs; paths and stats live in the document index
+        metadata = {key: self.doc[key] for key in CHUNK_METADATA_KEYS}
+        if page_number is not None:
+            metadata["page"] = page_number
+        chunks = self.text_splitter.create_documents([page_text], [metadata])
+        for chunk in chunks:
+            chunk.metadata["chunk_id"] = self._chunk_id(page_number, chunk.page_content)
+            if page_number is None and "start_index" in chunk.metadata:
+                chunk.metadata["start_index"] += self._offset
+        if page_number is None:
+            self._offset += len(page_text)
+        self.chunk_count += len(chunks)
+        return chunks
+
+    def _chunk_id(self, page_number, content):
+        """Derive a stable chunk id from the document id, page and chunk text.
+
+        Unchanged chunks keep their id when a modified file is re-ingested, so
+        only new ids need embedding. Repeated identical chunks get a counter suffix.
+        """
+        chunk_hash = hashlib.sha256(f"{page_number}\0{content}".encode("utf-8")).hexdigest()[:32]
+        occurrence = self._seen_hashes.get(chunk_hash, 0)
+        self._seen_hashes[chunk_hash] = occurrence + 1
+        suffix = f"-{occurrence}" if occurrence else ""
+        return f"{self.doc['id']}:{chunk_hash}{suffix}"
+
+    def close(self):
+        self._file.close()
+
+    def commit(self):
+        """Replace the processed text file with the text written so far."""
+        self.close()
+        os.replace(self.temp_path, self.doc["processed_path"])
+        self._committed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        if not self._committed and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
 
 
 class DocumentProcessor:
     """Service for processing various document types and extracting text content."""
 
     def __init__(self):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP
+            chunk_overlap=CHUNK_OVERLAP,
+            # Offsets within the page let overlapping chunks be merged again at query time
+            add_start_index=True
         )
 
-    def save_uploaded_file(self, file):
-        """Save an uploaded file to disk and return the file path."""
+    def save_uploaded_file(self, file, max_size=MAX_UPLOAD_SIZE):
+        """Stream an uploaded file to disk in fixed-size chunks.
+
+        Returns the file path, its unique name, the SHA-256 of its content and its
+        size in bytes. Raises FileTooLargeError (and removes the partial file) once
+        more than max_size bytes have been read.
+        """
         file_ext = os.path.splitext(file.filename)[1].lower()
         unique_filename = f"{uuid.uuid4()}{file_ext}"
         file_path = UPLOAD_DIR / unique_filename
 
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with track_stage("ingest", "save"), open(file_path, "wb") as f:
+                while True:
+                    block = file.file.read(UPLOAD_CHUNK_SIZE)
+                    if not block:
+                        break
+                    size += len(block)
+                    if size > max_size:
+                        raise FileTooLargeError(
+                            f"{file.filename} is larger than the {max_size // (1024 * 1024)} MB upload limit"
+                        )
+                    sha256.update(block)
+                    f.write(block)
+        except BaseException:
+            file_path.unlink(missing_ok=True)
+            raise
 
-        return file_path, unique_filename
+        return file_path, unique_filename, sha256.hexdigest(), size
 
     def process_document(self, file):
         """Process a document file and extract text content."""
-        file_path, unique_id = self.save_uploaded_file(file)
+        file_path, unique_id, _, _ = self.save_uploaded_file(file)
         file_ext = os.path.splitext(file.filename)[1].lower()
+        pages = self.iter_pages(str(file_path), file_ext)
+        return self.build_document(pages, file_path, unique_id, file.filename)
+
+    async def aiter_pages(self, file_path, file_ext, cpu_pool):
+        """Extract pages on the CPU pool and yield them in order as each page range finishes.
 
+        Paged formats (PDF, multi-page TIFF) are split into page ranges that are
+        extracted in parallel across the pool's workers. Text files need no parsing
+        and are read block by block on a thread instead.
+        """
+        if DocumentProcessor.format_name(file_ext) == "text":
+            async for page in DocumentProcessor._aiter_text_blocks(file_path, file_ext):
+                yield page
+            return
+
+        page_count = await cpu_pool.run(DocumentProcessor.count_pages, file_path, file_ext)
+        if not page_count:
+            ranges = [(0, None)]
+        else:
+            tasks = max(1, min(cpu_pool.workers * 2, math.ceil(page_count / EXTRACTION_MIN_PAGES_PER_TASK)))
+            pages_per_task = math.ceil(page_count / tasks)
+            ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+        # Keep only one range per worker in flight so extracted pages that the
+        # consumer has not reached yet do not pile up in memory
+        def submit(page_range):
+            start, stop = page_range
+            return asyncio.ensure_future(
+                cpu_pool.run(DocumentProcessor.timed_extract_page_range, file_path, file_ext, start, stop)
+            )
+
+        stage = f"extract_{DocumentProcessor.format_name(file_ext)}"
+        pending = [submit(page_range) for page_range in ranges[:cpu_pool.workers]]
+        next_range = len(pending)
+        try:
+            while pending:
+                seconds, pages = await pending.pop(0)
+                record_stage("ingest", stage, time.perf_counter() - seconds, seconds)
+                if next_range < len(ranges):
+                    pending.append(submit(ranges[next_range]))
+                    next_range += 1
+                for page in pages:
+                    yield page
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    async def _aiter_text_blocks(file_path, file_ext):
+        # Only one block is read ahead of the consumer
+        blocks = DocumentProcessor.iter_pages(file_path, file_ext)
+        try:
+            while True:
+                start = time.perf_counter()
+                block = await asyncio.to_thread(next, blocks, None)
+                if block is None:
+                    return
+                record_stage("ingest", "extract_text", start, time.perf_counter() - start)
+                yield block
+        finally:
+            blocks.close()
+
+    @staticmethod
+    def count_pages(file_path, file_ext):
+        """Return the number of pages of a paged format, or None for formats without pages."""
+        if file_ext == ".pdf":
+            from pypdf import PdfReader
+
+            return len(PdfReader(file_path).pages)
+        elif file_ext in IMAGE_EXTENSIONS:
+            from PIL import Image
+
+            with Image.open(file_path) as image:
+                return getattr(image, "n_frames", 1)
+        return None
+
+    @staticmethod
+    def extract_page_range(file_path, file_ext, start, stop):
+        """Extract pages [start, stop) as a list; a static method so it can run in a process pool."""
+        try:
+            return list(DocumentProcessor.iter_pages(file_path, file_ext, start, stop))
+        except Exception as e:
+            # Some library exceptions (e.g. pytesseract's) cannot be unpickled, which would break the whole pool
+            raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+    @staticmethod
+    def timed_extract_page_range(file_path, file_ext, start, stop):
+        """Like extract_page_range, but also return the seconds the worker spent extracting."""
+        started = time.perf_counter()
+        pages = DocumentProcessor.extract_page_range(file_path, file_ext, start, stop)
+        return time.perf_counter() - started, pages
+
+    @staticmethod
+    def format_name(file_ext):
+        """Group a file extension into the format name used in extraction metrics."""
+        if file_ext in (".pdf", ".docx"):
+            return file_ext[1:]
+        if file_ext in IMAGE_EXTENSIONS:
+            return "image"
+        return "text"
+
+    @staticmethod
+    def iter_pages(file_path, file_ext, start=0, stop=None):
+        """Lazily yield (page_number, text) for a saved file.
+
+        page_number is 1-based, or None for formats without pages (DOCX, plain text),
+        which are yielded as consecutive blocks of about TEXT_BLOCK_SIZE characters.
+        """
         if file_ext == ".pdf":
-            text = self._extract_text_from_pdf(file_path)
+            yield from DocumentProcessor._iter_pdf_pages(file_path, start, stop)
         elif file_ext == ".docx":
-            text = self._extract_text_from_docx(file_path)
-        elif file_ext in [".png", ".jpg", ".jpeg", ".tiff", ".bmp"]:
-            text = self._extract_text_from_image(file_path)
+            for block in DocumentProcessor._iter_docx_blocks(file_path):
+                yield None, block
+        elif file_ext in IMAGE_EXTENSIONS:
+            yield from DocumentProcessor._iter_image_pages(file_path, start, stop)
         elif file_ext in [".txt", ".csv", ".md", ".json", ".log"]:
             # For text-like files just read text
-            text = self._extract_text_from_text_file(file_path)
+            for block in DocumentProcessor._iter_text_blocks(file_path):
+                yield None, block
         else:
             # For unsupported types, try to read as text or raise error
             try:
-                text = self._extract_text_from_text_file(file_path)
+                blocks = DocumentProcessor._iter_text_blocks(file_path)
+                block = next(blocks, None)
             except Exception:
                 raise ValueError(f"Unsupported file type: {file_ext}")
+            while block is not None:
+                yield None, block
+                block = next(blocks, None)
 
-        text_file_path = PROCESSED_DIR / f"{unique_id}.txt"
-        with open(text_file_path, "w", encoding="utf-8") as f:
-            f.write(text)
-
-        doc = {
+    def new_document(self, file_path, unique_id, filename):
+        """Return the metadata record for a document; its CHUNK_METADATA_KEYS are copied into every chunk."""
+        return {
             "id": unique_id,
-            "filename": file.filename,
-            "text": text,
+            "filename": filename,
             "path": str(file_path),
-            "processed_path": str(text_file_path)
+            "processed_path": str(PROCESSED_DIR / f"{unique_id}.txt")
         }
 
-        chunks = self._chunk_text(text, doc)
+    def chunker(self, doc):
+        """Return a PageChunker that writes doc's processed text and chunks it page by page."""
+        return PageChunker(self.text_splitter, doc)
 
+    def build_document(self, pages, file_path, unique_id, filename):
+        """Store the extracted pages and split them into chunks tagged with their page number."""
+        doc = self.new_document(file_path, unique_id, filename)
+        chunks = []
+        with self.chunker(doc) as chunker:
+            for page_number, page_text in pages:
+                chunks.extend(chunker.add_page(page_number, page_text))
+            chunker.commit()
         return doc, chunks
 
-    def _extract_text_from_pdf(self, file_path):
-        text = ""
+    # Extraction libraries are imported on first use to keep app startup light
+
+    @staticmethod
+    def _iter_pdf_pages(file_path, start=0, stop=None):
+        from pypdf import PdfReader
+
         reader = PdfReader(file_path)
-        for i, page in enumerate(reader.pages):
+        for i in range(start, len(reader.pages) if stop is None else stop):
+            page = reader.pages[i]
             page_text = page.extract_text() or ""
-            if page_text.strip():
-                text += f"Page {i+1}:\n{page_text}\n\n"
-        return text
+            if not page_text.strip() and PDF_OCR_FALLBACK:
+                page_text = DocumentProcessor._ocr_pdf_page(page)
+            yield i + 1, page_text
+
+    @staticmethod
+    def _ocr_pdf_page(page):
+        """OCR the images embedded in a page that has no text layer, as scanned pages do."""
+        import pytesseract
+
+        texts = []
+        try:
+            for image in page.images:
+                texts.append(pytesseract.image_to_string(image.image))
+        except Exception as e:
+            print(f"Error running OCR on PDF page: {e}")
+        return "\n".join(texts)
+
+    @staticmethod
+    def _iter_docx_blocks(file_path, block_size=TEXT_BLOCK_SIZE):
+        """Yield the paragraphs of a DOCX file grouped into blocks of about block_size characters."""
+        import docx
 
-    def _extract_text_from_docx(self, file_path):
         doc = docx.Document(file_path)
-        full_text = []
+        block, size = [], 0
         for para in doc.paragraphs:
-            full_text.append(para.text)
-        return "\n".join(full_text)
+            block.append(para.text + "\n")
+            size += len(block[-1])
+            if size >= block_size:
+                yield "".join(block)
+                block, size = [], 0
+        if block:
+            yield "".join(block)
 
-    def _extract_text_from_image(self, file_path):
-        image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
-        return text
+    @staticmethod
+    def _iter_image_pages(file_path, start=0, stop=None):
+        import pytesseract
+        from PIL import Image
 
-    def _extract_text_from_text_file(self, file_path):
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
+        # Multi-page TIFFs hold one frame per page; other images have a single frame
+        with Image.open(file_path) as image:
+            frame_count = getattr(image, "n_frames", 1)
+            for i in range(start, frame_count if stop is None else stop):
+                image.seek(i)
+                yield i + 1, pytesseract.image_to_string(image)
 
-    def _chunk_text(self, text, metadata):
-        docs = self.text_splitter.create_documents([text], [metadata])
-        return docs
+    @staticmethod
+    def _iter_text_blocks(file_path, block_size=TEXT_BLOCK_SIZE):
+        """Yield a text file in blocks of about block_size characters, cut at line ends where possible."""
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            block, size = [], 0
+            # Reading at most block_size characters per line bounds memory for files without newlines too
+            for line in iter(lambda: f.readline(block_size), ""):
+                block.append(line)
+                size += len(line)
+                if size >= block_size:
+                    yield "".join(block)
+                    block, size = [], 0
+            if block:
+                yield "".join(block)
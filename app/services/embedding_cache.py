@@ -0,0 +1,209 @@
+import os
+import re
+import fcntl
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.config import EMBEDDING_CACHE_DIR, EMBEDDING_QUERY_CACHE_SIZE
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Disk-backed embedding store keyed by (model name, text hash).
+
+    Vectors are appended as float32 rows to one file per model and read back
+    through a memory map; a SQLite index maps each text hash to its row. Appends
+    take an exclusive file lock, so several app processes can share the cache.
+    A partial row left by a crash is truncated before the next append, and a
+    row is indexed only after it has been written and synced.
+    """
+
+    def __init__(self, cache_dir=EMBEDDING_CACHE_DIR):
+        self.cache_dir = str(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_path = os.path.join(self.cache_dir, "index.db")
+        self._lock = threading.Lock()
+        self._maps = {}
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vectors (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    row INTEGER NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER NOT NULL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _vectors_path(self, model):
+        return os.path.join(self.cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model) + ".f32")
+
+    def _matrix(self, model, dim, rows_needed):
+        """Return a read-only memory map of the model's vectors covering at least rows_needed rows."""
+        matrix = self._maps.get(model)
+        if matrix is None or matrix.shape[0] < rows_needed:
+            path = self._vectors_path(model)
+            rows = os.path.getsize(path) // (dim * 4)
+            matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+            self._maps[model] = matrix
+        return matrix
+
+    @staticmethod
+    def _whole_rows(f, row_size):
+        """Truncate a partial row left by an interrupted append and return the row count."""
+        size = f.seek(0, os.SEEK_END)
+        if size % row_size:
+            print(f"Embedding cache: dropping {size % row_size} bytes of a partial row in {f.name}")
+            size -= size % row_size
+            f.truncate(size)
+        return size // row_size
+
+    def get_many(self, model, hashes):
+        """Return {text_hash: vector} for the hashes that are cached."""
+        if not hashes:
+            return {}
+        rows = {}
+        unique = list(set(hashes))
+        with closing(self._connect()) as conn:
+            dim = conn.execute("SELECT dim FROM models WHERE model = ?", (model,)).fetchone()
+            if dim is None:
+                return {}
+            dim = dim[0]
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(conn.execute(
+                    f"SELECT text_hash, row FROM vectors WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch)
+                ).fetchall())
+        if not rows:
+            return {}
+        with self._lock:
+            matrix = self._matrix(model, dim, max(rows.values()) + 1)
+            return {h: np.array(matrix[row]) for h, row in rows.items()}
+
+    def put_many(self, model, hashes, vectors):
+        """Append vectors for hashes that are not cached yet."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(hashes):
+            return
+        path = self._vectors_path(model)
+        with self._lock, open(path, "ab") as f, closing(self._connect()) as conn:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                known = set()
+                for start in range(0, len(hashes), 500):
+                    batch = hashes[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    known.update(h for (h,) in conn.execute(
+                        f"SELECT text_hash FROM vectors WHERE model = ? AND text_hash IN ({placeholders})",
+                        (model, *batch)
+                    ))
+                new = {}
+                for h, vector in zip(hashes, vectors):
+                    if h not in known and h not in new:
+                        new[h] = vector
+                if not new:
+                    return
+                row_size = vectors.shape[1] * 4
+                first_row = self._whole_rows(f, row_size)
+                try:
+                    f.write(np.stack(list(new.values())).astype(np.float32).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                except BaseException:
+                    # Drop whatever part of the batch reached the file so later rows stay aligned
+                    f.truncate(first_row * row_size)
+                    raise
+                # Rows are only indexed once they are fully on disk
+                with conn:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO models (model, dim) VALUES (?, ?)", (model, vectors.shape[1])
+                    )
+                    conn.executemany(
+                        "INSERT INTO vectors (model, text_hash, row) VALUES (?, ?, ?)",
+                        [(model, h, first_row + i) for i, h in enumerate(new)]
+                    )
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves previously seen texts without running the model.
+
+    Document texts go through the disk cache; query texts go through an in-memory
+    LRU, since the same question tends to be asked again shortly after.
+    """
+
+    def __init__(self, embeddings, model_name, cache=None, query_cache_size=EMBEDDING_QUERY_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        self.document_hits = 0
+        self.document_misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        cached = self.cache.get_many(self.model_name, hashes)
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(self.model_name, list(missing), vectors)
+            cached.update(zip(missing, (np.asarray(v, dtype=np.float32) for v in vectors)))
+
+        with self._lock:
+            self.document_misses += len(missing)
+            self.document_hits += len(texts) - len(missing)
+        return [cached[h].tolist() for h in hashes]
+
+    def embed_query(self, text):
+        h = text_hash(text)
+        with self._lock:
+            vector = self._queries.get(h)
+            if vector is not None:
+                self._queries.move_to_end(h)
+                self.query_hits += 1
+                return vector
+            self.query_misses += 1
+
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._queries[h] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "document_hits": self.document_hits,
+                "document_misses": self.document_misses,
+                "query_hits": self.query_hits,
+                "query_misses": self.query_misses,
+                "query_cache_entries": len(self._queries),
+            }
@@ -0,0 +1,114 @@
+import time
+import asyncio
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from app.services.metrics import QUEUE_WAIT_SECONDS
+
+
+class PoolSaturatedError(RuntimeError):
+    """Raised when a worker pool already holds its maximum number of pending jobs."""
+
+
+def _timed_call(fn, args, kwargs):
+    # Runs inside the worker; wall-clock time is comparable across processes
+    return time.time(), fn(*args, **kwargs)
+
+
+class WorkerPool:
+    """Bounded wrapper around a concurrent.futures executor for use from async code.
+
+    At most max_pending jobs may be queued or running at once; further submissions
+    are rejected with PoolSaturatedError so callers can shed load instead of queueing
+    without limit. Queue depth and queue wait times are tracked for monitoring.
+
+    With propagate_context (thread pools only), jobs run in a copy of the
+    caller's context, so stage timings recorded inside them join its trace.
+    """
+
+    def __init__(self, name, executor, workers, max_pending, propagate_context=False):
+        self.name = name
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.propagate_context = propagate_context
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and await its result."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PoolSaturatedError(f"The {self.name} worker pool is saturated")
+            self._pending += 1
+            self.submitted += 1
+
+        enqueued_at = time.time()
+        loop = asyncio.get_running_loop()
+        try:
+            if self.propagate_context:
+                call = loop.run_in_executor(
+                    self.executor, contextvars.copy_context().run, _timed_call, fn, args, kwargs
+                )
+            else:
+                call = loop.run_in_executor(self.executor, _timed_call, fn, args, kwargs)
+            started_at, result = await call
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+                self.failed += 1
+            raise
+
+        wait = max(0.0, started_at - enqueued_at)
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        QUEUE_WAIT_SECONDS.observe(wait, self.name)
+        return result
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed or 1
+            return {
+                "name": self.name,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._pending,
+                "queue_depth": max(0, self._pending - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds_avg": self.wait_seconds_total / finished,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_thread_pool(name, workers, max_pending):
+    """Create a pool for blocking I/O such as file writes, Chroma calls and embedding."""
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return WorkerPool(name, executor, workers, max_pending, propagate_context=True)
+
+
+def create_process_pool(name, workers, max_pending):
+    """Create a pool for CPU-bound work such as PDF parsing and OCR.
+
+    Workers are spawned rather than forked so they do not inherit the parent's
+    model threads and locks; functions submitted must be importable at module level.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return WorkerPool(name, executor, workers, max_pending)
@@ -0,0 +1,395 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+from contextlib import closing
+
+from app.config import INGEST_DB_PATH, INGEST_MAX_ATTEMPTS, INGEST_POLL_INTERVAL, INGEST_BATCH_SIZE, INGEST_LEASE_SECONDS
+from app.services.executors import PoolSaturatedError
+from app.services.metrics import QUEUE_WAIT_SECONDS, start_trace, finish_trace, track_stage
+
+
+class IngestionQueue:
+    """Persistent SQLite queue of uploaded files waiting to be extracted and indexed.
+
+    Several app processes can share the queue. A claimed job is leased to the
+    claiming queue's owner id until lease_until; the owner renews its leases while
+    it is alive, and a job whose lease expired is put back in the queue.
+    """
+
+    def __init__(self, db_path=INGEST_DB_PATH, lease_seconds=INGEST_LEASE_SECONDS):
+        self.db_path = str(db_path)
+        self.lease_seconds = lease_seconds
+        self.owner = str(uuid.uuid4())
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    batch_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    sha256 TEXT,
+                    size_bytes INTEGER,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    chunk_count INTEGER,
+                    reused_chunk_count INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    extract_seconds REAL,
+                    index_seconds REAL
+                )
+            """)
+            # Columns added after the first release of the queue
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (
+                ("sha256", "TEXT"), ("size_bytes", "INTEGER"), ("reused_chunk_count", "INTEGER"),
+                ("owner", "TEXT"), ("lease_until", "REAL")
+            ):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def enqueue(self, batch_id, filename, file_path, doc_id, sha256=None, size_bytes=None, status="queued"):
+        """Add a saved upload to the queue and return its job.
+
+        Uploads already known to be duplicates are recorded with status "duplicate"
+        so they show up in the batch without being processed.
+        """
+        job_id = str(uuid.uuid4())
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, batch_id, filename, file_path, doc_id, sha256, size_bytes, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, batch_id, filename, str(file_path), doc_id, sha256, size_bytes, status, time.time())
+            )
+        return self.get_job(job_id)
+
+    def claim_next(self):
+        """Atomically move the oldest queued job to running and return it, or None if none can run.
+
+        Jobs of a document that already has a running job wait for it, so two
+        versions of a document are never ingested at the same time. So do jobs
+        whose file has the same content hash as a running job: once that job is
+        done, the worker finds the file in the catalog and marks it a duplicate.
+        """
+        with closing(self._connect()) as conn:
+            # BEGIN IMMEDIATE takes the write lock so two workers (or processes) never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                self._requeue_expired(conn, now)
+                row = conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'queued' "
+                    "AND doc_id NOT IN (SELECT doc_id FROM jobs WHERE status = 'running') "
+                    "AND (sha256 IS NULL OR sha256 NOT IN "
+                    "(SELECT sha256 FROM jobs WHERE status = 'running' AND sha256 IS NOT NULL)) "
+                    "ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1, "
+                    "owner = ?, lease_until = ? WHERE job_id = ?",
+                    (now, self.owner, now + self.lease_seconds, row["job_id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get_job(row["job_id"])
+
+    def mark_done(self, job_id, chunk_count, extract_seconds, index_seconds, reused_chunk_count=0):
+        self._update(
+            job_id, status="done", error=None, chunk_count=chunk_count, reused_chunk_count=reused_chunk_count,
+            finished_at=time.time(), extract_seconds=extract_seconds, index_seconds=index_seconds
+        )
+
+    def mark_duplicate(self, job_id, doc_id):
+        """Finish a job whose file content is already indexed as doc_id."""
+        self._update(job_id, status="duplicate", doc_id=doc_id, finished_at=time.time())
+
+    def mark_failed(self, job_id, error, retry):
+        """Record a failure; the job goes back to the queue while retry is true."""
+        if retry:
+            self._update(job_id, status="queued", error=error)
+        else:
+            self._update(job_id, status="failed", error=error, finished_at=time.time())
+
+    def release(self, job_id):
+        """Return a claimed job to the queue without counting the attempt."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1 WHERE job_id = ?", (job_id,)
+            )
+
+    def renew_leases(self):
+        """Extend the lease of every job this queue's owner is running; returns how many were renewed."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE status = 'running' AND owner = ?",
+                (time.time() + self.lease_seconds, self.owner)
+            ).rowcount
+
+    def requeue_interrupted(self):
+        """Put running jobs whose lease expired back in the queue; returns how many were requeued.
+
+        Jobs of other processes that are still alive keep running.
+        """
+        with closing(self._connect()) as conn:
+            return self._requeue_expired(conn, time.time())
+
+    @staticmethod
+    def _requeue_expired(conn, now):
+        # Jobs claimed before leases existed have no lease_until and count as expired
+        return conn.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL "
+            "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+            (now,)
+        ).rowcount
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def get_job(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def active_jobs(self):
+        """Return the doc_id and file_path of every job that is queued or running."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT doc_id, file_path FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_jobs(self, batch_id=None, status=None, limit=100):
+        query = "SELECT * FROM jobs"
+        conditions, params = [], []
+        if batch_id:
+            conditions.append("batch_id = ?")
+            params.append(batch_id)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at LIMIT ?"
+        params.append(limit)
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+
+class IngestionWorker:
+    """Drains the ingestion queue with a fixed number of asyncio tasks.
+
+    Each job runs text extraction on the CPU pool and embedding and the Chroma
+    writes on the I/O pool, so the event loop stays free while a backlog drains.
+    Pages are chunked as they are extracted and handed to the shared BulkWriter in
+    batches of batch_size chunks, which bounds the memory a single document can
+    take and lets chunks from concurrent jobs share embedding calls and writes.
+
+    Files whose content hash is already indexed are marked as duplicates without
+    being extracted. When a document is re-ingested, only chunks whose ids are not
+    already stored are embedded, and chunks missing from the new version are deleted.
+    The queue runs one job per document at a time, so the stored chunk ids read
+    at the start of a job are not changed by another version under way.
+    """
+
+    def __init__(self, queue, document_index, document_processor, vector_store, bulk_writer,
+                 cpu_pool, io_pool, concurrency, max_attempts=INGEST_MAX_ATTEMPTS,
+                 poll_interval=INGEST_POLL_INTERVAL, batch_size=INGEST_BATCH_SIZE):
+        self.queue = queue
+        self.document_index = document_index
+        self.document_processor = document_processor
+        self.vector_store = vector_store
+        self.bulk_writer = bulk_writer
+        self.cpu_pool = cpu_pool
+        self.io_pool = io_pool
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._tasks = []
+        self._wakeup = None
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._renew_leases()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after new jobs were enqueued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            # Cleared before claiming so a notify() that races with an empty claim is not lost
+            self._wakeup.clear()
+            try:
+                job = await self._queue_call(self.queue.claim_next)
+            except Exception as e:
+                print(f"Error reading ingestion queue: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job["attempts"] == 1:
+                QUEUE_WAIT_SECONDS.observe(max(0.0, job["started_at"] - job["created_at"]), "ingest")
+            # Stage timings of the job are kept as a trace under the job id
+            trace, token = start_trace(job["job_id"])
+            try:
+                with track_stage("ingest", "document"):
+                    await self._process(job)
+            finally:
+                finish_trace(trace, token)
+
+    async def _renew_leases(self):
+        try:
+            requeued = await self._queue_call(self.queue.requeue_interrupted)
+            if requeued:
+                print(f"Resuming {requeued} interrupted ingestion jobs")
+        except Exception as e:
+            print(f"Error requeuing interrupted ingestion jobs: {e}")
+        # Renewed well before expiry so a slow renewal does not hand running jobs to another process
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await self._queue_call(self.queue.renew_leases)
+            except Exception as e:
+                print(f"Error renewing ingestion job leases: {e}")
+
+    async def _queue_call(self, fn, *args):
+        # Queue bookkeeping must not be dropped when the I/O pool is saturated
+        return await asyncio.to_thread(fn, *args)
+
+    async def _process(self, job):
+        added_ids = []
+        writes = []
+        try:
+            duplicate = await self._find_duplicate(job)
+            if duplicate is not None:
+                await self._queue_call(self.queue.mark_duplicate, job["job_id"], duplicate["doc_id"])
+                if duplicate["path"] != job["file_path"]:
+                    os.remove(job["file_path"])
+                return
+            extract_seconds, index_seconds, chunk_count, reused_count = await self._ingest(job, added_ids, writes)
+        except PoolSaturatedError:
+            await self._discard_partial(job, added_ids, writes)
+            await self._queue_call(self.queue.release, job["job_id"])
+            await asyncio.sleep(self.poll_interval)
+            return
+        except Exception as e:
+            print(f"Error ingesting {job['filename']} (job {job['job_id']}): {e}")
+            await self._discard_partial(job, added_ids, writes)
+            retry = job["attempts"] < self.max_attempts
+            await self._queue_call(self.queue.mark_failed, job["job_id"], str(e), retry)
+            return
+
+        await self._queue_call(
+            self.queue.mark_done, job["job_id"], chunk_count, extract_seconds, index_seconds, reused_count
+        )
+
+    async def _find_duplicate(self, job):
+        # Also checked at upload time; repeated here for identical files queued before either was ingested.
+        # The queue never runs two jobs with the same hash at once, so the first one is cataloged by now
+        if not job["sha256"]:
+            return None
+        return await self._queue_call(self.document_index.find_by_sha256, job["sha256"])
+
+    async def _ingest(self, job, added_ids, writes):
+        file_ext = os.path.splitext(job["filename"])[1].lower()
+        doc = self.document_processor.new_document(job["file_path"], job["doc_id"], job["filename"])
+        previous = await self._queue_call(self.document_index.get_document, job["doc_id"])
+        existing_ids = await self._queue_call(self.document_index.chunk_ids, job["doc_id"])
+        current_ids = []
+        extract_seconds = 0.0
+        index_seconds = 0.0
+        batch = []
+
+        # The processed text only replaces the previous version's once the new one is fully indexed
+        with self.document_processor.chunker(doc) as chunker:
+            pages = self.document_processor.aiter_pages(job["file_path"], file_ext, self.cpu_pool)
+            start = time.perf_counter()
+            async for page_number, page_text in pages:
+                batch.extend(chunker.add_page(page_number, page_text))
+                extract_seconds += time.perf_counter() - start
+                if len(batch) >= self.batch_size:
+                    start = time.perf_counter()
+                    await self._write_batch(batch, existing_ids, current_ids, added_ids, writes)
+                    index_seconds += time.perf_counter() - start
+                    batch = []
+                start = time.perf_counter()
+
+            start = time.perf_counter()
+            if batch:
+                await self._write_batch(batch, existing_ids, current_ids, added_ids, writes)
+            # The document is only recorded once all of its chunks are stored
+            await asyncio.gather(*writes)
+            chunker.commit()
+            await self._queue_call(
+                self.document_index.save_document, doc, job["sha256"], job["size_bytes"], current_ids,
+                chunker.page_count
+            )
+            # Chunks of the previous version that no longer exist in the new one; removed only once the new
+            # version is cataloged, so a failed re-ingest keeps the previous version whole
+            stale_ids = existing_ids.difference(current_ids)
+            if stale_ids:
+                try:
+                    await self._queue_call(self.vector_store.delete_chunks, stale_ids)
+                except Exception as e:
+                    # The catalog no longer lists them, so the consistency check reports and repairs them
+                    print(f"Error removing stale chunks of {job['doc_id']}: {e}")
+            index_seconds += time.perf_counter() - start
+
+        if previous and previous["path"] and previous["path"] != doc["path"] and os.path.exists(previous["path"]):
+            os.remove(previous["path"])
+
+        return extract_seconds, index_seconds, chunker.chunk_count, len(current_ids) - len(added_ids)
+
+    async def _write_batch(self, batch, existing_ids, current_ids, added_ids, writes):
+        """Queue only the chunks of a batch that are not already in the vector store."""
+        current_ids.extend(chunk.metadata["chunk_id"] for chunk in batch)
+        new_chunks = [chunk for chunk in batch if chunk.metadata["chunk_id"] not in existing_ids]
+        if not new_chunks:
+            return
+        ids = [chunk.metadata["chunk_id"] for chunk in new_chunks]
+        added_ids.extend(ids)
+        writes.append(await self.bulk_writer.add(new_chunks, ids))
+
+    async def _discard_partial(self, job, added_ids, writes):
+        # Chunks already written by a failed attempt would otherwise linger next to the previous version
+        await asyncio.gather(*writes, return_exceptions=True)
+        try:
+            await self._queue_call(self.vector_store.delete_chunks, added_ids)
+        except Exception as e:
+            print(f"Error removing partial chunks of {job['doc_id']}: {e}")
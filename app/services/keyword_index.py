@@ -0,0 +1,106 @@
+import re
+import json
+import sqlite3
+from contextlib import closing
+
+from app.config import KEYWORD_INDEX_PATH
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query that matches any of its terms.
+
+    Each whitespace-separated term is quoted, so punctuation never reaches the FTS5
+    query parser and identifiers such as "CV-2021-0042" match as a phrase.
+    """
+    terms = []
+    for term in query.split():
+        term = re.sub(r"^\W+|\W+$", "", term)
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"')
+    return " OR ".join(terms)
+
+
+class KeywordIndex:
+    """BM25 full-text index of chunk texts, kept next to the Chroma collection.
+
+    Uses SQLite FTS5, whose bm25() ranking catches exact identifiers and rare
+    terms that dense embeddings tend to miss.
+    """
+
+    def __init__(self, db_path=KEYWORD_INDEX_PATH):
+        self.db_path = str(db_path)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                    text, chunk_id UNINDEXED, doc_id UNINDEXED, metadata UNINDEXED
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def count(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def upsert(self, ids, texts, metadatas):
+        """Index chunk texts, replacing any earlier version of the same chunk ids."""
+        if not ids:
+            return
+        with closing(self._connect()) as conn, conn:
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                placeholders = ",".join("?" * len(batch))
+                conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+            conn.executemany(
+                "INSERT INTO chunks (text, chunk_id, doc_id, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (text, chunk_id, (metadata or {}).get("id"), json.dumps(metadata or {}))
+                    for chunk_id, text, metadata in zip(ids, texts, metadatas)
+                ]
+            )
+
+    def delete(self, ids):
+        ids = list(ids)
+        with closing(self._connect()) as conn, conn:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+
+    def delete_document(self, doc_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+
+    def chunk_refs(self):
+        """Yield (chunk_id, doc_id) for every indexed chunk."""
+        with closing(self._connect()) as conn:
+            yield from conn.execute("SELECT chunk_id, doc_id FROM chunks")
+
+    def compact(self):
+        """Merge the FTS5 index segments and return free pages to the file system."""
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO chunks (chunks) VALUES ('optimize')")
+            conn.commit()
+            conn.execute("VACUUM")
+
+    def search(self, query, k=5, document_ids=None):
+        """Return up to k (chunk_id, text, metadata, score) tuples, best match first.
+
+        Scores are FTS5 bm25() values, where lower is better.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        sql = "SELECT chunk_id, text, metadata, bm25(chunks) AS score FROM chunks WHERE chunks MATCH ?"
+        params = [expression]
+        if document_ids:
+            sql += f" AND doc_id IN ({','.join('?' * len(document_ids))})"
+            params.extend(document_ids)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(k)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [(chunk_id, text, json.loads(metadata), score) for chunk_id, text, metadata, score in rows]
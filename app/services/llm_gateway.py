@@ -0,0 +1,399 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from email.utils import parsedate_to_datetime
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.config import (
+    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_COMPLETION_TOKENS_ESTIMATE, LLM_GATEWAY_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_HTTP_MAX_CONNECTIONS, LLM_HTTP_KEEPALIVE_SECONDS,
+    LLM_CALL_TIMEOUT
+)
+from app.services.context_budget import CHARS_PER_TOKEN
+from app.services.metrics import QUEUE_WAIT_SECONDS
+
+# Lower runs first: finishing a query's synthesis beats starting another query's extractions
+STAGE_PRIORITIES = {"synthesis": 0, "themes": 1, "theme_names": 1, "batch": 2, "document": 2}
+DEFAULT_PRIORITY = 1
+RETRYABLE_STATUSES = (408, 409, 429)
+
+_current_stage = contextvars.ContextVar("llm_stage", default=None)
+
+
+class llm_stage:
+    """Context manager tagging the LLM calls made inside it with a query stage, which sets their priority."""
+
+    __slots__ = ("stage", "token")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.token = _current_stage.set(self.stage)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_stage.reset(self.token)
+
+
+def create_http_client(max_connections=LLM_HTTP_MAX_CONNECTIONS, keepalive_seconds=LLM_HTTP_KEEPALIVE_SECONDS):
+    """Return an async HTTP client whose keep-alive connections are shared by every model using it."""
+    import httpx
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_seconds
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+
+
+def estimate_tokens(messages):
+    """Tokens a call is expected to use before the provider reports them: the prompt plus a typical completion."""
+    return sum(len(str(message.content)) for message in messages) // CHARS_PER_TOKEN + LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def reported_tokens(message):
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(error):
+    """Rate limits, server errors, timeouts and connection failures are worth retrying; bad requests are not."""
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or status >= 500
+    # The Groq client's connection and timeout errors, without importing it here
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "RemoteProtocolError"
+    )
+
+
+def retry_after(error):
+    """Seconds the server asked to wait before retrying, from Retry-After(-ms) headers, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Allows per_minute units per minute, in bursts of up to one minute's worth.
+
+    The level may go negative when a call used more than was reserved for it;
+    the debt is paid back by the refill before anything else is allowed.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken; amounts above the capacity only need a full bucket."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "loop", "future")
+
+    def __init__(self, tokens, loop):
+        self.tokens = tokens
+        self.loop = loop
+        self.future = loop.create_future()
+
+
+class LLMGateway:
+    """Shared admission control for LLM calls: rate limits, concurrency, priorities, retries and failover.
+
+    A call waits until a concurrency slot is free and the request and token
+    buckets allow it; waiting calls are admitted by stage priority, then in
+    arrival order. Failed calls are retried with jittered exponential backoff,
+    at least as long as a Retry-After header asks, and a 429 pauses every call
+    for that long. When retries are exhausted the next model is tried.
+    attempt_timeout bounds each provider attempt, not the time spent queued or
+    backing off.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_concurrency=LLM_GATEWAY_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 base_delay=LLM_RETRY_BASE_DELAY, max_delay=LLM_RETRY_MAX_DELAY, attempt_timeout=LLM_CALL_TIMEOUT):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout or None
+        self._lock = threading.Lock()
+        self._queue = []
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        # When the pending re-dispatch timer fires, if any
+        self._timer_due = None
+        self._counters = {"calls": 0, "retries": 0, "rate_limited": 0, "failovers": 0, "failed": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "in_flight": self._in_flight,
+                "queued": sum(1 for _, _, waiter in self._queue if not waiter.future.done()),
+                "paused_seconds": max(0.0, self._paused_until - time.monotonic()),
+            }
+
+    def _dispatch(self):
+        """Admit waiting calls in priority order while slots and budget allow; call with the lock held.
+
+        Returns the seconds until the first waiting call could be admitted, or
+        None when it waits for a slot (a finishing call dispatches again). When
+        it waits for budget, a timer dispatches again once it is available.
+        """
+        now = time.monotonic()
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self._in_flight >= self.max_concurrency:
+                return None
+            delay = self._paused_until - now
+            if self.request_bucket is not None:
+                delay = max(delay, self.request_bucket.wait_time(1, now))
+            if self.token_bucket is not None:
+                delay = max(delay, self.token_bucket.wait_time(waiter.tokens, now))
+            if delay > 0:
+                self._schedule(waiter.loop, now + delay)
+                return delay
+            heapq.heappop(self._queue)
+            if self.request_bucket is not None:
+                self.request_bucket.take(1)
+            if self.token_bucket is not None:
+                self.token_bucket.take(waiter.tokens)
+            self._in_flight += 1
+            waiter.loop.call_soon_threadsafe(self._admit, waiter)
+        return None
+
+    def _schedule(self, loop, due):
+        """Dispatch again at monotonic time due; only the earliest timer is kept pending."""
+        if self._timer_due is not None and self._timer_due <= due:
+            return
+        self._timer_due = due
+        try:
+            loop.call_soon_threadsafe(lambda: loop.call_later(max(0.0, due - time.monotonic()), self._on_timer, due))
+        except RuntimeError:
+            # The waiter's loop is closed; the next acquire or release dispatches again
+            self._timer_due = None
+
+    def _on_timer(self, due):
+        with self._lock:
+            if self._timer_due == due:
+                self._timer_due = None
+            self._dispatch()
+
+    def _admit(self, waiter):
+        if waiter.future.cancelled():
+            # Cancelled after it was given a slot
+            self._release(waiter.tokens, None)
+        else:
+            waiter.future.set_result(True)
+
+    def _release(self, reserved, used):
+        """Free a slot; a call that used fewer or more tokens than reserved settles the difference."""
+        with self._lock:
+            self._in_flight -= 1
+            if self.token_bucket is not None and used is not None:
+                if used < reserved:
+                    self.token_bucket.give_back(reserved - used)
+                else:
+                    self.token_bucket.take(used - reserved)
+            self._dispatch()
+
+    async def _acquire(self, priority, tokens):
+        waiter = _Waiter(tokens, asyncio.get_running_loop())
+        start = time.perf_counter()
+        with self._lock:
+            heapq.heappush(self._queue, (priority, next(self._order), waiter))
+            delay = self._dispatch()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), timeout=delay)
+                    break
+                except asyncio.TimeoutError:
+                    with self._lock:
+                        delay = self._dispatch()
+        except asyncio.CancelledError:
+            if not waiter.future.cancel() and not waiter.future.cancelled():
+                # Admitted just before the cancellation arrived
+                self._release(tokens, None)
+            else:
+                with self._lock:
+                    self._dispatch()
+            raise
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start, "llm_gateway")
+
+    def _retry_delay(self, error, attempt):
+        """Full-jitter exponential backoff, but never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(error)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        if status_code(error) == 429:
+            self._count("rate_limited")
+            # The provider's limit is shared by every call, so all of them back off
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    async def ainvoke(self, models, call, tokens):
+        """Return await call(model) for the first model that answers, retrying each as configured."""
+        priority = STAGE_PRIORITIES.get(_current_stage.get(), DEFAULT_PRIORITY)
+        self._count("calls")
+        error, delay = None, 0.0
+        for index, model in enumerate(models):
+            if index:
+                self._count("failovers")
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+                await self._acquire(priority, tokens)
+                used = None
+                try:
+                    result = await asyncio.wait_for(call(model), timeout=self.attempt_timeout)
+                    used = reported_tokens(result)
+                    return result
+                except Exception as e:
+                    if not is_retryable(e):
+                        self._count("failed")
+                        raise
+                    print(f"Error calling the LLM (attempt {attempt + 1}): {e!r}")
+                    error, delay = e, self._retry_delay(e, attempt)
+                finally:
+                    self._release(tokens, used)
+        self._count("failed")
+        raise error
+
+    async def astream(self, models, stream, tokens):
+        """Yield the chunks of stream(model); a stream is only retried until its first chunk arrives."""
+        priority = STAGE_PRIORITIES.get(_current_stage.get(), DEFAULT_PRIORITY)
+        self._count("calls")
+        error, delay = None, 0.0
+        for index, model in enumerate(models):
+            if index:
+                self._count("failovers")
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+                await self._acquire(priority, tokens)
+                started, used = False, None
+                try:
+                    chunks = aiter(stream(model))
+                    # Until the first chunk the attempt can still be retried, so only that wait is bounded
+                    chunk = await asyncio.wait_for(anext(chunks, None), timeout=self.attempt_timeout)
+                    while chunk is not None:
+                        started = True
+                        used = reported_tokens(chunk) or used
+                        yield chunk
+                        chunk = await anext(chunks, None)
+                    return
+                except Exception as e:
+                    if started or not is_retryable(e):
+                        self._count("failed")
+                        raise
+                    print(f"Error streaming from the LLM (attempt {attempt + 1}): {e!r}")
+                    error, delay = e, self._retry_delay(e, attempt)
+                finally:
+                    self._release(tokens, used)
+        self._count("failed")
+        raise error
+
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model that sends every async call of its primary model, and fallback model, through an LLMGateway.
+
+    Tools (structured output) are formatted by the primary model and passed on to
+    whichever model serves the call. Synchronous calls go straight to the primary.
+    """
+
+    primary: BaseChatModel
+    fallback: Optional[BaseChatModel] = None
+    gateway: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    def _models(self):
+        return [model for model in (self.primary, self.fallback) if model is not None]
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        return self.bind(**self.primary.bind_tools(tools, tool_choice=tool_choice, **kwargs).kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self.primary.invoke(messages, stop=stop, **kwargs))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = await self.gateway.ainvoke(
+            self._models(), lambda model: model.ainvoke(messages, stop=stop, **kwargs), estimate_tokens(messages)
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any):
+        chunks = self.gateway.astream(
+            self._models(), lambda model: model.astream(messages, stop=stop, **kwargs), estimate_tokens(messages)
+        )
+        async for chunk in chunks:
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(chunk.content, chunk=chunk)
+            yield ChatGenerationChunk(message=chunk)
@@ -0,0 +1,150 @@
+import os
+import time
+
+from app.config import UPLOAD_DIR, PROCESSED_DIR, DB_DIR, ORPHAN_FILE_GRACE_SECONDS
+
+
+def directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+class StoreMaintenance:
+    """Deletes documents, compacts storage and checks that the document stores agree.
+
+    A document lives in three places: its uploaded and processed files, its
+    chunks in the vector store (and keyword index), and its row in the document
+    index. Deletes remove the chunks first, so a failure part-way leaves at worst
+    a catalog entry or files that the consistency check reports, never chunks
+    that are still retrieved for a document that no longer exists.
+    """
+
+    def __init__(self, document_index, vector_store, ingestion_queue,
+                 upload_dir=UPLOAD_DIR, processed_dir=PROCESSED_DIR, db_dir=DB_DIR,
+                 file_grace_seconds=ORPHAN_FILE_GRACE_SECONDS):
+        self.document_index = document_index
+        self.vector_store = vector_store
+        self.ingestion_queue = ingestion_queue
+        self.upload_dir = str(upload_dir)
+        self.processed_dir = str(processed_dir)
+        self.db_dir = str(db_dir)
+        self.file_grace_seconds = file_grace_seconds
+
+    def delete_documents(self, doc_ids):
+        """Delete documents from every store; documents with a queued or running ingest job are skipped."""
+        doc_ids = list(dict.fromkeys(doc_ids))
+        active = {job["doc_id"] for job in self.ingestion_queue.active_jobs()}
+        busy = [doc_id for doc_id in doc_ids if doc_id in active]
+        known = self.document_index.document_versions([doc_id for doc_id in doc_ids if doc_id not in active])
+        not_found = [doc_id for doc_id in doc_ids if doc_id not in active and doc_id not in known]
+        targets = [doc_id for doc_id in doc_ids if doc_id in known]
+
+        if targets:
+            self.vector_store.delete_documents(targets)
+            for row in self.document_index.delete_documents(targets):
+                self._remove_files(row["path"], row["processed_path"])
+        return {"deleted": targets, "not_found": not_found, "busy": busy}
+
+    @staticmethod
+    def _remove_files(*paths):
+        for path in paths:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error removing {path}: {e}")
+
+    @staticmethod
+    def _older_file(path, cutoff):
+        try:
+            return os.path.isfile(path) and os.path.getmtime(path) < cutoff
+        except OSError:
+            return False
+
+    def compact(self):
+        """Reclaim the disk space of deleted chunks and documents; returns the data directory size before and after."""
+        before = directory_size(self.db_dir)
+        self.vector_store.compact()
+        self.document_index.vacuum()
+        after = directory_size(self.db_dir)
+        return {"bytes_before": before, "bytes_after": after, "bytes_reclaimed": before - after}
+
+    def check_consistency(self, repair=False):
+        """Compare the document index, vector store, keyword index and files and report what does not match.
+
+        With repair, chunks and files that belong to no document are deleted and
+        the keyword index is re-synced. Chunks of a known document that its
+        catalog entry does not list (left by an earlier version) count as orphans
+        too. Files newer than file_grace_seconds are never reported, as they may be
+        uploads about to be queued. Documents whose chunks are missing from the
+        vector store are only reported; they need to be uploaded again.
+
+        Documents ingested before the catalog existed are cataloged first, so
+        their chunks are never taken for orphans.
+        """
+        active_jobs = self.ingestion_queue.active_jobs()
+        # Chunks and files of documents still being ingested are not in the catalog yet
+        ingesting = {job["doc_id"] for job in active_jobs}
+        if not self.document_index.backfilled():
+            self.document_index.backfill(self.vector_store.chunk_metadata(), exclude=ingesting)
+        documents = {row["doc_id"]: row for row in self.document_index.all_documents()}
+        expected = dict(self.document_index.chunk_refs())
+        stored = dict(self.vector_store.chunk_refs())
+
+        orphan_chunks = [
+            chunk_id for chunk_id, doc_id in stored.items() if chunk_id not in expected and doc_id not in ingesting
+        ]
+        stale_chunks = sum(1 for chunk_id in orphan_chunks if stored[chunk_id] in documents)
+        missing = {doc_id for chunk_id, doc_id in expected.items() if chunk_id not in stored}
+
+        keyword_orphans, keyword_missing = [], 0
+        keyword_index = self.vector_store.keyword_index
+        if keyword_index is not None:
+            indexed = dict(keyword_index.chunk_refs())
+            keyword_orphans = [chunk_id for chunk_id in indexed if chunk_id not in stored]
+            keyword_missing = sum(1 for chunk_id in stored if chunk_id not in indexed)
+
+        referenced = {job["file_path"] for job in active_jobs}
+        for doc_id in ingesting:
+            # The processed text is written to a temporary file until the job succeeds
+            referenced.add(os.path.join(self.processed_dir, f"{doc_id}.txt"))
+            referenced.add(os.path.join(self.processed_dir, f"{doc_id}.txt.tmp"))
+        for row in documents.values():
+            referenced.update(path for path in (row["path"], row["processed_path"]) if path)
+        cutoff = time.time() - self.file_grace_seconds
+        orphan_files = [
+            path for directory in (self.upload_dir, self.processed_dir)
+            for path in (os.path.join(directory, name) for name in sorted(os.listdir(directory)))
+            if path not in referenced and self._older_file(path, cutoff)
+        ]
+        missing_files = sorted(
+            doc_id for doc_id, row in documents.items() if not row["path"] or not os.path.exists(row["path"])
+        )
+
+        report = {
+            "documents": len(documents),
+            "chunks": len(stored),
+            "documents_missing_chunks": sorted(missing),
+            "documents_missing_files": missing_files,
+            "orphan_chunks": len(orphan_chunks),
+            "stale_chunks": stale_chunks,
+            "orphan_files": orphan_files,
+            "keyword_orphan_chunks": len(keyword_orphans),
+            "keyword_missing_chunks": keyword_missing,
+            "repaired": False
+        }
+        if repair:
+            self.vector_store.delete_chunks(orphan_chunks)
+            if keyword_orphans:
+                keyword_index.delete(keyword_orphans)
+            if keyword_missing:
+                self.vector_store.sync_keyword_index()
+            self._remove_files(*orphan_files)
+            report["repaired"] = True
+        return report
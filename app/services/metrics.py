@@ -0,0 +1,220 @@
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from collections import OrderedDict
+
+from app.config import TRACING_ENABLED, TRACE_BUFFER_SIZE, TRACE_MAX_SPANS
+
+METRIC_PREFIX = "queryquill_"
+
+# Seconds; spans sub-millisecond cache hits up to long LLM calls and large extractions
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    """Monotonic counter per combination of label values."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per combination of label values."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labelvalues, list(values)) for labelvalues, values in self._series.items())
+        for labelvalues, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Time spent in each stage of the ingest and query pipelines", ("pipeline", "stage")
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "queue_wait_seconds", "Time work waited for a worker pool, the ingestion queue or an LLM slot", ("queue",)
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM provider per stage", ("stage", "kind"))
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Time to answer HTTP requests, streamed bodies included", ("method", "route", "status")
+)
+
+METRICS = (STAGE_SECONDS, QUEUE_WAIT_SECONDS, LLM_TOKENS, HTTP_REQUEST_SECONDS)
+
+
+def render_metrics(families=()):
+    """Render the built-in metrics and extra (name, type, help, [(labels, value)]) families as Prometheus text."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, metric_type, help_text, samples in families:
+        name = METRIC_PREFIX + name
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Stage spans recorded while one request or ingest job ran."""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.dropped_spans = 0
+
+    def add_span(self, name, start, seconds):
+        # list.append is atomic, so spans can come from pool threads and tasks at once
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((name, start - self._start, seconds))
+        else:
+            self.dropped_spans += 1
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                for name, offset, seconds in sorted(self.spans, key=lambda span: span[1])
+            ],
+            "dropped_spans": self.dropped_spans,
+        }
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_traces = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+def start_trace(trace_id=None):
+    """Make a new trace current for this context; returns (trace, token), or (None, None) when tracing is off."""
+    if not TRACING_ENABLED:
+        return None, None
+    trace = Trace(trace_id or uuid.uuid4().hex)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace, token):
+    """Stop recording into trace and keep it among the recent traces."""
+    if trace is None:
+        return
+    _current_trace.reset(token)
+    with _traces_lock:
+        _traces[trace.trace_id] = trace
+        _traces.move_to_end(trace.trace_id)
+        while len(_traces) > TRACE_BUFFER_SIZE:
+            _traces.popitem(last=False)
+
+
+def get_trace(trace_id):
+    with _traces_lock:
+        trace = _traces.get(trace_id)
+    return trace.to_dict() if trace is not None else None
+
+
+def record_stage(pipeline, stage, start, seconds):
+    """Record a stage that started at perf_counter() time start and took seconds."""
+    STAGE_SECONDS.observe(seconds, pipeline, stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(f"{pipeline}.{stage}", start, seconds)
+
+
+class track_stage:
+    """Context manager timing a block as one pipeline stage, e.g. with track_stage("query", "themes").
+
+    Also usable with async with, so it can share a statement with async context managers.
+    """
+
+    __slots__ = ("pipeline", "stage", "start")
+
+    def __init__(self, pipeline, stage):
+        self.pipeline = pipeline
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.pipeline, self.stage, self.start, time.perf_counter() - self.start)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+def record_usage(stage, message):
+    """Count the prompt and completion tokens the provider reported on an LLM reply, if any."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), stage, "prompt")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), stage, "completion")
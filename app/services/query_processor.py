@@ -1,22 +1,32 @@
 import re
 import json
+import time
+import asyncio
+import contextlib
 from pydantic import BaseModel, Field
 from typing import List
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
 from langchain.output_parsers import PydanticOutputParser, OutputFixingParser
 
-from app.config import LLM_MODEL, LLM_TEMPERATURE, GROQ_API_KEY
-from app.services.vector_store import VectorStore
+from app.services.context_budget import ContextBudget
+from app.services.llm_gateway import llm_stage
+from app.services.metrics import QUEUE_WAIT_SECONDS, track_stage, record_stage, record_usage
+from app.services.structured_output import ParseCounters, parse_json
+from app.services.themes import ThemeClusterer
+from app.services.embedding_cache import CachedEmbeddings
+from app.config import (
+    LLM_MODEL, LLM_TEMPERATURE, GROQ_API_KEY, LLM_MAX_CONCURRENCY, LLM_CALL_TIMEOUT, QUERY_TOP_K,
+    EXTRACTION_BATCH_ENABLED, EXTRACTION_BATCH_MAX_DOCUMENTS, EXTRACTION_BATCH_CONTEXT_TOKENS,
+    STRUCTURED_OUTPUT_ENABLED, LLM_PARSE_FIX_ENABLED, THEME_CLUSTERING_ENABLED, THEME_LLM_NAMING
+)
 
 
 def clean_text(text: str) -> str:
     # Remove unwanted symbols like non-printable chars, excessive punctuation, etc.
+    # Remove control characters; non-ASCII letters and punctuation are kept
+    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]+', ' ', text)
     # Replace multiple spaces/newlines/tabs with a single space
     text = re.sub(r'\s+', ' ', text)
-    # Remove unusual/unicode control characters (keep basic printable ASCII)
-    text = re.sub(r'[^\x20-\x7E]+', ' ', text)
     # Remove repeated punctuation (e.g. "!!!" to "!")
     text = re.sub(r'([!?.]){2,}', r'\1', text)
     # Trim leading/trailing spaces
@@ -47,54 +57,413 @@ class SynthesizedResponse(BaseModel):
     synthesized_answer: str = Field(description="Final synthesized answer to the query")
 
 
+class ThemeList(BaseModel):
+    """Schema for the themes identified across documents."""
+    themes: List[ThemeResponse] = Field(description="Themes identified across documents")
+
+
+class ThemeName(BaseModel):
+    """Schema for the name the LLM gives one clustered theme."""
+    theme: int = Field(description="Number of the theme being named")
+    theme_name: str = Field(description="Short name of the theme")
+    theme_description: str = Field(description="One-sentence description of the theme")
+
+
+class ThemeNameList(BaseModel):
+    """Schema for the names of the clustered themes."""
+    names: List[ThemeName] = Field(description="One name per theme")
+
+
+class DocumentResponseList(BaseModel):
+    """Schema for the responses from a batch of documents."""
+    responses: List[DocumentResponse] = Field(description="One response per document")
+
+
+def _themes_from_json(value):
+    if isinstance(value, dict):
+        value = value.get("themes", [])
+    return [ThemeResponse(**theme) for theme in value]
+
+
+def _theme_names_from_json(value):
+    if isinstance(value, dict):
+        value = value.get("names", [])
+    return [ThemeName(**name) for name in value]
+
+
+def _batch_items_from_json(value):
+    if isinstance(value, dict):
+        value = value.get("responses", [])
+    if not isinstance(value, list):
+        raise ValueError("Expected a list of document responses")
+    return value
+
+
+ERROR_ANSWER = "Error processing this document."
+
+
 class QueryProcessor:
     """Service for processing queries against documents and identifying themes."""
 
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.llm = ChatGroq(
-            model=LLM_MODEL,
-            temperature=LLM_TEMPERATURE,
-            groq_api_key=GROQ_API_KEY
-        )
-        self.document_parser = OutputFixingParser.from_llm(
-            parser=PydanticOutputParser(pydantic_object=DocumentResponse),
-            llm=self.llm
-        )
-        self.theme_parser = OutputFixingParser.from_llm(
-            parser=PydanticOutputParser(pydantic_object=ThemeResponse),
-            llm=self.llm
-        )
+    def __init__(self, llm=None, vector_store=None, io_pool=None,
+                 max_concurrency=LLM_MAX_CONCURRENCY, call_timeout=LLM_CALL_TIMEOUT,
+                 answer_cache=None, document_index=None, context_budget=None,
+                 batch_extraction=EXTRACTION_BATCH_ENABLED, batch_max_documents=EXTRACTION_BATCH_MAX_DOCUMENTS,
+                 batch_context_tokens=EXTRACTION_BATCH_CONTEXT_TOKENS,
+                 structured_output=STRUCTURED_OUTPUT_ENABLED, parse_fix=LLM_PARSE_FIX_ENABLED,
+                 theme_clustering=THEME_CLUSTERING_ENABLED, theme_llm_naming=THEME_LLM_NAMING):
+        if vector_store is None:
+            from app.services.vector_store import VectorStore
 
-    def process_query(self, query, top_k=10):
+            vector_store = VectorStore()
+        if llm is None:
+            # Imported lazily so that importing the app does not pull in the Groq client
+            from langchain_groq import ChatGroq
+
+            llm = ChatGroq(
+                model=LLM_MODEL,
+                temperature=LLM_TEMPERATURE,
+                groq_api_key=GROQ_API_KEY
+            )
+        self.vector_store = vector_store
+        self.llm = llm
+        self.io_pool = io_pool
+        self.max_concurrency = max_concurrency
+        self.call_timeout = call_timeout
+        # Without a document index there is no corpus version, so only stage results are cached
+        self.answer_cache = answer_cache
+        self.document_index = document_index
+        self.context_budget = context_budget or ContextBudget()
+        # Several documents share one extraction call, sized by their packed context
+        self.batch_extraction = batch_extraction
+        self.batch_max_documents = batch_max_documents
+        self.batch_context_tokens = batch_context_tokens
+        self.batch_fallbacks = 0
+        # Replies are parsed natively, then directly, then after local repair; the LLM fixer is the last resort
+        self.structured_output = structured_output
+        self._structured_llms = {}
+        self.parse_counters = ParseCounters()
+        # Themes come from clustering the answers locally when the vector store's embedding model is at hand
+        embeddings = getattr(self.vector_store, "embeddings", None)
+        if isinstance(embeddings, CachedEmbeddings):
+            # Answers are new text on every query, so they would only grow the chunk embedding cache
+            embeddings = embeddings.embeddings
+        self.theme_clusterer = ThemeClusterer(embeddings) if theme_clustering and embeddings is not None else None
+        self.theme_llm_naming = theme_llm_naming
+        self.document_parser = None
+        self.theme_parser = None
+        if parse_fix:
+            self.document_parser = OutputFixingParser.from_llm(
+                parser=PydanticOutputParser(pydantic_object=DocumentResponse),
+                llm=self.llm
+            )
+            self.theme_parser = OutputFixingParser.from_llm(
+                parser=PydanticOutputParser(pydantic_object=ThemeList),
+                llm=self.llm
+            )
+
+    def process_query(self, query, top_k=QUERY_TOP_K, document_ids=None):
         """Process a query against documents and return individual responses."""
-        document_chunks = self.vector_store.similarity_search(query, k=top_k)
+        return asyncio.run(self.aprocess_query(query, top_k=top_k, document_ids=document_ids))
+
+    async def aprocess_query(self, query, top_k=QUERY_TOP_K, document_ids=None):
+        """Process a query against documents, extracting answers from all documents concurrently.
+
+        When document_ids is given, retrieval is restricted to those documents so no
+        LLM calls are spent on documents outside the scope.
+        """
+        doc_chunks = await self._retrieve(query, top_k, document_ids)
+        responses = {doc_id: response async for doc_id, response in self._iter_extractions(query, doc_chunks)}
+        return self._rank(doc_chunks, responses)
+
+    async def _retrieve(self, query, top_k, document_ids):
+        """Return the retrieved chunks grouped per document, in retrieval order."""
+        with track_stage("query", "retrieve"):
+            document_chunks = await self._run_blocking(
+                self.vector_store.similarity_search, query, k=top_k, document_ids=document_ids
+            )
 
         doc_chunks = {}
         for doc, score in document_chunks:
             doc_id = doc.metadata.get("id")
             if doc_id not in doc_chunks:
                 doc_chunks[doc_id] = {
-                    "chunks": [],
+                    "documents": [],
                     "filename": doc.metadata.get("filename"),
                     "score": score
                 }
-            doc_chunks[doc_id]["chunks"].append(doc.page_content)
-
-        document_responses = []
-        for doc_id, doc_data in doc_chunks.items():
-            answer = self._extract_answer_from_document(
-                query,
-                doc_data["chunks"],
-                doc_id,
-                doc_data["filename"]
-            )
-            document_responses.append(answer)
+            doc_chunks[doc_id]["documents"].append(doc)
+
+        # Merge overlapping chunks and cut each document's context to the extraction budget
+        for doc_data in doc_chunks.values():
+            doc_data["chunks"] = self.context_budget.pack_chunks(doc_data.pop("documents"))
+        return doc_chunks
 
+    @staticmethod
+    def _rank(doc_chunks, responses):
+        # Stable sort, so documents with equal relevance keep their retrieval order
+        document_responses = [responses[doc_id] for doc_id in doc_chunks]
         document_responses.sort(key=lambda x: x.relevance, reverse=True)
         return document_responses
 
-    def _extract_answer_from_document(self, query, chunks, doc_id, filename):
+    async def _iter_extractions(self, query, doc_chunks):
+        """Yield (doc_id, DocumentResponse) pairs in the order the extractions finish.
+
+        Cached answers come first; failed extractions yield an error response.
+        """
+        # Answers for documents whose content has not changed since they were last asked about
+        versions, pending = {}, dict(doc_chunks)
+        if self.answer_cache is not None and self.document_index is not None and doc_chunks:
+            versions = await self._run_blocking(self.document_index.document_versions, doc_chunks)
+            for doc_id in doc_chunks:
+                response = self.answer_cache.get_extraction(
+                    query, doc_id, versions.get(doc_id), doc_chunks[doc_id]["chunks"]
+                )
+                if response is not None:
+                    del pending[doc_id]
+                    yield doc_id, response
+
+        # One semaphore per query keeps at most max_concurrency calls in flight
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.batch_extraction:
+            tasks = [
+                asyncio.ensure_future(self._safe_extract_batch(semaphore, query, batch, versions))
+                for batch in self._plan_batches(pending)
+            ]
+        else:
+            tasks = [
+                asyncio.ensure_future(self._safe_extract(semaphore, query, doc_id, doc_data, versions.get(doc_id)))
+                for doc_id, doc_data in pending.items()
+            ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if isinstance(result, list):
+                    for item in result:
+                        yield item
+                else:
+                    yield result
+        finally:
+            # The consumer may stop early (e.g. a closed stream); do not leave LLM calls running
+            for task in tasks:
+                task.cancel()
+
+    async def _safe_extract(self, semaphore, query, doc_id, doc_data, doc_version):
+        try:
+            result = await self._bounded_extract(semaphore, query, doc_data["chunks"], doc_id, doc_data["filename"])
+        except Exception as e:
+            print(f"Error extracting answer from document {doc_id}: {e!r}")
+            return doc_id, self._error_response(doc_id, doc_data["filename"])
+        if self.answer_cache is not None and result.extracted_answer != ERROR_ANSWER:
+            self.answer_cache.put_extraction(query, doc_id, doc_version, doc_data["chunks"], result)
+        return doc_id, result
+
+    def _plan_batches(self, pending):
+        """Group documents, in retrieval order, into batches that fit the batch context budget.
+
+        A document whose context alone exceeds the budget gets a batch of its own.
+        """
+        batches, batch, used = [], [], 0
+        for doc_id, doc_data in pending.items():
+            tokens = sum(self.context_budget.count_tokens(chunk) for chunk in doc_data["chunks"])
+            if batch and (used + tokens > self.batch_context_tokens or len(batch) >= self.batch_max_documents):
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append((doc_id, doc_data))
+            used += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _safe_extract_batch(self, semaphore, query, batch, versions):
+        """Extract answers for a batch of documents in one call, falling back to one call per document.
+
+        Documents missing from the batch reply, or every document when the call or
+        its parsing fails, are extracted individually.
+        """
+        if len(batch) == 1:
+            doc_id, doc_data = batch[0]
+            return [await self._safe_extract(semaphore, query, doc_id, doc_data, versions.get(doc_id))]
+
+        responses = {}
+        try:
+            async with self._llm_slot(semaphore), track_stage("query", "extract_batch"):
+                responses = await asyncio.wait_for(
+                    self._extract_answers_from_batch(query, batch), timeout=self.call_timeout
+                )
+        except Exception as e:
+            print(f"Error extracting answers from a batch of {len(batch)} documents: {e!r}")
+
+        results, fallback = [], []
+        for doc_id, doc_data in batch:
+            response = responses.get(doc_id)
+            if response is None:
+                fallback.append((doc_id, doc_data))
+                continue
+            if self.answer_cache is not None:
+                self.answer_cache.put_extraction(query, doc_id, versions.get(doc_id), doc_data["chunks"], response)
+            results.append((doc_id, response))
+        if fallback:
+            self.batch_fallbacks += len(fallback)
+            results.extend(await asyncio.gather(*[
+                self._safe_extract(semaphore, query, doc_id, doc_data, versions.get(doc_id))
+                for doc_id, doc_data in fallback
+            ]))
+        return results
+
+    async def _extract_answers_from_batch(self, query, batch):
+        """Return {doc_id: DocumentResponse} for the documents answered in one batched call."""
+        documents = "\n\n".join(
+            f"=== Document {doc_id} ({doc_data['filename']}) ===\n" + "\n\n".join(doc_data["chunks"])
+            for doc_id, doc_data in batch
+        )
+
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are an expert document analyzer. 
+            For each document below, extract the most relevant information that answers the query.
+            Include specific page numbers, paragraphs, or sections if possible.
+            If a document doesn't contain relevant information, state that clearly.
+            
+            Rate the relevance of each document to the query on a scale of 1-10, 
+            where 10 is perfectly relevant and 1 is not relevant at all."""),
+            ("user", """
+            Query: {query}
+            
+            Documents:
+            {documents}
+            
+            Return a JSON list with one object per document, covering every document above exactly once:
+            [
+                {{
+                    "doc_id": "the document id",
+                    "filename": "the document filename",
+                    "extracted_answer": "The relevant information from the document",
+                    "citation": "Specific location (page, paragraph, section)",
+                    "relevance": relevance_score_1_to_10
+                }},
+                ...
+            ]
+            """)
+        ])
+
+        parsed, raw_result = await self._call_structured(
+            "batch", prompt, {"query": query, "documents": documents}, DocumentResponseList
+        )
+        if parsed is not None:
+            items = [response.model_dump() for response in parsed.responses]
+        else:
+            # Documents the reply does not cover are extracted one by one, so there is no LLM fixer here
+            items = await self._parse_reply("batch", raw_result, _batch_items_from_json) or []
+
+        filenames = {doc_id: doc_data["filename"] for doc_id, doc_data in batch}
+        responses = {}
+        for item in items:
+            try:
+                response = DocumentResponse(**item)
+            except Exception as e:
+                print(f"Error parsing batched document response: {e}")
+                continue
+            if response.doc_id in filenames:
+                response.filename = filenames[response.doc_id]
+                responses[response.doc_id] = response
+        return responses
+
+    def _structured_llm(self, schema):
+        """Return the chat model bound to native structured output for schema, or None if unsupported."""
+        if not self.structured_output:
+            return None
+        if schema not in self._structured_llms:
+            try:
+                self._structured_llms[schema] = self.llm.with_structured_output(schema, include_raw=True)
+            except NotImplementedError:
+                self._structured_llms[schema] = None
+        return self._structured_llms[schema]
+
+    async def _call_structured(self, stage, prompt, inputs, schema):
+        """Run prompt, preferring native structured output; return (parsed model or None, raw reply text)."""
+        structured = self._structured_llm(schema)
+        if structured is not None:
+            try:
+                with llm_stage(stage):
+                    result = await (prompt | structured).ainvoke(inputs)
+            except Exception as e:
+                # e.g. the provider rejecting a malformed tool call; ask again for plain text below
+                print(f"Error getting structured output for {stage}, retrying as text: {e}")
+            else:
+                record_usage(stage, result.get("raw"))
+                if result.get("parsed") is not None:
+                    self.parse_counters.record(stage, "native")
+                    return result["parsed"], None
+                raw = result["raw"]
+                tool_calls = getattr(raw, "tool_calls", None)
+                return None, json.dumps(tool_calls[0]["args"]) if tool_calls else raw.content
+        with llm_stage(stage):
+            reply = await (prompt | self.llm).ainvoke(inputs)
+        record_usage(stage, reply)
+        return None, reply.content
+
+    async def _parse_reply(self, stage, text, build, fixer=None):
+        """Turn a reply into build(json_value), repairing it locally and then with the LLM fixer if needed.
+
+        Returns None when every path fails.
+        """
+        try:
+            with track_stage("query", "parse"):
+                value, repaired = parse_json(clean_text(text))
+                result = build(value)
+        except Exception:
+            pass
+        else:
+            self.parse_counters.record(stage, "repaired" if repaired else "direct")
+            return result
+
+        if fixer is not None:
+            try:
+                with track_stage("query", "parse_fix"), llm_stage(stage):
+                    result = build((await fixer.aparse(text)).model_dump())
+            except Exception as e:
+                print(f"Error fixing {stage} response: {e}")
+            else:
+                self.parse_counters.record(stage, "llm_fixed")
+                return result
+
+        self.parse_counters.record(stage, "failed")
+        return None
+
+    async def _run_blocking(self, fn, *args, **kwargs):
+        # Embedding the query and searching Chroma block, so keep them off the event loop
+        if self.io_pool is not None:
+            return await self.io_pool.run(fn, *args, **kwargs)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def _bounded_extract(self, semaphore, query, chunks, doc_id, filename):
+        async with self._llm_slot(semaphore), track_stage("query", "extract"):
+            # The timeout also covers the repair calls made by OutputFixingParser
+            return await asyncio.wait_for(
+                self._extract_answer_from_document(query, chunks, doc_id, filename),
+                timeout=self.call_timeout
+            )
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def _llm_slot(semaphore):
+        """Hold one of the query's LLM concurrency slots, recording how long it took to get one."""
+        start = time.perf_counter()
+        async with semaphore:
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start, "llm")
+            yield
+
+    @staticmethod
+    def _error_response(doc_id, filename):
+        return DocumentResponse(
+            doc_id=doc_id,
+            filename=filename,
+            extracted_answer=ERROR_ANSWER,
+            citation="Unknown",
+            relevance=1
+        )
+
+    async def _extract_answer_from_document(self, query, chunks, doc_id, filename):
         context = "\n\n".join(chunks)
 
         prompt = ChatPromptTemplate.from_messages([
@@ -121,33 +490,31 @@ class QueryProcessor:
             """)
         ])
 
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-        raw_result = chain.run(query=query, context=context, doc_id=doc_id, filename=filename)
-
-        cleaned_result = clean_text(raw_result)
-
-        try:
-            return self.document_parser.parse(cleaned_result)
-        except Exception as e:
-            print(f"Error parsing document response: {e}")
-            return DocumentResponse(
-                doc_id=doc_id,
-                filename=filename,
-                extracted_answer="Error processing this document.",
-                citation="Unknown",
-                relevance=1
+        parsed, raw_result = await self._call_structured(
+            "document", prompt, {"query": query, "context": context, "doc_id": doc_id, "filename": filename},
+            DocumentResponse
+        )
+        if parsed is None:
+            parsed = await self._parse_reply(
+                "document", raw_result, lambda value: DocumentResponse(**value), self.document_parser
             )
+        if parsed is None:
+            print(f"Error parsing document response for {doc_id}")
+            return self._error_response(doc_id, filename)
+        return parsed
 
-    def identify_themes(self, document_responses, query):
+    async def identify_themes(self, document_responses, query):
         if not document_responses:
             return []
+        if self.theme_clusterer is not None:
+            return await self._cluster_themes(document_responses, query)
 
         context = []
         for resp in document_responses:
             if resp.relevance >= 3:
                 context.append(f"Document {resp.doc_id} ({resp.filename}): {resp.extracted_answer}")
 
-        context_text = "\n\n".join(context)
+        context_text = "\n\n".join(self.context_budget.pack_texts("themes", context))
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an expert at identifying themes across documents.
@@ -173,21 +540,80 @@ class QueryProcessor:
             """)
         ])
 
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-        result = chain.run(query=query, context=context_text)
-
-        try:
-            themes_json = json.loads(result)
-            return [ThemeResponse(**theme) for theme in themes_json]
-        except Exception as e:
-            print(f"Error parsing theme response: {e}")
+        parsed, result = await self._call_structured("themes", prompt, {"query": query, "context": context_text}, ThemeList)
+        if parsed is not None:
+            return parsed.themes
+        themes = await self._parse_reply("themes", result, _themes_from_json, self.theme_parser)
+        if themes is None:
+            print("Error parsing theme response")
             return []
+        return themes
+
+    async def _cluster_themes(self, document_responses, query):
+        """Find themes by clustering the answers locally, optionally naming them in one LLM call."""
+        answers = [
+            (resp.doc_id, resp.extracted_answer, resp.relevance)
+            for resp in document_responses if resp.relevance >= 3 and resp.extracted_answer != ERROR_ANSWER
+        ]
+        with track_stage("query", "theme_clustering"):
+            clusters = await self._run_blocking(self.theme_clusterer.cluster, answers)
+        if clusters and self.theme_llm_naming:
+            try:
+                with track_stage("query", "theme_naming"):
+                    names = await asyncio.wait_for(self._name_themes(clusters, query), timeout=self.call_timeout)
+            except Exception as e:
+                print(f"Error naming themes, keeping keyword names: {e!r}")
+            else:
+                for name in names:
+                    if 1 <= name.theme <= len(clusters):
+                        clusters[name.theme - 1]["theme_name"] = name.theme_name
+                        clusters[name.theme - 1]["theme_description"] = name.theme_description
+        return [
+            ThemeResponse(
+                theme_name=cluster["theme_name"], theme_description=cluster["theme_description"],
+                supporting_documents=cluster["supporting_documents"], confidence=cluster["confidence"]
+            )
+            for cluster in clusters
+        ]
 
-    def synthesize_answer(self, document_responses, themes, query):
-        doc_context = [
+    async def _name_themes(self, clusters, query):
+        """Return ThemeName objects for the clusters, given a few excerpts of each labelled with its theme number."""
+        # Each theme's most central excerpts first, so the budget cuts the least typical ones
+        excerpts = [
+            f"Theme {number}: {cluster['excerpts'][rank]}"
+            for rank in range(3)
+            for number, cluster in enumerate(clusters, start=1) if rank < len(cluster["excerpts"])
+        ]
+        themes = "\n\n".join(self.context_budget.pack_texts("themes", excerpts))
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", """You name themes that were found by grouping similar answers from several documents.
+            Give each theme a short name and a one-sentence description based on its excerpts."""),
+            ("user", """
+            Query: {query}
+            
+            {themes}
+            
+            Name each theme. Return your answer as a JSON list:
+            [
+                {{
+                    "theme": theme_number,
+                    "theme_name": "Short name",
+                    "theme_description": "One-sentence description"
+                }},
+                ...
+            ]
+            """)
+        ])
+        parsed, result = await self._call_structured("theme_names", prompt, {"query": query, "themes": themes}, ThemeNameList)
+        if parsed is not None:
+            return parsed.names
+        return await self._parse_reply("theme_names", result, _theme_names_from_json) or []
+
+    def _synthesis_prompt(self, document_responses, themes, query):
+        doc_context = self.context_budget.pack_texts("synthesis", [
             f"Document {resp.doc_id} ({resp.filename}): {resp.extracted_answer}"
             for resp in document_responses if resp.relevance >= 3
-        ]
+        ])
         theme_context = [
             f"Theme: {theme.theme_name}\nDescription: {theme.theme_description}\nSupporting Documents: {', '.join(theme.supporting_documents)}"
             for theme in themes
@@ -210,17 +636,101 @@ class QueryProcessor:
             Provide a comprehensive answer to the query, organizing information by themes and citing specific documents.
             """)
         ])
+        return prompt, {
+            "query": query, "doc_context": "\n\n".join(doc_context), "theme_context": "\n\n".join(theme_context)
+        }
+
+    async def synthesize_answer(self, document_responses, themes, query):
+        prompt, inputs = self._synthesis_prompt(document_responses, themes, query)
+        with llm_stage("synthesis"):
+            reply = await (prompt | self.llm).ainvoke(inputs)
+        record_usage("synthesis", reply)
+        return reply.content
+
+    async def astream_synthesis(self, document_responses, themes, query):
+        """Yield the synthesized answer piece by piece as the LLM streams it."""
+        prompt, inputs = self._synthesis_prompt(document_responses, themes, query)
+        start, first_token = time.perf_counter(), True
+        # Set only while the stream is being opened: the gateway reads it when the call is queued
+        with llm_stage("synthesis"):
+            chunks = aiter((prompt | self.llm).astream(inputs))
+            chunk = await anext(chunks, None)
+        while chunk is not None:
+            record_usage("synthesis", chunk)
+            if chunk.content:
+                if first_token:
+                    record_stage("query", "synthesis_first_token", start, time.perf_counter() - start)
+                    first_token = False
+                yield chunk.content
+            chunk = await anext(chunks, None)
+        record_stage("query", "synthesis", start, time.perf_counter() - start)
+
+    def process_query_with_themes(self, query, document_ids=None, top_k=QUERY_TOP_K):
+        return asyncio.run(self.aprocess_query_with_themes(query, document_ids=document_ids, top_k=top_k))
+
+    async def aprocess_query_with_themes(self, query, document_ids=None, top_k=QUERY_TOP_K):
+        async for event, data in self.astream_query_with_themes(query, document_ids=document_ids, top_k=top_k):
+            if event == "done":
+                return data
+
+    async def astream_query_with_themes(self, query, document_ids=None, top_k=QUERY_TOP_K):
+        """Yield (event, data) pairs as each stage of the query finishes.
+
+        Events are "document" with each DocumentResponse as soon as its extraction
+        completes, "themes" with the list of themes, "token" with each piece of the
+        synthesized answer, and finally "done" with the full SynthesizedResponse.
+        """
+        cache = self.answer_cache
+        corpus_version, query_vector = None, None
+        if cache is not None and self.document_index is not None:
+            corpus_version = await self._run_blocking(self.document_index.corpus_version)
+            if cache.similarity_threshold:
+                # Goes through the query embedding cache, so the similarity search below reuses it
+                query_vector = await self._run_blocking(self.vector_store.embeddings.embed_query, query)
+            response = cache.get_response(query, document_ids, corpus_version, query_vector)
+            if response is not None:
+                for document_response in response.document_responses:
+                    yield "document", document_response
+                yield "themes", response.identified_themes
+                yield "token", response.synthesized_answer
+                yield "done", response
+                return
+
+        doc_chunks = await self._retrieve(query, top_k, document_ids)
+        responses = {}
+        async for doc_id, document_response in self._iter_extractions(query, doc_chunks):
+            responses[doc_id] = document_response
+            yield "document", document_response
+        document_responses = self._rank(doc_chunks, responses)
+
+        themes = cache.get_stage("themes", query, document_responses) if cache is not None else None
+        if themes is None:
+            with track_stage("query", "themes"):
+                themes = await self.identify_themes(document_responses, query)
+            if cache is not None:
+                cache.put_stage("themes", query, document_responses, value=themes)
+        yield "themes", themes
 
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-        result = chain.run(query=query, doc_context="\n\n".join(doc_context), theme_context="\n\n".join(theme_context))
-        return result
+        synthesized_answer = None
+        if cache is not None:
+            synthesized_answer = cache.get_stage("synthesis", query, document_responses, themes)
+        if synthesized_answer is None:
+            parts = []
+            async for token in self.astream_synthesis(document_responses, themes, query):
+                parts.append(token)
+                yield "token", token
+            synthesized_answer = "".join(parts)
+            if cache is not None:
+                cache.put_stage("synthesis", query, document_responses, themes, value=synthesized_answer)
+        else:
+            yield "token", synthesized_answer
 
-    def process_query_with_themes(self, query):
-        document_responses = self.process_query(query)
-        themes = self.identify_themes(document_responses, query)
-        synthesized_answer = self.synthesize_answer(document_responses, themes, query)
-        return SynthesizedResponse(
+        response = SynthesizedResponse(
             document_responses=document_responses,
             identified_themes=themes,
             synthesized_answer=synthesized_answer
         )
+        # Responses with failed extractions are not cached so the next ask retries them
+        if corpus_version is not None and all(r.extracted_answer != ERROR_ANSWER for r in document_responses):
+            cache.put_response(query, document_ids, corpus_version, response, query_vector)
+        yield "done", response
@@ -0,0 +1,406 @@
+import asyncio
+import threading
+
+from app.config import (
+    LLM_MODEL, LLM_TEMPERATURE, GROQ_API_KEY, GROQ_API_BASE, LLM_GATEWAY_ENABLED, LLM_CALL_TIMEOUT, LLM_FALLBACK_MODEL, EMBEDDING_MODEL, EMBEDDING_CACHE_ENABLED, ANSWER_CACHE_ENABLED, HYBRID_SEARCH_ENABLED, RERANK_ENABLED, VECTOR_BACKEND,
+    CPU_WORKERS, CPU_MAX_PENDING, IO_WORKERS, IO_MAX_PENDING, INGEST_WORKERS
+)
+
+# Process-wide service instances, created lazily on first use (or eagerly on app startup)
+_services = {}
+_lock = threading.RLock()
+
+
+def _get_or_create(name, factory):
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = factory()
+                _services[name] = service
+    return service
+
+
+def _create_embeddings():
+    from app.services.vector_store import create_embeddings
+
+    embeddings = create_embeddings()
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+
+    from app.services.embedding_cache import CachedEmbeddings
+
+    return CachedEmbeddings(embeddings, EMBEDDING_MODEL)
+
+
+def _create_vector_store():
+    from app.services.vector_store import VectorStore
+
+    keyword_index, reranker = None, None
+    if HYBRID_SEARCH_ENABLED:
+        from app.services.keyword_index import KeywordIndex
+
+        keyword_index = KeywordIndex()
+        if RERANK_ENABLED:
+            from app.services.retrieval import CrossEncoderReranker
+
+            reranker = CrossEncoderReranker()
+
+    if VECTOR_BACKEND == "chroma":
+        vector_store = VectorStore(embeddings=get_embeddings(), keyword_index=keyword_index, reranker=reranker)
+    else:
+        from app.services.ann_store import AnnVectorStore
+
+        vector_store = AnnVectorStore(
+            VECTOR_BACKEND, embeddings=get_embeddings(), keyword_index=keyword_index, reranker=reranker
+        )
+    if keyword_index is not None and keyword_index.count() == 0:
+        # Chunks ingested before the keyword index existed
+        vector_store.sync_keyword_index()
+    return vector_store
+
+
+def _create_document_processor():
+    from app.services.document_processor import DocumentProcessor
+
+    return DocumentProcessor()
+
+
+def _create_llm():
+    # Imported lazily so that importing the app does not pull in the Groq client
+    from langchain_groq import ChatGroq
+
+    if not LLM_GATEWAY_ENABLED:
+        return ChatGroq(model=LLM_MODEL, temperature=LLM_TEMPERATURE, groq_api_key=GROQ_API_KEY, base_url=GROQ_API_BASE)
+
+    from app.services.llm_gateway import GatewayChatModel
+
+    def create(model):
+        # The gateway retries and fails over, so the Groq client does not retry on its own
+        return ChatGroq(
+            model=model, temperature=LLM_TEMPERATURE, groq_api_key=GROQ_API_KEY, base_url=GROQ_API_BASE,
+            max_retries=0, http_async_client=get_llm_http_client()
+        )
+
+    return GatewayChatModel(
+        primary=create(LLM_MODEL), fallback=create(LLM_FALLBACK_MODEL) if LLM_FALLBACK_MODEL else None,
+        gateway=get_llm_gateway()
+    )
+
+
+def _create_llm_gateway():
+    from app.services.llm_gateway import LLMGateway
+
+    return LLMGateway()
+
+
+def _create_llm_http_client():
+    from app.services.llm_gateway import create_http_client
+
+    return create_http_client()
+
+
+def _create_query_processor():
+    from app.services.query_processor import QueryProcessor
+
+    return QueryProcessor(
+        llm=get_llm(), vector_store=get_vector_store(), io_pool=get_io_pool(),
+        answer_cache=get_answer_cache(), document_index=get_document_index(),
+        context_budget=get_context_budget(),
+        # The gateway bounds each provider attempt, so time queued or backing off is not counted against a call
+        call_timeout=None if LLM_GATEWAY_ENABLED else LLM_CALL_TIMEOUT
+    )
+
+
+def _create_answer_cache():
+    from app.services.answer_cache import AnswerCache
+
+    return AnswerCache()
+
+
+def _create_context_budget():
+    from app.services.context_budget import ContextBudget
+
+    return ContextBudget()
+
+
+def _create_cpu_pool():
+    from app.services.executors import create_process_pool
+
+    return create_process_pool("cpu", CPU_WORKERS, CPU_MAX_PENDING)
+
+
+def _create_io_pool():
+    from app.services.executors import create_thread_pool
+
+    return create_thread_pool("io", IO_WORKERS, IO_MAX_PENDING)
+
+
+def _create_ingestion_queue():
+    from app.services.ingestion import IngestionQueue
+
+    return IngestionQueue()
+
+
+def _create_document_index():
+    from app.services.document_index import DocumentIndex
+
+    document_index = DocumentIndex()
+    if not document_index.backfilled():
+        # Documents ingested before the catalog existed are only in the vector store
+        ingesting = {job["doc_id"] for job in get_ingestion_queue().active_jobs()}
+        added = document_index.backfill(get_vector_store().chunk_metadata(), exclude=ingesting)
+        if added:
+            print(f"Added {added} previously ingested documents to the document catalog")
+    return document_index
+
+
+def _create_maintenance():
+    from app.services.maintenance import StoreMaintenance
+
+    return StoreMaintenance(get_document_index(), get_vector_store(), get_ingestion_queue())
+
+
+def _create_bulk_writer():
+    from app.services.bulk_writer import BulkWriter
+
+    return BulkWriter(get_vector_store(), get_io_pool())
+
+
+def _create_ingestion_worker():
+    from app.services.ingestion import IngestionWorker
+
+    return IngestionWorker(
+        get_ingestion_queue(), get_document_index(), get_document_processor(),
+        get_vector_store(), get_bulk_writer(), get_cpu_pool(), get_io_pool(),
+        concurrency=INGEST_WORKERS
+    )
+
+
+def get_embeddings():
+    """Return the shared embedding model."""
+    return _get_or_create("embeddings", _create_embeddings)
+
+
+def get_llm():
+    """Return the shared chat model used by the query pipeline."""
+    return _get_or_create("llm", _create_llm)
+
+
+def get_llm_gateway():
+    """Return the gateway that rate-limits, prioritizes and retries every LLM call of this process."""
+    return _get_or_create("llm_gateway", _create_llm_gateway)
+
+
+def get_llm_http_client():
+    """Return the keep-alive HTTP connection pool shared by the LLM clients."""
+    return _get_or_create("llm_http_client", _create_llm_http_client)
+
+
+def get_vector_store():
+    """Return the shared vector store backed by the single Chroma collection."""
+    return _get_or_create("vector_store", _create_vector_store)
+
+
+def get_document_processor():
+    """Return the shared document processor."""
+    return _get_or_create("document_processor", _create_document_processor)
+
+
+def get_query_processor():
+    """Return the shared query processor."""
+    return _get_or_create("query_processor", _create_query_processor)
+
+
+def get_answer_cache():
+    """Return the shared query answer cache, or None when it is disabled."""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return _get_or_create("answer_cache", _create_answer_cache)
+
+
+def get_context_budget():
+    """Return the shared packer that fits retrieved text into the LLM prompt budgets."""
+    return _get_or_create("context_budget", _create_context_budget)
+
+
+def get_cpu_pool():
+    """Return the shared process pool for CPU-bound extraction."""
+    return _get_or_create("cpu_pool", _create_cpu_pool)
+
+
+def get_io_pool():
+    """Return the shared thread pool for blocking I/O."""
+    return _get_or_create("io_pool", _create_io_pool)
+
+
+def get_ingestion_queue():
+    """Return the persistent ingestion job queue."""
+    return _get_or_create("ingestion_queue", _create_ingestion_queue)
+
+
+def get_document_index():
+    """Return the content-hash index of ingested documents."""
+    return _get_or_create("document_index", _create_document_index)
+
+
+def get_maintenance():
+    """Return the service that deletes documents, compacts storage and checks store consistency."""
+    return _get_or_create("maintenance", _create_maintenance)
+
+
+def get_bulk_writer():
+    """Return the writer that batches chunks from all ingestion jobs into bulk vector store writes."""
+    return _get_or_create("bulk_writer", _create_bulk_writer)
+
+
+def get_ingestion_worker():
+    """Return the background worker that drains the ingestion queue."""
+    return _get_or_create("ingestion_worker", _create_ingestion_worker)
+
+
+def set_service(name, service):
+    """Install a prebuilt service under name, e.g. a fake "llm" or "embeddings" for offline benchmarks.
+
+    Must be called before anything that depends on it is created.
+    """
+    with _lock:
+        _services[name] = service
+
+
+def pool_stats():
+    """Return queue metrics for the worker pools that have been started."""
+    return [_services[name].stats() for name in ("cpu_pool", "io_pool") if name in _services]
+
+
+def embedding_cache_stats():
+    """Return hit/miss counters of the embedding cache, or None when it is disabled or not loaded."""
+    embeddings = _services.get("embeddings")
+    return embeddings.stats() if hasattr(embeddings, "stats") else None
+
+
+def answer_cache_stats():
+    """Return hit/miss counters of the answer cache, or None when it is disabled or not loaded."""
+    cache = _services.get("answer_cache")
+    return cache.stats() if cache is not None else None
+
+
+def context_budget_stats():
+    """Return prompt tokens before and after packing per LLM stage, or None when not loaded."""
+    budget = _services.get("context_budget")
+    return budget.stats() if budget is not None else None
+
+
+def context_tokenizer():
+    """Return the tokenizer the context budget counts with ("approximate" without one), or None when not loaded."""
+    budget = _services.get("context_budget")
+    return budget.tokenizer if budget is not None else None
+
+
+def llm_gateway_stats():
+    """Return call, retry, rate-limit and failover counters of the LLM gateway, or None when it is not loaded."""
+    gateway = _services.get("llm_gateway")
+    return gateway.stats() if gateway is not None else None
+
+
+def parsing_stats():
+    """Return how often each LLM reply parse path was taken, or None when the query processor is not loaded."""
+    processor = _services.get("query_processor")
+    if processor is None:
+        return None
+    return {"paths": processor.parse_counters.stats(), "batch_fallbacks": processor.batch_fallbacks}
+
+
+def service_metrics():
+    """Return the counters and gauges of the loaded services as (name, type, help, samples) metric families."""
+    families = []
+    pools = pool_stats()
+    for field, metric_type, help_text in (
+        ("in_flight", "gauge", "Jobs queued or running in the worker pool"),
+        ("queue_depth", "gauge", "Jobs waiting for a worker"),
+        ("completed", "counter", "Jobs completed by the worker pool"),
+        ("failed", "counter", "Jobs that raised in the worker pool"),
+        ("rejected", "counter", "Jobs rejected because the worker pool was saturated"),
+    ):
+        families.append((f"pool_{field}", metric_type, help_text, [({"pool": p["name"]}, p[field]) for p in pools]))
+
+    cache_samples = []
+    embedding = embedding_cache_stats()
+    if embedding is not None:
+        for kind in ("document", "query"):
+            cache_samples.append(({"cache": f"embedding_{kind}", "result": "hit"}, embedding[f"{kind}_hits"]))
+            cache_samples.append(({"cache": f"embedding_{kind}", "result": "miss"}, embedding[f"{kind}_misses"]))
+    answers = answer_cache_stats()
+    if answers is not None:
+        for cache, stats in answers.items():
+            cache_samples.append(({"cache": f"answer_{cache}", "result": "hit"}, stats["hits"]))
+            cache_samples.append(({"cache": f"answer_{cache}", "result": "miss"}, stats["misses"]))
+    families.append(("cache_requests_total", "counter", "Cache lookups by cache and result", cache_samples))
+
+    budget = context_budget_stats() or {}
+    families.append(("context_tokens_total", "counter", "Prompt context tokens before and after packing per stage", [
+        ({"stage": stage, "kind": kind}, stats[f"tokens_{kind}"])
+        for stage, stats in budget.items() for kind in ("before", "sent")
+    ]))
+
+    parsing = parsing_stats()
+    if parsing is not None:
+        families.append(("llm_parse_total", "counter", "LLM replies by stage and the parse path that produced the result", [
+            ({"stage": stage, "path": path}, count)
+            for stage, counts in parsing["paths"].items() for path, count in counts.items()
+        ]))
+        families.append((
+            "batch_fallbacks_total", "counter", "Documents re-extracted alone after a batched extraction missed them",
+            [({}, parsing["batch_fallbacks"])]
+        ))
+
+    gateway = llm_gateway_stats()
+    if gateway is not None:
+        families.append(("llm_gateway_calls_total", "counter", "LLM gateway calls, retries, 429s, failovers and failures", [
+            ({"result": name}, gateway[name]) for name in ("calls", "retries", "rate_limited", "failovers", "failed")
+        ]))
+        families.append(("llm_gateway_in_flight", "gauge", "LLM calls running through the gateway", [({}, gateway["in_flight"])]))
+        families.append(("llm_gateway_queued", "gauge", "LLM calls waiting for a slot or rate budget", [({}, gateway["queued"])]))
+    return families
+
+
+async def start_ingestion_worker():
+    """Return the ingestion worker, starting it on first use; the services it needs are built off the event loop."""
+    worker = await asyncio.to_thread(get_ingestion_worker)
+    if not worker.running:
+        worker.start()
+    return worker
+
+
+async def stop_ingestion_worker():
+    """Stop the ingestion worker and flush the bulk writer, if they were started."""
+    worker = _services.get("ingestion_worker")
+    if worker is not None:
+        await worker.stop()
+    bulk_writer = _services.get("bulk_writer")
+    if bulk_writer is not None:
+        await bulk_writer.close()
+
+
+async def close_llm_http_client():
+    """Close the LLM keep-alive connections, if the pool was created."""
+    client = _services.pop("llm_http_client", None)
+    if client is not None:
+        await client.aclose()
+
+
+def init_services():
+    """Build every shared service up front so the first request does not pay for model loading."""
+    get_document_processor()
+    get_query_processor()
+    get_cpu_pool()
+
+
+def shutdown_services():
+    """Stop the worker pools and drop all shared services so the next access rebuilds them."""
+    with _lock:
+        for name in ("cpu_pool", "io_pool"):
+            if name in _services:
+                _services[name].shutdown()
+        _services.clear()
@@ -0,0 +1,38 @@
+from app.config import RRF_K, RERANK_MODEL
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked lists of (chunk_id, Document) into one list of (chunk_id, Document, score).
+
+    Each list contributes 1 / (k + rank) for every chunk it contains, so a chunk
+    ranked well by both dense and keyword search beats one found by only one of them.
+    """
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, (chunk_id, document) in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(chunk_id, document)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(chunk_id, documents[chunk_id], score) for chunk_id, score in fused]
+
+
+class CrossEncoderReranker:
+    """Re-scores (query, chunk) pairs with a local cross-encoder model."""
+
+    def __init__(self, model_name=RERANK_MODEL):
+        # Imported lazily so that the model is only loaded when reranking is enabled
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def rerank(self, query, candidates):
+        """Reorder (chunk_id, Document, score) candidates by cross-encoder score."""
+        if not candidates:
+            return []
+        scores = self.model.predict([(query, document.page_content) for _, document, _ in candidates])
+        reranked = [
+            (chunk_id, document, float(score))
+            for (chunk_id, document, _), score in zip(candidates, scores)
+        ]
+        reranked.sort(key=lambda item: item[2], reverse=True)
+        return reranked
@@ -0,0 +1,141 @@
+import re
+import json
+import threading
+
+# How a structured LLM reply was turned into a model, in the order the paths are tried
+PARSE_PATHS = ("native", "direct", "repaired", "llm_fixed", "failed")
+
+SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
+
+
+def extract_json_span(text):
+    """Return the first balanced JSON object or array in text, ignoring prose and code fences around it."""
+    start = next((i for i, ch in enumerate(text) if ch in "{["), None)
+    if start is None:
+        raise ValueError("No JSON found in reply")
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    # Truncated reply; let the repairs below close what they can
+    return text[start:]
+
+
+def _escape_newlines_in_strings(text):
+    out, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                out.append("\\n")
+                continue
+        elif ch == '"':
+            in_string = True
+        out.append(ch)
+    return "".join(out)
+
+
+def _close_brackets(text):
+    stack, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text, single_quotes=False):
+    """Apply deterministic fixes for the usual ways LLMs break JSON and return the repaired text.
+
+    Handles prose and code fences around the JSON, smart quotes, Python literals,
+    trailing commas, raw newlines inside strings and unclosed brackets at the end
+    of a truncated reply. With single_quotes, single-quoted keys and strings are
+    also converted, which can misfire on quotes inside string values.
+    """
+    text = extract_json_span(text.translate(SMART_QUOTES))
+    text = _escape_newlines_in_strings(text)
+    if single_quotes:
+        # 'key': 'value' -> "key": "value", only where the single quotes delimit a whole token
+        text = re.sub(r"(?<=[{\[,:\s])'([^'\"\\]*)'(?=\s*[:,}\]])", r'"\1"', text)
+    return _close_brackets(_outside_strings(text, _fix_tokens))
+
+
+STRING_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"')
+
+
+def _outside_strings(text, fix):
+    """Apply fix to the parts of text that are not inside JSON string literals."""
+    parts, last = [], 0
+    for match in STRING_PATTERN.finditer(text):
+        parts.append(fix(text[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(fix(text[last:]))
+    return "".join(parts)
+
+
+def _fix_tokens(text):
+    text = re.sub(r"\bTrue\b", "true", text)
+    text = re.sub(r"\bFalse\b", "false", text)
+    text = re.sub(r"\bNone\b", "null", text)
+    return re.sub(r",(\s*[}\]])", r"\1", text)
+
+
+def parse_json(text):
+    """Parse text as JSON, repairing it locally if needed; return (value, repaired)."""
+    try:
+        return json.loads(text), False
+    except (TypeError, ValueError):
+        pass
+    try:
+        return json.loads(repair_json(text)), True
+    except ValueError:
+        return json.loads(repair_json(text, single_quotes=True)), True
+
+
+class ParseCounters:
+    """Counts, per stage, how often each parse path produced the result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, stage, path):
+        with self._lock:
+            counts = self._counts.setdefault(stage, dict.fromkeys(PARSE_PATHS, 0))
+            counts[path] += 1
+
+    def stats(self):
+        with self._lock:
+            return {stage: dict(counts) for stage, counts in self._counts.items()}
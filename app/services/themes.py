@@ -0,0 +1,126 @@
+import re
+import math
+from collections import Counter
+
+import numpy as np
+
+from app.config import THEME_SIMILARITY_THRESHOLD, THEME_MAX_THEMES, THEME_MIN_DOCUMENTS
+
+# Words too common to name a theme after
+STOPWORDS = set("""
+a about above after again against all also an and any are as at be because been before being below between both
+but by can could did do does doing document documents down during each few for from further had has have having
+he her here hers him his how i if in into is it its itself just more most no nor not of off on once only or other
+our out over own page provided same she should so some such than that the their them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with would you
+your information context relevant mentioned states stated regarding related
+""".split())
+KEYWORDS_PER_THEME = 3
+DESCRIPTION_CHARS = 300
+
+
+def _words(text):
+    return [word for word in re.findall(r"[a-z][a-z0-9-]{2,}", text.lower()) if word not in STOPWORDS]
+
+
+def average_linkage_clusters(similarity, threshold):
+    """Agglomerative clustering of a cosine similarity matrix with average linkage.
+
+    The two clusters with the highest average pairwise similarity are merged until
+    no pair reaches threshold. Returns lists of item indexes, each in ascending order.
+    """
+    count = len(similarity)
+    linkage = similarity.astype(np.float64)
+    np.fill_diagonal(linkage, -np.inf)
+    sizes = np.ones(count)
+    members = [[i] for i in range(count)]
+    active = np.ones(count, dtype=bool)
+    while active.sum() > 1:
+        masked = np.where(active[:, None] & active[None, :], linkage, -np.inf)
+        i, j = np.unravel_index(np.argmax(masked), masked.shape)
+        if masked[i, j] < threshold:
+            break
+        # Lance-Williams update: the merged cluster's average similarity to every other cluster
+        merged = (sizes[i] * linkage[i] + sizes[j] * linkage[j]) / (sizes[i] + sizes[j])
+        linkage[i], linkage[:, i] = merged, merged
+        linkage[i, i] = -np.inf
+        sizes[i] += sizes[j]
+        active[j] = False
+        members[i] = sorted(members[i] + members[j])
+    return [members[i] for i in np.flatnonzero(active)]
+
+
+class ThemeClusterer:
+    """Finds themes shared by several documents by clustering their extracted answers.
+
+    Answers are embedded with the already loaded embedding model and grouped by
+    average-linkage clustering on cosine similarity. Each cluster is a theme
+    supported by its documents; its confidence grows with how similar the answers
+    are and how many of the documents share it. Themes are named after keywords
+    frequent in the cluster but rare in the other answers.
+    """
+
+    def __init__(self, embeddings, threshold=THEME_SIMILARITY_THRESHOLD, max_themes=THEME_MAX_THEMES,
+                 min_documents=THEME_MIN_DOCUMENTS):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_themes = max_themes
+        self.min_documents = min_documents
+
+    def cluster(self, answers):
+        """Return theme dicts for (doc_id, text, relevance) answers, most supported theme first.
+
+        Each theme has theme_name, theme_description, supporting_documents,
+        confidence and excerpts (the answer texts of the cluster, most central first).
+        """
+        if len(answers) < self.min_documents:
+            return []
+        vectors = np.asarray(self.embeddings.embed_documents([text for _, text, _ in answers]), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+
+        clusters = [
+            members for members in average_linkage_clusters(similarity, self.threshold)
+            if len(members) >= self.min_documents
+        ]
+        # Most supported first: total relevance of the documents in the cluster
+        clusters.sort(key=lambda members: (-sum(answers[i][2] for i in members), members[0]))
+        clusters = clusters[:self.max_themes]
+
+        document_words = [set(_words(text)) for _, text, _ in answers]
+        document_frequency = Counter(word for words in document_words for word in words)
+        themes = []
+        for members in clusters:
+            block = similarity[np.ix_(members, members)]
+            # Mean similarity to the other members; the most central answer describes the theme.
+            # A single answer (THEME_MIN_DOCUMENTS=1) has no other members to agree with.
+            centrality = (block.sum(axis=1) - 1) / (len(members) - 1) if len(members) > 1 else np.zeros(1)
+            order = [members[i] for i in np.argsort(-centrality, kind="stable")]
+            cohesion = float(np.clip(centrality.mean(), 0, 1))
+            coverage = len(members) / len(answers)
+            keywords = self._keywords(members, document_words, document_frequency, len(answers))
+            themes.append({
+                "theme_name": ", ".join(keywords).capitalize() if keywords else f"Theme {len(themes) + 1}",
+                "theme_description": self._describe(answers[order[0]][1], len(members)),
+                "supporting_documents": [answers[i][0] for i in members],
+                "confidence": max(1, min(10, round(10 * (0.7 * cohesion + 0.3 * coverage)))),
+                "excerpts": [answers[i][1] for i in order],
+            })
+        return themes
+
+    @staticmethod
+    def _keywords(members, document_words, document_frequency, total):
+        """Words in most of the cluster's answers, weighted by how rare they are among all answers."""
+        in_cluster = Counter(word for i in members for word in document_words[i])
+        scores = {
+            word: count * math.log(1 + total / document_frequency[word])
+            for word, count in in_cluster.items() if count > 1 or len(members) == 1
+        }
+        return sorted(scores, key=lambda word: (-scores[word], word))[:KEYWORDS_PER_THEME]
+
+    @staticmethod
+    def _describe(text, documents):
+        text = " ".join(text.split())
+        if len(text) > DESCRIPTION_CHARS:
+            text = text[:DESCRIPTION_CHARS].rsplit(" ", 1)[0] + "..."
+        return f"Shared by {documents} document{'' if documents == 1 else 's'}, e.g.: {text}"
@@ -1,40 +1,323 @@
 import os
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from app.config import DB_DIR, CHROMA_COLLECTION_NAME
+import time
+import threading
+from langchain_core.documents import Document
+
+from app.config import (
+    DB_DIR, CHROMA_COLLECTION_NAME, EMBEDDING_MODEL, EMBED_BATCH_SIZE, EMBED_MULTI_PROCESS,
+    PERSIST_EVERY_N_CHUNKS, PERSIST_INTERVAL_SECONDS, HYBRID_CANDIDATES_FACTOR, RERANK_CANDIDATES,
+    HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH
+)
+from app.services.metrics import track_stage
+from app.services.retrieval import reciprocal_rank_fusion
+
+# chromadb releases whose internals the search ef update and compaction below are written against
+CHROMA_INTERNALS_VERSIONS = ("0.5.",)
+
+
+def chroma_internals_supported():
+    import chromadb
+
+    return chromadb.__version__.startswith(CHROMA_INTERNALS_VERSIONS)
+
+
+def create_embeddings():
+    """Load the sentence-transformers embedding model used for chunks and queries."""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"batch_size": EMBED_BATCH_SIZE},
+        multi_process=EMBED_MULTI_PROCESS
+    )
+
 
 class VectorStore:
-    def __init__(self):
+    """Chroma collection of document chunks, optionally paired with a BM25 keyword index.
+
+    With a keyword_index, every write and delete is mirrored into it and searches
+    fuse dense and keyword results; a reranker, if given, re-scores the fused list.
+    """
+
+    def __init__(self, embeddings=None, persist_directory=DB_DIR, collection_name=CHROMA_COLLECTION_NAME,
+                 keyword_index=None, reranker=None):
+        # Imported lazily so that importing the app does not pull in chromadb
+        from langchain_community.vectorstores import Chroma
+
         # Ensure DB_DIR exists (should already be created by your config)
-        if not os.path.exists(DB_DIR):
-            os.makedirs(DB_DIR, exist_ok=True)
+        if not os.path.exists(persist_directory):
+            os.makedirs(persist_directory, exist_ok=True)
 
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={"device": "cpu"}
-        )
+        self.embeddings = embeddings or create_embeddings()
         self.vectorstore = Chroma(
-            collection_name=CHROMA_COLLECTION_NAME,
+            collection_name=collection_name,
             embedding_function=self.embeddings,
-            persist_directory=str(DB_DIR)
+            persist_directory=str(persist_directory),
+            # Graph parameters only take effect when the collection is first created
+            collection_metadata={
+                "hnsw:M": HNSW_M, "hnsw:construction_ef": HNSW_EF_CONSTRUCTION, "hnsw:search_ef": HNSW_EF_SEARCH
+            }
         )
+        self._apply_search_ef(HNSW_EF_SEARCH)
+        self.keyword_index = keyword_index
+        self.reranker = reranker
+        self._persist_lock = threading.Lock()
+        self._unpersisted = 0
+        self._last_persist = time.monotonic()
+
+    def _apply_search_ef(self, ef_search):
+        """Update the query-time HNSW breadth of an existing collection; unlike M it can change after creation.
 
-    def add_documents(self, documents):
+        Chroma 0.5 copies the HNSW settings into the collection's vector segment when
+        the collection is created, and collection.modify() does not update them, so
+        the segment's own setting (and its index, if loaded) is updated and read back.
+        That relies on Chroma internals; on other releases only the collection
+        metadata is updated.
+        """
+        collection = self.vectorstore._collection
+        metadata = collection.metadata or {}
+        modified = metadata.get("hnsw:search_ef") != ef_search
+        if modified:
+            try:
+                collection.modify(metadata={**metadata, "hnsw:search_ef": ef_search})
+            except Exception as e:
+                print(f"Error updating hnsw:search_ef of the collection: {e}")
+        if not chroma_internals_supported():
+            if modified:
+                print("Cannot check that this chromadb release applies hnsw:search_ef to an existing collection")
+            return
         try:
-            ids = self.vectorstore.add_documents(documents)
-            self.vectorstore.persist()
+            self._set_segment_search_ef(ef_search)
+        except Exception as e:
+            print(f"Error applying hnsw:search_ef to the collection's HNSW segment: {e}")
+
+    def _vector_segment(self):
+        from chromadb.types import SegmentScope
+
+        server = self.vectorstore._client._server
+        segments = server._sysdb.get_segments(collection=self.vectorstore._collection.id)
+        return server, next(segment for segment in segments if segment["scope"] == SegmentScope.VECTOR)
+
+    def _set_segment_search_ef(self, ef_search):
+        from chromadb.segment import VectorReader
+
+        server, segment = self._vector_segment()
+        if (segment["metadata"] or {}).get("hnsw:search_ef") == ef_search:
+            return
+        collection_id = self.vectorstore._collection.id
+        server._sysdb.update_segment(collection_id, segment["id"], metadata={"hnsw:search_ef": ef_search})
+        # The segment may already be loaded with the old value
+        instance = server._manager.get_segment(collection_id, VectorReader)
+        instance._params.search_ef = ef_search
+        if getattr(instance, "_index", None) is not None:
+            instance._index.set_ef(ef_search)
+        _, segment = self._vector_segment()
+        applied = (segment["metadata"] or {}).get("hnsw:search_ef")
+        if applied != ef_search:
+            print(f"hnsw:search_ef of the collection's HNSW segment is still {applied}, not {ef_search}")
+
+    def add_documents(self, documents, ids=None):
+        try:
+            ids = self.vectorstore.add_documents(documents, ids=ids)
+            if self.keyword_index is not None:
+                self.keyword_index.upsert(
+                    ids, [doc.page_content for doc in documents], [doc.metadata for doc in documents]
+                )
+            self._maybe_persist(len(documents))
             return ids
         except Exception as e:
             print(f"Error adding documents to vector store: {e}")
             raise
 
-    def similarity_search(self, query, k=5):
+    def upsert_documents(self, documents, ids):
+        """Embed documents in one model call and upsert them with as few Chroma writes as possible."""
+        try:
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            with track_stage("ingest", "embed"):
+                vectors = self.embeddings.embed_documents(texts)
+
+            collection = self.vectorstore._collection
+            max_batch = self._max_batch_size()
+            with track_stage("ingest", "vector_write"):
+                for start in range(0, len(ids), max_batch):
+                    end = start + max_batch
+                    collection.upsert(
+                        ids=ids[start:end], embeddings=vectors[start:end],
+                        metadatas=metadatas[start:end], documents=texts[start:end]
+                    )
+            if self.keyword_index is not None:
+                with track_stage("ingest", "keyword_write"):
+                    self.keyword_index.upsert(ids, texts, metadatas)
+            self._maybe_persist(len(documents))
+        except Exception as e:
+            print(f"Error upserting documents to vector store: {e}")
+            raise
+
+    def _max_batch_size(self):
+        client = self.vectorstore._client
+        try:
+            return client.get_max_batch_size()
+        except AttributeError:
+            return getattr(client, "max_batch_size", 5000)
+
+    def _maybe_persist(self, written):
+        """Persist once enough chunks were written or enough time has passed, instead of on every write."""
+        with self._persist_lock:
+            self._unpersisted += written
+            due = (
+                self._unpersisted >= PERSIST_EVERY_N_CHUNKS
+                or time.monotonic() - self._last_persist >= PERSIST_INTERVAL_SECONDS
+            )
+        if due:
+            self.persist()
+
+    def persist(self):
+        """Flush the collection to disk."""
+        with self._persist_lock:
+            self._unpersisted = 0
+            self._last_persist = time.monotonic()
+        self.vectorstore.persist()
+
+    def delete_document(self, doc_id):
+        """Remove every chunk of a document from the collection."""
+        self.vectorstore._collection.delete(where={"id": doc_id})
+        if self.keyword_index is not None:
+            self.keyword_index.delete_document(doc_id)
+
+    def delete_documents(self, doc_ids):
+        """Remove every chunk of several documents with one metadata-filtered delete."""
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        self.vectorstore._collection.delete(where=self._document_filter(doc_ids))
+        if self.keyword_index is not None:
+            for doc_id in doc_ids:
+                self.keyword_index.delete_document(doc_id)
+
+    def delete_chunks(self, ids):
+        """Remove chunks by id."""
+        if ids:
+            self.vectorstore.delete(ids=list(ids))
+            if self.keyword_index is not None:
+                self.keyword_index.delete(ids)
+
+    def chunk_refs(self, page_size=1000):
+        """Yield (chunk_id, doc_id) for every chunk in the collection."""
+        for chunk_id, metadata in self.chunk_metadata(page_size):
+            yield chunk_id, metadata.get("id")
+
+    def chunk_metadata(self, page_size=1000):
+        """Yield (chunk_id, metadata) for every chunk in the collection."""
+        collection = self.vectorstore._collection
+        offset = 0
+        while True:
+            batch = collection.get(limit=page_size, offset=offset, include=["metadatas"])
+            if not batch["ids"]:
+                return
+            for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+                yield chunk_id, metadata or {}
+            offset += len(batch["ids"])
+
+    def compact(self):
+        """Reclaim the space left by deleted chunks.
+
+        Chroma keeps every write in its embeddings log until it is purged, so the
+        log is purged and the SQLite file vacuumed. Deleted vectors in the HNSW
+        segment are not removed from disk; their slots are reused by later writes.
+        Purging uses Chroma internals, so on other chromadb releases, or if it
+        fails, only the keyword index is compacted.
+        """
+        self.persist()
+        if chroma_internals_supported():
+            try:
+                from chromadb.db.impl.sqlite import SqliteDB
+
+                db = self.vectorstore._client._system.instance(SqliteDB)
+                db.purge_log(collection_id=self.vectorstore._collection.id)
+                db.vacuum(timeout=60)
+            except Exception as e:
+                print(f"Error compacting the Chroma collection: {e}")
+        else:
+            print("Compacting the Chroma collection is not supported with this chromadb release; skipping it")
+        if self.keyword_index is not None:
+            self.keyword_index.compact()
+
+    def sync_keyword_index(self, page_size=1000):
+        """Index every chunk already in the collection, e.g. chunks ingested before the keyword index existed."""
+        collection = self.vectorstore._collection
+        offset = 0
+        while True:
+            batch = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not batch["ids"]:
+                break
+            self.keyword_index.upsert(batch["ids"], batch["documents"], batch["metadatas"])
+            offset += len(batch["ids"])
+        return offset
+
+    def similarity_search(self, query, k=5, document_ids=None):
+        """Return up to k (Document, score) pairs for the query.
+
+        Without a keyword index the score is the Chroma distance (lower is better);
+        with one it is the fused or reranked score (higher is better).
+        """
         try:
-            return self.vectorstore.similarity_search_with_score(query, k=k)
+            if self.keyword_index is None:
+                return self._scored_search(query, k, document_ids)
+            return self._hybrid_search(query, k, document_ids)
         except Exception as e:
             print(f"Error searching vector store: {e}")
             return []
 
+    def _scored_search(self, query, k, document_ids):
+        with track_stage("query", "embed_query"):
+            vector = self.embeddings.embed_query(query)
+        with track_stage("query", "vector_search"):
+            return self.vectorstore.similarity_search_by_vector_with_relevance_scores(
+                vector, k=k, filter=self._document_filter(document_ids)
+            )
+
+    def _hybrid_search(self, query, k, document_ids):
+        candidates = k * HYBRID_CANDIDATES_FACTOR
+        dense = self._dense_search(query, candidates, document_ids)
+        with track_stage("query", "keyword_search"):
+            keyword = [
+                (chunk_id, Document(page_content=text, metadata=metadata))
+                for chunk_id, text, metadata, _ in self.keyword_index.search(query, candidates, document_ids)
+            ]
+        fused = reciprocal_rank_fusion([dense, keyword])
+        if self.reranker is not None:
+            with track_stage("query", "rerank"):
+                fused = self.reranker.rerank(query, fused[:max(k, RERANK_CANDIDATES)])
+        return [(document, score) for _, document, score in fused[:k]]
+
+    def _dense_search(self, query, k, document_ids):
+        """Return the k nearest chunks as (chunk_id, Document) pairs, nearest first."""
+        collection = self.vectorstore._collection
+        with track_stage("query", "embed_query"):
+            vector = self.embeddings.embed_query(query)
+        with track_stage("query", "vector_search"):
+            result = collection.query(
+                query_embeddings=[vector],
+                n_results=k,
+                where=self._document_filter(document_ids),
+                include=["documents", "metadatas"]
+            )
+        return [
+            (chunk_id, Document(page_content=text, metadata=metadata or {}))
+            for chunk_id, text, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])
+        ]
+
+    @staticmethod
+    def _document_filter(document_ids):
+        """Build a Chroma metadata filter restricting results to the given document ids."""
+        if not document_ids:
+            return None
+        if len(document_ids) == 1:
+            return {"id": document_ids[0]}
+        return {"id": {"$in": list(document_ids)}}
+
     def get_all_documents(self):
         try:
             return self.vectorstore.get()
@@ -0,0 +1,169 @@
+"""Measure recall@k, query latency, build time and memory of the vector index backends.
+
+Generates clustered synthetic vectors (like sentence embeddings, they are not
+uniformly spread), computes exact neighbours for a sample of queries by brute
+force, then builds each index configuration and sweeps ef_search over it:
+
+  hnswlib        - local HNSW graph, float32 (one build per M)
+  faiss          - local HNSW graph per --quantization (float32/float16/int8), if faiss-cpu is installed
+  chroma         - a Chroma collection with the same HNSW parameters (--chroma; slow to build at 1M)
+
+RSS is the growth of this process's resident memory while the index was built,
+so run one size per process for clean numbers at 1M vectors; index~ is the size
+of the vectors and graph links computed from the index parameters.
+
+Usage: python -m benchmarks.bench_ann --sizes 100000 1000000 --M 16 32 --ef-search 32 64 128
+"""
+import gc
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from app.services.ann_index import HnswlibIndex, FaissIndex
+
+BUILD_BATCH = 10000
+
+
+def rss_bytes():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def make_vectors(count, dim, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, BUILD_BATCH):
+        end = min(start + BUILD_BATCH, count)
+        assignment = rng.integers(0, clusters, end - start)
+        vectors[start:end] = centers[assignment] + 0.5 * rng.standard_normal((end - start, dim)).astype(np.float32)
+    return vectors
+
+
+def exact_neighbours(vectors, queries, k):
+    """Brute-force l2 top-k, in blocks so 1M vectors do not need a full distance matrix."""
+    best_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    query_norms = (queries ** 2).sum(axis=1)[:, None]
+    for start in range(0, len(vectors), 100000):
+        block = vectors[start:start + 100000]
+        dist = query_norms - 2 * queries @ block.T + (block ** 2).sum(axis=1)[None, :]
+        ids = np.arange(start, start + len(block))[None, :].repeat(len(queries), axis=0)
+        merged_dist = np.concatenate([best_dist, dist], axis=1)
+        merged_ids = np.concatenate([best_ids, ids], axis=1)
+        order = np.argsort(merged_dist, axis=1)[:, :k]
+        best_dist = np.take_along_axis(merged_dist, order, axis=1)
+        best_ids = np.take_along_axis(merged_ids, order, axis=1)
+    return [set(row) for row in best_ids.tolist()]
+
+
+def build(index, vectors):
+    gc.collect()
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), BUILD_BATCH):
+        block = vectors[offset:offset + BUILD_BATCH]
+        index.add(list(range(offset, offset + len(block))), block)
+    return time.perf_counter() - start, rss_bytes() - rss_before
+
+
+def measure(search, queries, truth, k):
+    latencies, found = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        labels = search(query, k)
+        latencies.append(time.perf_counter() - start)
+        found += len(expected & set(labels))
+    latencies = np.array(latencies) * 1000
+    return found / (len(queries) * k), np.percentile(latencies, [50, 95, 99])
+
+
+def report(label, size, build_seconds, rss, ef_search, recall, percentiles, index_bytes=None):
+    p50, p95, p99 = percentiles
+    estimate = f"{index_bytes / 2**20:7.0f}MB" if index_bytes is not None else "      -"
+    print(f"{label:<22} n={size:<8} build={build_seconds:7.1f}s rss=+{rss / 2**20:7.0f}MB index~{estimate} "
+          f"ef={ef_search:<4} recall={recall:.3f} p50={p50:6.2f}ms p95={p95:6.2f}ms p99={p99:6.2f}ms")
+
+
+def run_local(label, index, vectors, queries, truth, args):
+    build_seconds, rss = build(index, vectors)
+    for ef_search in args.ef_search:
+        index.set_ef_search(ef_search)
+        recall, percentiles = measure(lambda q, k: index.search(q, k)[0], queries, truth, args.k)
+        report(label, len(vectors), build_seconds, rss, ef_search, recall, percentiles, index.memory_bytes())
+
+
+def run_chroma(vectors, queries, truth, M, args):
+    import chromadb
+
+    with tempfile.TemporaryDirectory() as directory:
+        client = chromadb.PersistentClient(path=directory)
+        collection = client.create_collection("bench_collection", metadata={
+            "hnsw:M": M, "hnsw:construction_ef": args.ef_construction, "hnsw:search_ef": args.ef_search[0]
+        })
+        gc.collect()
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        for offset in range(0, len(vectors), 5000):
+            block = vectors[offset:offset + 5000]
+            collection.add(ids=[str(i) for i in range(offset, offset + len(block))], embeddings=block.tolist())
+        build_seconds, rss = time.perf_counter() - start, rss_bytes() - rss_before
+
+        def search(query, k):
+            result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+            return [int(i) for i in result["ids"][0]]
+
+        # Chroma fixes search_ef when the segment is loaded, so only the first value is measured
+        recall, percentiles = measure(search, queries, truth, args.k)
+        report(f"chroma M={M}", len(vectors), build_seconds, rss, args.ef_search[0], recall, percentiles)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--M", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--quantization", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument("--chroma", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        import faiss  # noqa: F401
+        has_faiss = True
+    except ImportError:
+        print("faiss-cpu is not installed; skipping the faiss backend")
+        has_faiss = False
+
+    for size in args.sizes:
+        vectors = make_vectors(size + args.queries, args.dim)
+        vectors, queries = vectors[:size], vectors[size:]
+        truth = exact_neighbours(vectors, queries, args.k)
+
+        for M in args.M:
+            with tempfile.TemporaryDirectory() as directory:
+                index = HnswlibIndex(f"{directory}/index", M=M, ef_construction=args.ef_construction)
+                run_local(f"hnswlib M={M}", index, vectors, queries, truth, args)
+                del index
+            if has_faiss:
+                for quantization in args.quantization:
+                    with tempfile.TemporaryDirectory() as directory:
+                        index = FaissIndex(
+                            f"{directory}/index", M=M, ef_construction=args.ef_construction, quantization=quantization
+                        )
+                        run_local(f"faiss M={M} {quantization}", index, vectors, queries, truth, args)
+                        del index
+            if args.chroma:
+                run_chroma(vectors, queries, truth, M, args)
+
+
+if __name__ == "__main__":
+    main()
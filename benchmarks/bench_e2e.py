@@ -0,0 +1,334 @@
+"""Offline end-to-end load test of the FastAPI app with a generated corpus and a fake chat model.
+
+  ingest - uploads a corpus of PDFs, DOCX files and PNG scans through POST /api/documents/upload
+           and polls the jobs until they finish; reports documents, pages and chunks per second,
+           per-job extract/index times and failures per format
+  query  - sends --queries POST /api/query requests at each --concurrency level; reports
+           p50/p95/p99 latency, throughput, errors, LLM calls and reply parsing outcomes
+
+Requests go through the full ASGI app (middleware, routes, ingestion worker, pools) in this
+process, with the app's data in a scratch DATA_DIR. FakeChatModel answers after --latency
+seconds and breaks --malformed-rate of its JSON replies, in process or, with --llm mock-server,
+over HTTP through the LLM gateway to a local mock Groq API; embeddings are hash-based unless
+--embeddings model. The answer cache is off unless --answer-cache, so every query reaches
+the LLM. Image OCR needs the tesseract binary; without it scans show up as failed jobs.
+
+Results are written as JSON with the git commit (default benchmarks/results/) and two runs
+can be compared with benchmarks.compare.
+
+Usage: python -m benchmarks.bench_e2e --pdfs 20 --docxs 10 --images 5 --queries 40 --concurrency 1 4 16
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+
+from benchmarks.fixtures import WORDS, generate_corpus
+
+TERMINAL_STATUSES = ("done", "failed", "duplicate")
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".png": "image/png",
+}
+
+
+def rss_bytes():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def memory_snapshot():
+    # Of the app process only; ru_maxrss is in kilobytes on Linux
+    return {"rss_bytes": rss_bytes(), "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(values))}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_queries(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        f"What do the documents say about {rng.choice(WORDS)} and {rng.choice(WORDS)} in case CASE-{rng.randint(1, 5):05d}?"
+        for _ in range(count)
+    ]
+
+
+def file_format(path):
+    return os.path.splitext(path)[1].lstrip(".")
+
+
+async def wait_for_batches(client, batch_ids, poll_interval, timeout):
+    """Poll the upload batches until every job has finished; returns all jobs."""
+    deadline = time.monotonic() + timeout
+    pending = list(batch_ids)
+    finished = []
+    while pending:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{len(pending)} upload batches still running after {timeout}s")
+        still_pending = []
+        for batch_id in pending:
+            jobs = (await client.get(f"/api/ingest/batches/{batch_id}")).json()["jobs"]
+            if all(job["status"] in TERMINAL_STATUSES for job in jobs):
+                finished.extend(jobs)
+            else:
+                still_pending.append(batch_id)
+        pending = still_pending
+        if pending:
+            await asyncio.sleep(poll_interval)
+    return finished
+
+
+async def total_pages(client):
+    pages, cursor = 0, None
+    while True:
+        params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+        body = (await client.get("/api/documents", params=params)).json()
+        pages += sum(document["page_count"] or 0 for document in body["documents"])
+        cursor = body["next_cursor"]
+        if not cursor:
+            return pages
+
+
+async def run_ingest(client, paths, upload_batch, timeout):
+    start = time.perf_counter()
+    batch_ids = []
+    for offset in range(0, len(paths), upload_batch):
+        files = []
+        for path in paths[offset:offset + upload_batch]:
+            with open(path, "rb") as f:
+                files.append(("files", (os.path.basename(path), f.read(), CONTENT_TYPES[os.path.splitext(path)[1]])))
+        response = await client.post("/api/documents/upload", files=files)
+        response.raise_for_status()
+        batch_ids.append(response.json()["batch_id"])
+    upload_seconds = time.perf_counter() - start
+    jobs = await wait_for_batches(client, batch_ids, poll_interval=0.05, timeout=timeout)
+    elapsed = time.perf_counter() - start
+
+    done = [job for job in jobs if job["status"] == "done"]
+    failures = {}
+    for job in jobs:
+        if job["status"] == "failed":
+            failures[file_format(job["filename"])] = failures.get(file_format(job["filename"]), 0) + 1
+    chunks = sum(job["chunk_count"] or 0 for job in done)
+    pages = await total_pages(client)
+    return {
+        "files": len(paths),
+        "documents": len(done),
+        "pages": pages,
+        "chunks": chunks,
+        "failed": failures,
+        "upload_seconds": upload_seconds,
+        "elapsed_seconds": elapsed,
+        "documents_per_second": len(done) / elapsed,
+        "pages_per_second": pages / elapsed,
+        "chunks_per_second": chunks / elapsed,
+        "job_extract_seconds": percentiles([job["extract_seconds"] for job in done if job["extract_seconds"] is not None]),
+        "job_index_seconds": percentiles([job["index_seconds"] for job in done if job["index_seconds"] is not None]),
+    }
+
+
+def parse_totals(parsing):
+    """Sum the parse path counters over all stages."""
+    totals = {}
+    for counts in ((parsing or {}).get("paths") or {}).values():
+        for path, count in counts.items():
+            totals[path] = totals.get(path, 0) + count
+    return totals
+
+
+async def run_queries(client, llm, queries, concurrency, error_answer):
+    parsing_before = parse_totals((await client.get("/api/system/parsing")).json()["parsing"])
+    gateway_before = (await client.get("/api/system/llm-gateway")).json()["llm_gateway"] or {}
+    calls_before, malformed_before = llm.calls, llm.malformed
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors, error_answers, themes = [], 0, 0, 0
+
+    async def one(query):
+        nonlocal errors, error_answers, themes
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/query", json={"query": query})
+            latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors += 1
+            return
+        body = response.json()
+        error_answers += sum(1 for answer in body["document_responses"] if answer["extracted_answer"] == error_answer)
+        themes += len(body["identified_themes"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    elapsed = time.perf_counter() - start
+
+    parsing_after = parse_totals((await client.get("/api/system/parsing")).json()["parsing"])
+    gateway_after = (await client.get("/api/system/llm-gateway")).json()["llm_gateway"] or {}
+    return {
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "elapsed_seconds": elapsed,
+        "queries_per_second": len(queries) / elapsed,
+        "latency_seconds": percentiles(latencies),
+        "errors": errors,
+        "error_answers": error_answers,
+        "themes": themes,
+        "llm_calls": llm.calls - calls_before,
+        "llm_malformed_replies": llm.malformed - malformed_before,
+        "parse_paths": {
+            path: count - parsing_before.get(path, 0) for path, count in parsing_after.items()
+            if count - parsing_before.get(path, 0)
+        },
+        "llm_gateway": {
+            name: gateway_after[name] - gateway_before.get(name, 0)
+            for name in ("calls", "retries", "rate_limited", "failovers", "failed") if name in gateway_after
+        },
+        "memory": memory_snapshot(),
+    }
+
+
+async def run(args, corpus_dir, llm=None):
+    import httpx
+
+    from app.main import app
+    from app.services.registry import set_service
+    from app.services.query_processor import ERROR_ANSWER
+    from benchmarks.fake_llm import FakeChatModel
+
+    if llm is None:
+        llm = FakeChatModel(latency=args.latency, malformed_rate=args.malformed_rate, seed=args.seed)
+        set_service("llm", llm)
+    if args.embeddings == "fake":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+
+        set_service("embeddings", DeterministicFakeEmbedding(size=384))
+
+    results = {"memory": {"baseline": memory_snapshot()}}
+    paths = generate_corpus(
+        corpus_dir, pdfs=args.pdfs, docxs=args.docxs, images=args.images, pdf_pages=args.pdf_pages, seed=args.seed
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        results["memory"]["startup"] = memory_snapshot()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            results["ingest"] = await run_ingest(client, paths, args.upload_batch, args.ingest_timeout)
+            results["memory"]["after_ingest"] = memory_snapshot()
+            print_ingest(results["ingest"])
+
+            queries = make_queries(args.queries, seed=args.seed)
+            # One unmeasured query loads whatever the first request would otherwise pay for
+            await client.post("/api/query", json={"query": queries[0]})
+            results["query"] = []
+            for concurrency in args.concurrency:
+                level = await run_queries(client, llm, queries, concurrency, ERROR_ANSWER)
+                results["query"].append(level)
+                print_query(level)
+    results["memory"]["final"] = memory_snapshot()
+    return results
+
+
+def print_ingest(ingest):
+    print(f"ingest  files={ingest['files']} docs={ingest['documents']} pages={ingest['pages']} "
+          f"chunks={ingest['chunks']} failed={ingest['failed'] or 0} elapsed={ingest['elapsed_seconds']:.2f}s "
+          f"docs/s={ingest['documents_per_second']:.1f} pages/s={ingest['pages_per_second']:.1f} "
+          f"chunks/s={ingest['chunks_per_second']:.0f}")
+
+
+def print_query(level):
+    latency = level["latency_seconds"]
+    print(f"query   concurrency={level['concurrency']:<3} q/s={level['queries_per_second']:6.2f} "
+          f"p50={latency['p50']:.3f}s p95={latency['p95']:.3f}s p99={latency['p99']:.3f}s "
+          f"errors={level['errors']} error_answers={level['error_answers']} llm_calls={level['llm_calls']} "
+          f"malformed={level['llm_malformed_replies']} rss={level['memory']['rss_bytes'] / 2**20:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdfs", type=int, default=20)
+    parser.add_argument("--docxs", type=int, default=10)
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--upload-batch", type=int, default=10, help="files per upload request")
+    parser.add_argument("--ingest-timeout", type=float, default=600)
+    parser.add_argument("--queries", type=int, default=40, help="queries per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of JSON replies the LLM breaks")
+    parser.add_argument("--llm", choices=["fake", "mock-server"], default="fake",
+                        help="mock-server sends LLM calls over HTTP through the LLM gateway to a local mock Groq API")
+    parser.add_argument("--server-rpm", type=int, default=0, help="requests per minute the mock server allows")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="share of requests the mock server fails")
+    parser.add_argument("--embeddings", choices=["fake", "model"], default="fake")
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result file (default benchmarks/results/e2e-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    with tempfile.TemporaryDirectory() as data_dir, tempfile.TemporaryDirectory() as corpus_dir:
+        # The app reads its configuration on import, so the environment is set up first
+        os.environ["DATA_DIR"] = data_dir
+        os.environ["ANSWER_CACHE_ENABLED"] = "true" if args.answer_cache else "false"
+        server, llm = None, None
+        if args.llm == "mock-server":
+            from benchmarks.mock_llm_server import create_app, serve_in_thread
+
+            mock_app = create_app(
+                latency=args.latency, requests_per_window=args.server_rpm, error_rate=args.server_error_rate,
+                malformed_rate=args.malformed_rate, seed=args.seed
+            )
+            server, base_url = serve_in_thread(mock_app)
+            llm = mock_app.state.answers
+            os.environ["GROQ_API_BASE"] = base_url
+            os.environ.setdefault("GROQ_API_KEY", "mock")
+            # Client-side limits match the mock server's unless set explicitly
+            os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", str(args.server_rpm))
+            os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "0")
+        try:
+            results = asyncio.run(run(args, corpus_dir, llm))
+        finally:
+            if server is not None:
+                server.should_exit = True
+
+    results = {
+        "benchmark": "e2e",
+        "git_commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "args": vars(args),
+        **results,
+    }
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"e2e-{commit or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
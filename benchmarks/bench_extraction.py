@@ -0,0 +1,66 @@
+"""Measure page extraction throughput, single process vs fanned out across the CPU pool.
+
+Generates a text-layer PDF and a multi-page TIFF (OCR, needs the tesseract binary) and
+extracts them once in-process and once through DocumentProcessor.aiter_pages.
+
+Usage: python -m benchmarks.bench_extraction --pdf-pages 500 --tiff-pages 20 --workers 4
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from app.services.document_processor import DocumentProcessor
+from app.services.executors import create_process_pool
+from benchmarks.fixtures import write_text_pdf, write_multipage_tiff
+
+
+def extract_sequential(file_path, file_ext):
+    start = time.perf_counter()
+    pages = list(DocumentProcessor.iter_pages(file_path, file_ext))
+    return len(pages), time.perf_counter() - start
+
+
+async def extract_parallel(processor, file_path, file_ext, pool):
+    start = time.perf_counter()
+    pages = [page async for page in processor.aiter_pages(file_path, file_ext, pool)]
+    return len(pages), time.perf_counter() - start
+
+
+def report(label, pages, seconds):
+    print(f"{label:<28} pages={pages:<5} seconds={seconds:7.2f} pages/sec={pages / seconds:8.1f}")
+
+
+async def run(files, workers):
+    processor = DocumentProcessor()
+    pool = create_process_pool("bench", workers, max_pending=workers * 4)
+    try:
+        # Start the worker processes before timing anything
+        await asyncio.gather(*[pool.run(time.sleep, 0) for _ in range(workers)])
+        for file_path, file_ext in files:
+            name = os.path.basename(file_path)
+            try:
+                report(f"{name} sequential", *extract_sequential(file_path, file_ext))
+                report(f"{name} pool x{workers}", *await extract_parallel(processor, file_path, file_ext, pool))
+            except Exception as e:
+                print(f"{name}: skipped ({e})")
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf-pages", type=int, default=500)
+    parser.add_argument("--tiff-pages", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = write_text_pdf(os.path.join(tmp, "bench.pdf"), args.pdf_pages)
+        tiff_path = write_multipage_tiff(os.path.join(tmp, "bench.tiff"), args.tiff_pages)
+        asyncio.run(run([(pdf_path, ".pdf"), (tiff_path, ".tiff")], args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Compare chunks/sec of per-file vector store writes against the bulk ingest path.
+
+  per-file - one add_documents call and one persist per file, as uploads used to do
+  bulk     - all files' chunks go through BulkWriter, which embeds and upserts them
+             in CHROMA_WRITE_BATCH_SIZE batches and persists on the time/size policy
+
+Uses the real embedding model by default; --embeddings fake swaps in random vectors
+to measure only the Chroma side.
+
+Usage: python -m benchmarks.bench_ingest --files 50 --chunks-per-file 40
+"""
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+from langchain_core.documents import Document
+
+from app.services.bulk_writer import BulkWriter
+from app.services.executors import create_thread_pool
+from app.services.vector_store import VectorStore, create_embeddings
+from benchmarks.fixtures import lorem
+
+
+def make_files(num_files, chunks_per_file, seed=0):
+    rng = random.Random(seed)
+    files = []
+    for f in range(num_files):
+        chunks = [
+            Document(page_content=lorem(rng, 150), metadata={"id": f"doc-{f}", "filename": f"doc-{f}.pdf"})
+            for _ in range(chunks_per_file)
+        ]
+        files.append((chunks, [f"doc-{f}:{c}" for c in range(chunks_per_file)]))
+    return files
+
+
+def make_store(embeddings, directory):
+    return VectorStore(embeddings=embeddings, persist_directory=directory, collection_name="bench_collection")
+
+
+def run_per_file(embeddings, files):
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(embeddings, directory)
+        start = time.perf_counter()
+        for chunks, ids in files:
+            store.add_documents(chunks, ids=ids)
+            store.persist()
+        return time.perf_counter() - start
+
+
+async def run_bulk(embeddings, files):
+    with tempfile.TemporaryDirectory() as directory:
+        store = make_store(embeddings, directory)
+        pool = create_thread_pool("bench", workers=4, max_pending=64)
+        writer = BulkWriter(store, pool)
+        start = time.perf_counter()
+        writes = [await writer.add(chunks, ids) for chunks, ids in files]
+        await writer.flush()
+        await asyncio.gather(*writes)
+        await writer.close()
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--chunks-per-file", type=int, default=40)
+    parser.add_argument("--embeddings", choices=["model", "fake"], default="model")
+    args = parser.parse_args()
+
+    if args.embeddings == "fake":
+        from langchain_community.embeddings import FakeEmbeddings
+
+        embeddings = FakeEmbeddings(size=384)
+    else:
+        embeddings = create_embeddings()
+
+    files = make_files(args.files, args.chunks_per_file)
+    total = args.files * args.chunks_per_file
+    for label, elapsed in (
+        ("per-file", run_per_file(embeddings, files)),
+        ("bulk", asyncio.run(run_bulk(embeddings, files))),
+    ):
+        print(f"{label:<9} chunks={total:<6} seconds={elapsed:7.2f} chunks/sec={total / elapsed:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
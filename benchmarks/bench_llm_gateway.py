@@ -0,0 +1,120 @@
+"""Compare direct Groq client calls with calls through the LLM gateway, against the local mock server.
+
+Simulates --queries concurrent queries, each making --extractions extraction calls
+and then one synthesis call, against a mock server that allows
+--requests-per-window requests per --window seconds and fails --error-rate of them.
+
+  direct  - one ChatGroq client with its default retries, as before the gateway
+  gateway - GatewayChatModel with matching client-side rate limits, priorities,
+            jittered retries honoring Retry-After and, with --fallback, failover
+            to a second model (which the server always fails with --fail-primary)
+
+Reports failed queries and calls, query latency percentiles, wall time, and the
+429s and errors the server returned.
+
+Usage: python -m benchmarks.bench_llm_gateway --queries 20 --extractions 5 --requests-per-window 20 --window 2
+"""
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from app.services.llm_gateway import GatewayChatModel, LLMGateway, create_http_client, llm_stage
+from benchmarks.mock_llm_server import create_app, serve_in_thread
+
+PRIMARY_MODEL = "mock-primary"
+FALLBACK_MODEL = "mock-fallback"
+
+
+def chat_model(base_url, model, **kwargs):
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(model=model, groq_api_key="mock", base_url=base_url, temperature=0, **kwargs)
+
+
+async def run_query(llm, number, extractions):
+    """One query: concurrent extraction calls, then a synthesis call; returns (latency, failed calls)."""
+    async def call(stage, text):
+        with llm_stage(stage):
+            try:
+                await llm.ainvoke(text)
+                return 0
+            except Exception:
+                return 1
+
+    start = time.perf_counter()
+    failed = sum(await asyncio.gather(*[
+        call("document", f'Query {number}: extract from "doc_id": "doc-{i}" "filename": "doc-{i}.pdf"')
+        for i in range(extractions)
+    ]))
+    failed += await call("synthesis", f"Query {number}: synthesize the answers.")
+    return time.perf_counter() - start, failed
+
+
+async def run_mode(mode, args):
+    app = create_app(
+        latency=args.latency, requests_per_window=args.requests_per_window, window=args.window,
+        error_rate=args.error_rate, fail_models=[PRIMARY_MODEL] if args.fail_primary else [], seed=args.seed
+    )
+    server, base_url = serve_in_thread(app)
+    gateway = None
+    try:
+        if mode == "direct":
+            llm = chat_model(base_url, PRIMARY_MODEL)
+        else:
+            http_client = create_http_client()
+            gateway = LLMGateway(
+                requests_per_minute=args.requests_per_window * 60 / args.window, tokens_per_minute=0,
+                max_concurrency=args.max_concurrency, max_retries=args.max_retries, base_delay=0.1,
+                max_delay=args.window
+            )
+            fallback = chat_model(base_url, FALLBACK_MODEL, max_retries=0, http_async_client=http_client)
+            llm = GatewayChatModel(
+                primary=chat_model(base_url, PRIMARY_MODEL, max_retries=0, http_async_client=http_client),
+                fallback=fallback if args.fallback else None, gateway=gateway
+            )
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[run_query(llm, i, args.extractions) for i in range(args.queries)])
+        elapsed = time.perf_counter() - start
+        latencies = [latency for latency, failed in results if not failed]
+        failed_queries = sum(1 for _, failed in results if failed)
+        failed_calls = sum(failed for _, failed in results)
+
+        import httpx
+
+        async with httpx.AsyncClient() as client:
+            stats = (await client.get(f"{base_url}/stats")).json()
+    finally:
+        server.should_exit = True
+
+    p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (float("nan"), float("nan"))
+    print(f"{mode:<8} failed_queries={failed_queries:<3} failed_calls={failed_calls:<3} elapsed={elapsed:6.2f}s "
+          f"query_p50={p50:6.2f}s query_p95={p95:6.2f}s server_requests={stats['requests']:<4} "
+          f"429s={stats['rate_limited']:<4} 5xx={stats['errors']:<3} by_model={stats['by_model']}")
+    if gateway is not None:
+        print(f"         gateway {gateway.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--extractions", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per mock completion")
+    parser.add_argument("--requests-per-window", type=int, default=20)
+    parser.add_argument("--window", type=float, default=2.0, help="seconds of the server's rate limit window")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-retries", type=int, default=4)
+    parser.add_argument("--fallback", action="store_true", help="fail over to a second model")
+    parser.add_argument("--fail-primary", action="store_true", help="the server fails every primary model call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for mode in ("direct", "gateway"):
+        asyncio.run(run_mode(mode, args))
+
+
+if __name__ == "__main__":
+    main()
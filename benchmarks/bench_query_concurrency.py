@@ -0,0 +1,56 @@
+"""Measure per-query latency and LLM calls of the extraction fan-out against a fake chat model.
+
+Runs sequential extraction, concurrent extraction, and batched extraction where
+several documents share one call.
+
+Usage: python -m benchmarks.bench_query_concurrency --docs 10 --latency 0.5
+"""
+import time
+import asyncio
+import argparse
+
+from langchain_core.documents import Document
+
+from app.services.query_processor import QueryProcessor
+from benchmarks.fake_llm import FakeChatModel
+
+
+class StubVectorStore:
+    """Returns one chunk per document so every document costs one extraction call."""
+
+    def __init__(self, num_docs):
+        self.num_docs = num_docs
+
+    def similarity_search(self, query, k=5, document_ids=None):
+        return [
+            (Document(page_content=f"Chunk of document {i}.", metadata={"id": f"doc-{i}", "filename": f"doc-{i}.pdf"}), 0.1)
+            for i in range(min(k, self.num_docs))
+        ]
+
+
+async def run(num_docs, latency, max_concurrency, batch_extraction=False):
+    llm = FakeChatModel(latency=latency)
+    processor = QueryProcessor(
+        llm=llm, vector_store=StubVectorStore(num_docs), max_concurrency=max_concurrency,
+        batch_extraction=batch_extraction
+    )
+    start = time.perf_counter()
+    response = await processor.aprocess_query_with_themes("What do the documents say?", top_k=num_docs)
+    elapsed = time.perf_counter() - start
+    print(f"max_concurrency={max_concurrency:<3} batched={str(batch_extraction):<5} "
+          f"docs={len(response.document_responses):<3} llm_calls={llm.calls:<3} elapsed={elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    for max_concurrency in (1, args.docs):
+        asyncio.run(run(args.docs, args.latency, max_concurrency))
+    asyncio.run(run(args.docs, args.latency, args.docs, batch_extraction=True))
+
+
+if __name__ == "__main__":
+    main()
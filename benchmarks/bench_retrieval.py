@@ -0,0 +1,124 @@
+"""Compare retrieval quality and latency of dense, hybrid (dense + BM25) and reranked search.
+
+Builds a synthetic corpus in which some chunks carry a unique case identifier and
+others a sentence about a unique subject, then asks one question per such chunk:
+
+  identifier - "What was decided in case CV-2021-00042?"
+  subject    - "What does the report say about the <subject>?"
+
+and reports hit rate (target chunk in the top k), MRR and query latency per mode.
+
+Uses the real embedding model by default; --embeddings fake swaps in hash-based vectors
+so the script runs offline (dense results are then meaningless). --rerank also runs
+the cross-encoder, which has to be downloaded on first use.
+
+Usage: python -m benchmarks.bench_retrieval --docs 50 --chunks-per-doc 40 --k 5
+"""
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from langchain_core.documents import Document
+
+from app.services.keyword_index import KeywordIndex
+from app.services.vector_store import VectorStore, create_embeddings
+from benchmarks.fixtures import lorem
+
+SUBJECTS = (
+    "lighthouse vineyard glacier orchard quarry observatory aqueduct monastery "
+    "shipyard brewery foundry greenhouse racetrack reservoir windmill"
+).split()
+
+
+def make_corpus(num_docs, chunks_per_doc, seed=0):
+    """Return (documents, ids, queries) where each query is (kind, text, target chunk id)."""
+    rng = random.Random(seed)
+    documents, ids, queries = [], [], []
+    for d in range(num_docs):
+        for c in range(chunks_per_doc):
+            chunk_id = f"doc-{d}:{c}"
+            text = lorem(rng, 120)
+            roll = rng.random()
+            if roll < 0.1:
+                case = f"CV-{2015 + d % 10}-{rng.randrange(100000):05d}"
+                text += f" In case {case} the court ruled on the disputed payment."
+                queries.append(("identifier", f"What was decided in case {case}?", chunk_id))
+            elif roll < 0.15:
+                subject = f"{rng.choice(SUBJECTS)} {d}-{c}"
+                text += f" The {subject} exceeded its maintenance budget."
+                queries.append(("subject", f"What does the report say about the {subject}?", chunk_id))
+            documents.append(Document(page_content=text, metadata={"id": f"doc-{d}", "filename": f"doc-{d}.pdf"}))
+            ids.append(chunk_id)
+    return documents, ids, queries
+
+
+def evaluate(store, queries, k, documents_by_text):
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for _, text, target in queries:
+        start = time.perf_counter()
+        results = store.similarity_search(text, k=k)
+        latencies.append(time.perf_counter() - start)
+        ranked = [documents_by_text.get(doc.page_content) for doc, _ in results]
+        if target in ranked:
+            hits += 1
+            reciprocal_ranks.append(1.0 / (ranked.index(target) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+    latencies.sort()
+    return {
+        "hit_rate": hits / len(queries),
+        "mrr": statistics.mean(reciprocal_ranks),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--chunks-per-doc", type=int, default=40)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--embeddings", choices=["model", "fake"], default="model")
+    parser.add_argument("--rerank", action="store_true")
+    args = parser.parse_args()
+
+    if args.embeddings == "fake":
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+
+        embeddings = DeterministicFakeEmbedding(size=384)
+    else:
+        embeddings = create_embeddings()
+
+    documents, ids, queries = make_corpus(args.docs, args.chunks_per_doc)
+    documents_by_text = {doc.page_content: chunk_id for doc, chunk_id in zip(documents, ids)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        keyword_index = KeywordIndex(f"{directory}/keywords.db")
+        store = VectorStore(
+            embeddings=embeddings, persist_directory=directory,
+            collection_name="bench_collection", keyword_index=keyword_index
+        )
+        store.upsert_documents(documents, ids)
+
+        modes = [("dense", None, None), ("hybrid", keyword_index, None)]
+        if args.rerank:
+            from app.services.retrieval import CrossEncoderReranker
+
+            modes.append(("hybrid+rerank", keyword_index, CrossEncoderReranker()))
+
+        print(f"chunks={len(ids)} queries={len(queries)} k={args.k}")
+        for label, index, reranker in modes:
+            store.keyword_index, store.reranker = index, reranker
+            for kind in ("identifier", "subject"):
+                subset = [q for q in queries if q[0] == kind]
+                result = evaluate(store, subset, args.k, documents_by_text)
+                print(
+                    f"{label:<14} {kind:<11} hit@{args.k}={result['hit_rate']:.3f} mrr={result['mrr']:.3f} "
+                    f"p50={result['p50_ms']:7.1f}ms p95={result['p95_ms']:7.1f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measure worker startup time and memory with the shared service registry.
+
+Each scenario runs in a fresh interpreter so import caches and model loads do not leak
+between measurements:
+
+  import     - `import app.main` only (what uvicorn does before lifespan startup)
+  startup    - import plus lifespan startup, which builds the shared services once
+  duplicated - import plus two independent VectorStore instances, as routes.py and
+               QueryProcessor used to create before the registry existed
+
+Usage: python -m benchmarks.bench_startup
+"""
+import sys
+import json
+import subprocess
+
+from app.config import BASE_DIR
+
+SCENARIOS = {
+    "import": """
+import app.main
+""",
+    "startup": """
+import app.main
+from app.services.registry import init_services
+init_services()
+""",
+    "duplicated": """
+import app.main
+from app.services.vector_store import VectorStore
+stores = [VectorStore(), VectorStore()]
+""",
+}
+
+CHILD_TEMPLATE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": round(elapsed, 3),
+    "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "heavy_modules": [m for m in ("torch", "sentence_transformers", "chromadb", "langchain_groq") if m in sys.modules],
+}}))
+"""
+
+
+def run_scenario(name):
+    code = CHILD_TEMPLATE.format(body=SCENARIOS[name])
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    for name in SCENARIOS:
+        print(f"{name:<11} {json.dumps(run_scenario(name))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare two bench_e2e result files and flag regressions.
+
+Prints each tracked metric for the baseline and candidate runs with the relative
+change, and exits with status 1 if any metric got worse by more than --threshold,
+so it can gate a CI job.
+
+Usage: python -m benchmarks.compare benchmarks/results/e2e-old.json benchmarks/results/e2e-new.json
+"""
+import sys
+import json
+import argparse
+
+# (label, path into the result, True if higher is better)
+INGEST_METRICS = (
+    ("ingest docs/s", ("ingest", "documents_per_second"), True),
+    ("ingest chunks/s", ("ingest", "chunks_per_second"), True),
+    ("ingest job extract p95", ("ingest", "job_extract_seconds", "p95"), False),
+    ("ingest job index p95", ("ingest", "job_index_seconds", "p95"), False),
+    ("rss after ingest", ("memory", "after_ingest", "rss_bytes"), False),
+    ("peak rss", ("memory", "final", "peak_rss_bytes"), False),
+)
+QUERY_METRICS = (
+    ("q/s", ("queries_per_second",), True),
+    ("p50", ("latency_seconds", "p50"), False),
+    ("p95", ("latency_seconds", "p95"), False),
+    ("p99", ("latency_seconds", "p99"), False),
+    ("llm calls", ("llm_calls",), False),
+    ("errors", ("errors",), False),
+)
+
+
+def lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(label, old, new, higher_is_better, threshold):
+    """Print one metric row; returns True if it regressed by more than threshold."""
+    if old is None or new is None:
+        print(f"{label:<28} {'-':>12} {'-':>12}")
+        return False
+    change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+    worse = -change if higher_is_better else change
+    regressed = worse > threshold
+    print(f"{label:<28} {old:>12.4g} {new:>12.4g} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+    settings = [{key: value for key, value in run.get("args", {}).items() if key != "output"} for run in (old, new)]
+    if settings[0] != settings[1]:
+        print("warning: the runs used different arguments, so the numbers may not be comparable")
+
+    print(f"{'metric':<28} {old.get('git_commit') or 'baseline':>12} {new.get('git_commit') or 'candidate':>12}")
+    regressions = 0
+    for label, path, higher_is_better in INGEST_METRICS:
+        regressions += compare(label, lookup(old, path), lookup(new, path), higher_is_better, args.threshold)
+
+    new_levels = {level["concurrency"]: level for level in new.get("query", [])}
+    for old_level in old.get("query", []):
+        new_level = new_levels.get(old_level["concurrency"])
+        if new_level is None:
+            continue
+        for label, path, higher_is_better in QUERY_METRICS:
+            regressions += compare(
+                f"query c={old_level['concurrency']} {label}", lookup(old_level, path), lookup(new_level, path),
+                higher_is_better, args.threshold
+            )
+
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
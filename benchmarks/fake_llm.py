@@ -0,0 +1,128 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+DOC_ID_PATTERN = re.compile(r'"doc_id":\s*"([^"]*)"')
+FILENAME_PATTERN = re.compile(r'"filename":\s*"([^"]*)"')
+DOCUMENT_PATTERN = re.compile(r"Document (\S+) \(")
+BATCH_DOCUMENT_PATTERN = re.compile(r"=== Document (\S+) \((.*?)\) ===")
+THEME_NUMBER_PATTERN = re.compile(r"^Theme (\d+):", re.MULTILINE)
+
+# Ways real models break JSON replies; all but "garbage" are fixed by the local repair
+MALFORMATIONS = ("prose", "fence", "trailing_comma", "single_quotes", "truncated", "garbage")
+
+
+def malform(content, kind):
+    if kind == "prose":
+        return f"Sure! Here is the requested JSON:\n{content}\nLet me know if you need anything else."
+    if kind == "fence":
+        return f"```json\n{content}\n```"
+    if kind == "trailing_comma":
+        return content[:-1] + "," + content[-1]
+    if kind == "single_quotes":
+        return content.replace('"', "'")
+    if kind == "truncated":
+        return content[:-2]
+    return "I could not find a clear answer in the provided context."
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic local stand-in for ChatGroq that answers each pipeline stage after a fixed latency.
+
+    With malformed_rate, that share of JSON replies is broken in one of the
+    MALFORMATIONS ways. Which replies are broken depends only on the prompt and
+    seed, so runs are repeatable whatever the order of concurrent calls.
+    """
+
+    latency: float = 0.5
+    malformed_rate: float = 0.0
+    seed: int = 0
+    calls: int = 0
+    malformed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        return self.reply("\n".join(str(m.content) for m in messages))
+
+    def reply(self, prompt: str) -> str:
+        """Answer one prompt, breaking it at malformed_rate; shared with the mock LLM server."""
+        self.calls += 1
+        content = self._answer(prompt)
+        if self.malformed_rate and content.startswith(("{", "[")):
+            digest = hashlib.sha256(f"{self.seed}:{prompt}".encode()).digest()
+            if int.from_bytes(digest[:8], "big") / 2 ** 64 < self.malformed_rate:
+                self.malformed += 1
+                return malform(content, MALFORMATIONS[digest[8] % len(MALFORMATIONS)])
+        return content
+
+    def _answer(self, prompt: str) -> str:
+        batch = BATCH_DOCUMENT_PATTERN.findall(prompt)
+        if batch:
+            return json.dumps([{
+                "doc_id": doc_id,
+                "filename": filename,
+                "extracted_answer": "Fake answer extracted from the document context.",
+                "citation": "Page 1",
+                "relevance": 7
+            } for doc_id, filename in batch])
+
+        doc_id = DOC_ID_PATTERN.search(prompt)
+        if doc_id:
+            filename = FILENAME_PATTERN.search(prompt)
+            return json.dumps({
+                "doc_id": doc_id.group(1),
+                "filename": filename.group(1) if filename else "unknown",
+                "extracted_answer": "Fake answer extracted from the document context.",
+                "citation": "Page 1",
+                "relevance": 7
+            })
+
+        if "Name each theme" in prompt:
+            return json.dumps([{
+                "theme": number,
+                "theme_name": f"Fake theme {number}",
+                "theme_description": "A theme named by the fake model."
+            } for number in sorted(set(map(int, THEME_NUMBER_PATTERN.findall(prompt))))])
+
+        if "Identify 2-5 common themes" in prompt:
+            doc_ids = sorted(set(DOCUMENT_PATTERN.findall(prompt)))
+            return json.dumps([{
+                "theme_name": "Fake theme",
+                "theme_description": "A theme shared by every document.",
+                "supporting_documents": doc_ids,
+                "confidence": 6
+            }])
+
+        return "Fake synthesized answer."
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        content = self._respond(messages)
+        # Approximate token usage, as a provider would report it
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        message = AIMessage(content=content, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
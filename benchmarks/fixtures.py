@@ -0,0 +1,114 @@
+"""Generators for synthetic documents used by the benchmarks."""
+import os
+import random
+
+WORDS = (
+    "contract court appeal evidence tax revenue policy audit finance report regulation "
+    "compliance ruling penalty statute budget invoice payment hearing witness claim"
+).split()
+
+
+def lorem(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(path, pages, lines_per_page=40, seed=0):
+    """Write a PDF with a real text layer on every page, without any PDF library."""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for page_number in range(1, pages + 1):
+        lines = [f"Page {page_number} case number CASE-{page_number:05d}"]
+        lines += [lorem(rng, 12) for _ in range(lines_per_page - 1)]
+        stream = "BT /F1 10 Tf 50 780 Td 12 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+def write_multipage_tiff(path, pages, lines_per_page=30, seed=0):
+    """Write a multi-page TIFF with one rendered text page per frame."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    frames = []
+    for page_number in range(1, pages + 1):
+        image = Image.new("L", (1240, 1754), color=255)
+        draw = ImageDraw.Draw(image)
+        lines = [f"Page {page_number} case number CASE-{page_number:05d}"]
+        lines += [lorem(rng, 10) for _ in range(lines_per_page - 1)]
+        for i, line in enumerate(lines):
+            draw.text((60, 60 + i * 28), line, fill=0)
+        frames.append(image)
+    frames[0].save(path, save_all=True, append_images=frames[1:], compression="tiff_deflate")
+    return path
+
+
+def write_docx(path, paragraphs, words_per_paragraph=60, seed=0):
+    """Write a DOCX with a heading and plain paragraphs."""
+    from docx import Document
+
+    rng = random.Random(seed)
+    document = Document()
+    document.add_heading(f"Report {seed} case number CASE-{seed:05d}", level=1)
+    for _ in range(paragraphs):
+        document.add_paragraph(lorem(rng, words_per_paragraph))
+    document.save(path)
+    return path
+
+
+def write_image(path, lines=30, seed=0):
+    """Write a single scanned-looking page as an image, in the format given by the path's extension."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("L", (1240, 1754), color=255)
+    draw = ImageDraw.Draw(image)
+    text = [f"Scan {seed} case number CASE-{seed:05d}"] + [lorem(rng, 10) for _ in range(lines - 1)]
+    for i, line in enumerate(text):
+        draw.text((60, 60 + i * 28), line, fill=0)
+    image.save(path)
+    return path
+
+
+def generate_corpus(directory, pdfs=10, docxs=5, images=5, pdf_pages=5, seed=0):
+    """Write a mixed corpus of distinct PDFs, DOCX files and PNG scans; returns the file paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(pdfs):
+        paths.append(write_text_pdf(os.path.join(directory, f"report-{i:04d}.pdf"), pdf_pages, seed=seed + i))
+    for i in range(docxs):
+        paths.append(write_docx(os.path.join(directory, f"memo-{i:04d}.docx"), 5 * pdf_pages, seed=seed + i))
+    for i in range(images):
+        paths.append(write_image(os.path.join(directory, f"scan-{i:04d}.png"), seed=seed + i))
+    return paths
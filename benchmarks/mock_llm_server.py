@@ -0,0 +1,147 @@
+"""Local stand-in for the Groq chat completions API, for testing the LLM gateway without network.
+
+Answers like FakeChatModel after --latency seconds, streamed or not, breaking
+--malformed-rate of its JSON replies, and reports usage. It allows
+--requests-per-window requests per --window seconds and answers 429 with
+Retry-After beyond that, fails --error-rate of the requests with a 503, and
+always fails requests for the models in --fail-models (to exercise failover).
+Counters are at GET /stats.
+
+Usage: python -m benchmarks.mock_llm_server --port 8099 --requests-per-window 30 --window 60
+       GROQ_API_BASE=http://127.0.0.1:8099 uvicorn app.main:app
+"""
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+from collections import deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.fake_llm import FakeChatModel
+
+
+def create_app(latency=0.2, requests_per_window=0, window=60.0, error_rate=0.0, fail_models=(),
+               malformed_rate=0.0, seed=0):
+    app = FastAPI()
+    answers = FakeChatModel(latency=0, malformed_rate=malformed_rate, seed=seed)
+    # Its calls and malformed counters are the server's
+    app.state.answers = answers
+    rng = random.Random(seed)
+    recent = deque()
+    counters = {"requests": 0, "rate_limited": 0, "errors": 0, "completed": 0, "max_concurrent": 0, "by_model": {}}
+    running = [0]
+
+    def rate_limited(now):
+        while recent and recent[0] <= now - window:
+            recent.popleft()
+        if requests_per_window and len(recent) >= requests_per_window:
+            return recent[0] + window - now
+        recent.append(now)
+        return None
+
+    @app.get("/stats")
+    async def stats():
+        return counters
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        counters["requests"] += 1
+        counters["by_model"][model] = counters["by_model"].get(model, 0) + 1
+
+        wait = rate_limited(time.monotonic())
+        if wait is not None:
+            counters["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429, headers={"retry-after": f"{wait:.3f}"}
+            )
+        if model in fail_models or rng.random() < error_rate:
+            counters["errors"] += 1
+            return JSONResponse({"error": {"message": "Service unavailable", "type": "internal_server_error"}},
+                                status_code=503)
+
+        running[0] += 1
+        counters["max_concurrent"] = max(counters["max_concurrent"], running[0])
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            running[0] -= 1
+        prompt = "\n".join(
+            message["content"] if isinstance(message.get("content"), str) else json.dumps(message.get("content"))
+            for message in body.get("messages", [])
+        )
+        content = answers.reply(prompt)
+        usage = {
+            "prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+            "total_tokens": len(prompt) // 4 + len(content) // 4
+        }
+        counters["completed"] += 1
+        completion_id, created = f"chatcmpl-{counters['requests']}", int(time.time())
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        def chunk(delta, finish_reason=None, **extra):
+            return "data: " + json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra
+            }) + "\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for word in content.split(" "):
+                yield chunk({"content": word + " "})
+            yield chunk({}, "stop", x_groq={"usage": usage})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def serve_in_thread(app):
+    """Run app on a free local port in a background thread; returns (server, base_url)."""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests-per-window", type=int, default=0, help="0 disables the rate limit")
+    parser.add_argument("--window", type=float, default=60.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fail-models", nargs="*", default=[])
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(
+        args.latency, args.requests_per_window, args.window, args.error_rate, args.fail_models, args.malformed_rate
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.services.ann_index import HnswlibIndex, create_ann_index
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(50, 8)).astype(np.float32)
+
+
+def test_search_skips_deleted_and_filtered_labels(tmp_path, vectors):
+    index = HnswlibIndex(tmp_path / "hnswlib.index", ef_search=64)
+    index.add(list(range(50)), vectors)
+
+    labels, distances = index.search(vectors[3], k=1)
+    assert labels == [3] and distances[0] == pytest.approx(0.0, abs=1e-5)
+
+    index.delete([3])
+    assert 3 not in index.search(vectors[3], k=5)[0]
+    assert index.search(vectors[3], k=5, allowed={7, 8})[0] in ([7, 8], [8, 7])
+
+
+def test_compact_and_reload_keep_only_live_vectors(tmp_path, vectors):
+    path = tmp_path / "hnswlib.index"
+    index = HnswlibIndex(path, ef_search=64)
+    index.add(list(range(50)), vectors)
+    index.delete(range(25))
+    index.compact(range(25, 50))
+    assert len(index) == 25
+
+    reloaded = HnswlibIndex(path, ef_search=64)
+    assert len(reloaded) == 25 and reloaded.max_label == 49
+    assert reloaded.search(vectors[30], k=1)[0] == [30]
+    assert not HnswlibIndex.lossy
+
+
+def test_unknown_backend_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        create_ann_index("annoy", tmp_path / "index")
+
+
+@pytest.mark.parametrize("quantization", ["float32", "float16", "int8"])
+def test_faiss_search_filters_and_reloads(tmp_path, vectors, quantization):
+    pytest.importorskip("faiss")
+    from app.services.ann_index import FaissIndex
+
+    path = tmp_path / "faiss.index"
+    index = FaissIndex(path, ef_search=64, quantization=quantization)
+    index.add(list(range(50)), vectors)
+    assert index.lossy == (quantization != "float32")
+
+    assert index.search(vectors[3], k=1)[0] == [3]
+    index.delete([3])
+    assert 3 not in index.search(vectors[3], k=5)[0]
+    labels, distances = index.search(vectors[10], k=5, allowed={10, 11, 12})
+    assert labels[0] == 10 and set(labels) <= {10, 11, 12} and distances == sorted(distances)
+
+    index.save()
+    reloaded = FaissIndex(path, ef_search=64, quantization=quantization)
+    assert len(reloaded) == 49 and reloaded.search(vectors[7], k=1)[0] == [7]
+
+
+def test_faiss_int8_counts_values_outside_the_trained_ranges_and_retrains_on_compact(tmp_path, vectors):
+    pytest.importorskip("faiss")
+    from app.services.ann_index import FaissIndex
+
+    index = FaissIndex(tmp_path / "faiss.index", ef_search=64, quantization="int8")
+    index.add(list(range(25)), vectors[:25])
+    assert index.values_out_of_range == 0
+    index.add([100], vectors[25:26] * 10)
+    assert index.values_out_of_range > 0
+
+    index.delete([0])
+    live = list(range(1, 25)) + [100]
+    index.compact(live, np.vstack([vectors[1:25], vectors[25:26] * 10]))
+    assert (len(index), index.values_out_of_range) == (25, 0)
+    assert index.search(vectors[25] * 10, k=1)[0] == [100]
@@ -0,0 +1,75 @@
+import pytest
+
+from app.services.answer_cache import AnswerCache, TTLCache, normalize_query
+from app.services.query_processor import DocumentResponse, SynthesizedResponse
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.services.answer_cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def answer(doc_id="a", text="Rates rose"):
+    return DocumentResponse(doc_id=doc_id, filename=f"{doc_id}.pdf", extracted_answer=text, citation="p. 1",
+                            relevance=7)
+
+
+def response(text="Rates rose in 2023."):
+    return SynthesizedResponse(document_responses=[answer()], identified_themes=[], synthesized_answer=text)
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = TTLCache(max_entries=10, ttl=60)
+    cache.put("key", "value")
+    clock[0] += 59
+    assert cache.get("key") == "value"
+    clock[0] += 2
+    assert cache.get("key") is None
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 0)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_responses_are_invalidated_by_a_new_corpus_version():
+    cache = AnswerCache(similarity_threshold=0)
+    cache.put_response("What happened to rates?", None, 1, response())
+    assert cache.get_response("  what happened to RATES ", None, 1).synthesized_answer == "Rates rose in 2023."
+    assert cache.get_response("What happened to rates?", None, 2) is None
+    assert cache.get_response("What happened to rates?", ["a"], 1) is None
+    assert normalize_query("What  happened?!") == "what happened"
+
+
+def test_near_duplicate_queries_hit_only_above_the_similarity_threshold():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put_response("What happened to rates?", None, 1, response(), query_vector=[1.0, 0.0])
+
+    close, far = [0.95, 0.31], [0.6, 0.8]
+    assert cache.get_response("How did rates change?", None, 1, close) is not None
+    assert cache.get_response("Who won the election?", None, 1, far) is None
+    # Same scope and corpus version only
+    assert cache.get_response("How did rates change?", None, 2, close) is None
+    assert cache.stats()["responses"]["semantic_hits"] == 1
+
+
+def test_extractions_are_keyed_by_document_version_and_packed_chunks():
+    cache = AnswerCache()
+    cache.put_extraction("rates?", "a", "v1", ["chunk 1", "chunk 2"], answer())
+
+    assert cache.get_extraction("Rates", "a", "v1", ["chunk 1", "chunk 2"]).extracted_answer == "Rates rose"
+    assert cache.get_extraction("rates?", "a", "v2", ["chunk 1", "chunk 2"]) is None
+    # Another scope or top_k retrieves a different set of chunks
+    assert cache.get_extraction("rates?", "a", "v1", ["chunk 1"]) is None
+    assert cache.get_extraction("rates?", "a", "v1", ["chunk 1\0chunk 2"]) is None
+    # Documents without a version (not in the catalog) are never cached
+    cache.put_extraction("rates?", "b", None, ["chunk"], answer("b"))
+    assert cache.get_extraction("rates?", "b", None, ["chunk"]) is None
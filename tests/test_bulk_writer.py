@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+
+from app.services.bulk_writer import BulkWriter
+from app.services.executors import create_thread_pool
+
+
+class RecordingVectorStore:
+    """Records each write and rejects any batch that contains a chunk id listed in bad_ids."""
+
+    def __init__(self, bad_ids=()):
+        self.bad_ids = set(bad_ids)
+        self.writes = []
+        self.chunks = {}
+
+    def upsert_documents(self, documents, ids):
+        self.writes.append(list(ids))
+        if self.bad_ids.intersection(ids):
+            raise ValueError("bad chunk")
+        self.chunks.update(zip(ids, documents))
+
+    def persist(self):
+        pass
+
+
+@pytest.fixture
+def pool():
+    pool = create_thread_pool("test", 2, 16)
+    yield pool
+    pool.shutdown()
+
+
+def chunks(*ids):
+    return [Document(page_content=chunk_id) for chunk_id in ids], list(ids)
+
+
+def test_jobs_share_one_write_per_batch(pool):
+    store = RecordingVectorStore()
+
+    async def main():
+        writer = BulkWriter(store, pool, batch_size=100, max_delay=0.01)
+        first = await writer.add(*chunks("a:1", "a:2"))
+        second = await writer.add(*chunks("b:1"))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(main()) == [3, 3]
+    assert store.writes == [["a:1", "a:2", "b:1"]]
+
+
+def test_full_batch_is_written_without_waiting(pool):
+    store = RecordingVectorStore()
+
+    async def main():
+        writer = BulkWriter(store, pool, batch_size=2, max_delay=60)
+        return await asyncio.wait_for(await writer.add(*chunks("a:1", "a:2")), timeout=5)
+
+    assert asyncio.run(main()) == 2
+
+
+def test_failed_batch_only_fails_the_job_with_the_bad_chunk(pool):
+    store = RecordingVectorStore(bad_ids={"b:1"})
+
+    async def main():
+        writer = BulkWriter(store, pool, batch_size=100, max_delay=0.01)
+        futures = [await writer.add(*chunks("a:1")), await writer.add(*chunks("b:1", "b:2")),
+                   await writer.add(*chunks("c:1"))]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    good, bad, other = asyncio.run(main())
+    assert (good, other) == (1, 1)
+    assert isinstance(bad, ValueError)
+    assert set(store.chunks) == {"a:1", "c:1"}
+    assert store.writes[0] == ["a:1", "b:1", "b:2", "c:1"]
@@ -0,0 +1,38 @@
+from langchain_core.documents import Document
+
+from app.services.context_budget import ContextBudget, drop_near_duplicates, merge_chunks
+
+TEXT = "The quick brown fox jumps over the lazy dog near the river bank."
+
+
+def chunk(start, end, page=1):
+    return Document(page_content=TEXT[start:end], metadata={"page": page, "start_index": start})
+
+
+def test_merge_chunks_stitches_overlapping_chunks_in_reading_order():
+    # Retrieved out of order, with an overlap of "jumps over"
+    documents = [chunk(20, 45), chunk(0, 30), chunk(50, 64, page=2)]
+    assert merge_chunks(documents) == [(0, 1, TEXT[0:45]), (2, 2, TEXT[50:64])]
+
+
+def test_merge_chunks_keeps_gaps_and_chunks_without_offsets():
+    legacy = Document(page_content="old chunk", metadata={"page": 3})
+    documents = [chunk(0, 10), legacy, chunk(30, 40)]
+    assert merge_chunks(documents) == [(1, 3, "old chunk"), (0, 1, TEXT[0:10]), (2, 1, TEXT[30:40])]
+
+
+def test_drop_near_duplicates_keeps_the_first_of_similar_texts():
+    texts = [TEXT, TEXT.replace("river bank.", "river bank!"), "Completely different words about taxes and rates."]
+    assert drop_near_duplicates(texts, threshold=0.8) == [0, 2]
+    assert drop_near_duplicates(texts, threshold=1.01) == [0, 1, 2]
+
+
+def test_pack_texts_cuts_least_relevant_text_to_the_budget():
+    budget = ContextBudget(synthesis_tokens=100, tokenizer=None)
+    texts = ["a " * 80, "b " * 200, "c " * 100]
+    packed = budget.pack_texts("synthesis", texts)
+    # The second text is cut to the 60 tokens left; the third does not fit at all
+    assert packed == ["a " * 80, ("b " * 200)[:240]]
+    stats = budget.stats()["synthesis"]
+    assert (stats["tokens_before"], stats["tokens_sent"]) == (190, 100)
+    assert budget.tokenizer == "approximate"
@@ -0,0 +1,89 @@
+import pytest
+
+from app.services.document_index import DocumentIndex
+
+
+def save(index, doc_id, chunk_ids=(), sha256=None):
+    doc = {"id": doc_id, "filename": f"{doc_id}.pdf", "path": f"/uploads/{doc_id}", "processed_path": None}
+    index.save_document(doc, sha256 or doc_id, 10, chunk_ids)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DocumentIndex(tmp_path / "documents.db")
+
+
+def test_cursor_pages_cover_every_document_once_newest_first(index):
+    for i in range(7):
+        save(index, f"doc-{i}")
+    seen, cursor = [], None
+    while True:
+        rows, cursor = index.list_documents(limit=3, cursor=cursor)
+        seen.extend(row["doc_id"] for row in rows)
+        if cursor is None:
+            break
+    assert seen == [f"doc-{i}" for i in reversed(range(7))]
+    assert index.document_count() == 7
+
+
+def test_documents_with_the_same_timestamp_are_not_skipped(index, monkeypatch):
+    monkeypatch.setattr("app.services.document_index.time.time", lambda: 1000.0)
+    for doc_id in ("a", "b", "c", "d"):
+        save(index, doc_id)
+    first, cursor = index.list_documents(limit=2)
+    second, last_cursor = index.list_documents(limit=2, cursor=cursor)
+    assert [row["doc_id"] for row in first + second] == ["d", "c", "b", "a"]
+    assert last_cursor is None
+
+
+def test_invalid_cursor_raises(index):
+    with pytest.raises(ValueError):
+        index.list_documents(cursor="not-a-cursor")
+
+
+def test_replacing_a_document_updates_its_chunks_and_versions(index):
+    save(index, "a", ["a:1", "a:2"], sha256="v1")
+    version = index.corpus_version()
+    save(index, "a", ["a:2", "a:3"], sha256="v2")
+
+    assert index.chunk_ids("a") == {"a:2", "a:3"}
+    assert index.document_versions(["a", "missing"]) == {"a": "v2"}
+    assert index.corpus_version() == version + 1
+    assert index.document_count() == 1
+    assert index.find_by_sha256("v2")["doc_id"] == "a"
+
+
+def test_delete_documents_updates_count_and_chunks(index):
+    save(index, "a", ["a:1"])
+    save(index, "b", ["b:1"])
+    removed = index.delete_documents(["a", "missing"])
+    assert [row["doc_id"] for row in removed] == ["a"]
+    assert index.document_count() == 1
+    assert dict(index.chunk_refs()) == {"b:1": "b"}
+
+
+def test_backfill_catalogs_documents_only_found_in_the_vector_store(index, tmp_path):
+    upload = tmp_path / "old.pdf"
+    upload.write_bytes(b"old upload")
+    save(index, "cataloged", ["cataloged:1"])
+    chunks = [
+        ("uuid-1", {"id": "old", "filename": "old.pdf", "path": str(upload), "processed_path": "/processed/old.txt"}),
+        ("uuid-2", {"id": "old", "filename": "old.pdf", "path": str(upload), "processed_path": "/processed/old.txt"}),
+        ("cataloged:1", {"id": "cataloged", "filename": "cataloged.pdf"}),
+        ("ingesting:1", {"id": "ingesting", "filename": "ingesting.pdf"}),
+    ]
+    version = index.corpus_version()
+
+    assert not index.backfilled()
+    assert index.backfill(chunks, exclude={"ingesting"}) == 1
+    assert index.backfilled()
+    old = index.get_document("old")
+    assert (old["filename"], old["chunk_count"], old["size_bytes"]) == ("old.pdf", 2, len(b"old upload"))
+    assert index.find_by_sha256(old["sha256"])["doc_id"] == "old"
+    assert index.chunk_ids("old") == {"uuid-1", "uuid-2"}
+    assert index.get_document("ingesting") is None
+    assert (index.document_count(), index.corpus_version()) == (2, version + 1)
+
+    # Runs only once
+    assert index.backfill([("x", {"id": "later"})]) == 0
+    assert index.get_document("later") is None
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.services.document_processor import DocumentProcessor, PageChunker
+
+
+def make_chunker(tmp_path):
+    doc = {"id": "doc-a", "filename": "a.txt", "path": str(tmp_path / "a.txt"),
+           "processed_path": str(tmp_path / "doc-a.txt")}
+    return doc, PageChunker(RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=0, add_start_index=True), doc)
+
+
+def test_processed_text_is_replaced_on_commit(tmp_path):
+    doc, chunker = make_chunker(tmp_path)
+    (tmp_path / "doc-a.txt").write_text("previous version")
+    with chunker:
+        chunks = chunker.add_page(1, "new text")
+        chunker.commit()
+    assert [chunk.page_content for chunk in chunks] == ["new text"]
+    assert (tmp_path / "doc-a.txt").read_text() == "Page 1:\nnew text\n\n"
+    assert not (tmp_path / "doc-a.txt.tmp").exists()
+
+
+def test_failed_ingest_keeps_previous_processed_text(tmp_path):
+    doc, chunker = make_chunker(tmp_path)
+    (tmp_path / "doc-a.txt").write_text("previous version")
+    with pytest.raises(RuntimeError):
+        with chunker:
+            chunker.add_page(1, "new text")
+            raise RuntimeError("extraction failed")
+    assert (tmp_path / "doc-a.txt").read_text() == "previous version"
+    assert not (tmp_path / "doc-a.txt.tmp").exists()
+
+
+def test_chunk_ids_are_stable_and_unique(tmp_path):
+    _, first = make_chunker(tmp_path)
+    with first:
+        ids = [chunk.metadata["chunk_id"] for chunk in first.add_page(1, "same") + first.add_page(1, "same")]
+    _, second = make_chunker(tmp_path)
+    with second:
+        again = second.add_page(1, "same")[0].metadata["chunk_id"]
+    assert ids[0] != ids[1] and ids[1].endswith("-1")
+    assert again == ids[0]
+
+
+def test_text_files_are_read_in_blocks_cut_at_line_ends(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("first line\nsecond line\n" + "x" * 25)
+    blocks = list(DocumentProcessor._iter_text_blocks(path, block_size=12))
+    # Lines are kept whole up to the block size; a line longer than a block is split
+    assert blocks == ["first line\nsecond line\n", "x" * 12, "x" * 12, "x"]
+    assert [page for page, _ in DocumentProcessor.iter_pages(str(path), ".txt")] == [None]
+
+
+def test_blocks_of_one_document_get_offsets_into_the_whole_text(tmp_path):
+    doc, chunker = make_chunker(tmp_path)
+    with chunker:
+        first = chunker.add_page(None, "alpha beta\n")
+        second = chunker.add_page(None, "gamma delta\n")
+        chunker.commit()
+    assert (first[0].metadata["start_index"], second[0].metadata["start_index"]) == (0, 11)
+    assert "page" not in second[0].metadata
+    assert (tmp_path / "doc-a.txt").read_text() == "alpha beta\ngamma delta\n"
+
+
+def test_aiter_pages_streams_text_without_the_cpu_pool(tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("line\n" * 10)
+
+    async def collect():
+        return [page async for page in DocumentProcessor().aiter_pages(str(path), ".md", cpu_pool=None)]
+
+    assert "".join(text for _, text in asyncio.run(collect())) == "line\n" * 10
+
+
+def test_docx_paragraphs_are_grouped_into_blocks(tmp_path):
+    docx = pytest.importorskip("docx")
+    document = docx.Document()
+    for i in range(6):
+        document.add_paragraph(f"Paragraph {i}")
+    document.save(tmp_path / "a.docx")
+
+    blocks = list(DocumentProcessor._iter_docx_blocks(tmp_path / "a.docx", block_size=24))
+    assert blocks == ["Paragraph 0\nParagraph 1\n", "Paragraph 2\nParagraph 3\n", "Paragraph 4\nParagraph 5\n"]
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.services.embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(tmp_path)
+
+
+def test_put_and_get_many_round_trip(cache):
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    cache.put_many("model", ["a", "b", "a"], vectors)
+    found = cache.get_many("model", ["a", "b", "missing"])
+    assert set(found) == {"a", "b"}
+    np.testing.assert_array_equal(found["a"], vectors[0])
+    np.testing.assert_array_equal(found["b"], vectors[1])
+
+
+def test_partial_row_from_an_interrupted_append_is_truncated(cache):
+    cache.put_many("model", ["a"], np.ones((1, 4), dtype=np.float32))
+    path = cache._vectors_path("model")
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 6)
+
+    cache.put_many("model", ["b"], np.full((1, 4), 2, dtype=np.float32))
+    assert os.path.getsize(path) == 2 * 4 * 4
+    np.testing.assert_array_equal(cache.get_many("model", ["b"])["b"], np.full(4, 2, dtype=np.float32))
+
+
+def test_failed_write_leaves_no_index_entry_or_partial_row(cache, monkeypatch):
+    cache.put_many("model", ["a"], np.ones((1, 4), dtype=np.float32))
+
+    def fail(fd):
+        raise OSError("disk full")
+    monkeypatch.setattr("app.services.embedding_cache.os.fsync", fail)
+    with pytest.raises(OSError):
+        cache.put_many("model", ["b"], np.full((1, 4), 2, dtype=np.float32))
+    monkeypatch.undo()
+
+    assert cache.get_many("model", ["b"]) == {}
+    cache.put_many("model", ["c"], np.full((1, 4), 3, dtype=np.float32))
+    np.testing.assert_array_equal(cache.get_many("model", ["c"])["c"], np.full(4, 3, dtype=np.float32))
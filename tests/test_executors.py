@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.executors import PoolSaturatedError, create_thread_pool
+
+
+def test_full_pool_rejects_new_jobs_until_one_finishes():
+    pool = create_thread_pool("test", 1, 2)
+    release = threading.Event()
+
+    async def main():
+        running = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturatedError):
+            await pool.run(lambda: None)
+        stats = pool.stats()
+        release.set()
+        await asyncio.gather(*running)
+        return stats, await pool.run(lambda: "accepted")
+
+    try:
+        stats, result = asyncio.run(main())
+    finally:
+        release.set()
+        pool.shutdown()
+    assert (stats["in_flight"], stats["queue_depth"], stats["rejected"]) == (2, 1, 1)
+    assert result == "accepted"
+    assert pool.stats()["completed"] == 3
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from app.services.bulk_writer import BulkWriter
+from app.services.document_index import DocumentIndex
+from app.services.document_processor import DocumentProcessor
+from app.services.executors import create_thread_pool
+from app.services.ingestion import IngestionQueue, IngestionWorker
+
+
+class MemoryVectorStore:
+    """Just the chunk writes of a vector store."""
+
+    def __init__(self):
+        self.chunks = {}
+
+    def upsert_documents(self, documents, ids):
+        self.chunks.update((chunk_id, document.metadata["id"]) for chunk_id, document in zip(ids, documents))
+
+    def delete_chunks(self, ids):
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+
+    def persist(self):
+        pass
+
+
+def test_jobs_of_one_document_run_one_at_a_time(tmp_path):
+    queue = IngestionQueue(tmp_path / "ingest.db")
+    first = queue.enqueue("batch", "a.txt", tmp_path / "a1.txt", "doc-a")
+    second = queue.enqueue("batch", "a.txt", tmp_path / "a2.txt", "doc-a")
+    other = queue.enqueue("batch", "b.txt", tmp_path / "b.txt", "doc-b")
+
+    assert queue.claim_next()["job_id"] == first["job_id"]
+    # The second version of doc-a waits for the first; doc-b does not
+    assert queue.claim_next()["job_id"] == other["job_id"]
+    assert queue.claim_next() is None
+
+    queue.mark_done(first["job_id"], 1, 0.0, 0.0)
+    assert queue.claim_next()["job_id"] == second["job_id"]
+
+
+def test_released_job_is_claimed_again(tmp_path):
+    queue = IngestionQueue(tmp_path / "ingest.db")
+    job = queue.enqueue("batch", "a.txt", tmp_path / "a.txt", "doc-a")
+
+    assert queue.claim_next()["attempts"] == 1
+    queue.release(job["job_id"])
+    claimed = queue.claim_next()
+    assert (claimed["job_id"], claimed["attempts"]) == (job["job_id"], 1)
+
+
+def test_running_jobs_of_a_live_process_are_not_requeued(tmp_path):
+    first_process = IngestionQueue(tmp_path / "ingest.db", lease_seconds=60)
+    second_process = IngestionQueue(tmp_path / "ingest.db", lease_seconds=60)
+    job = first_process.enqueue("batch", "a.txt", tmp_path / "a.txt", "doc-a")
+    assert first_process.claim_next()["owner"] == first_process.owner
+
+    assert second_process.requeue_interrupted() == 0
+    assert second_process.claim_next() is None
+    assert first_process.renew_leases() == 1 and second_process.renew_leases() == 0
+    assert first_process.get_job(job["job_id"])["status"] == "running"
+
+
+def test_jobs_with_an_expired_lease_are_claimed_again(tmp_path, monkeypatch):
+    crashed = IngestionQueue(tmp_path / "ingest.db", lease_seconds=60)
+    survivor = IngestionQueue(tmp_path / "ingest.db", lease_seconds=60)
+    job = crashed.enqueue("batch", "a.txt", tmp_path / "a.txt", "doc-a")
+    crashed.claim_next()
+
+    later = crashed.get_job(job["job_id"])["lease_until"] + 1
+    monkeypatch.setattr("app.services.ingestion.time.time", lambda: later)
+    claimed = survivor.claim_next()
+    assert (claimed["job_id"], claimed["owner"], claimed["attempts"]) == (job["job_id"], survivor.owner, 2)
+
+
+def test_identical_files_are_not_ingested_at_the_same_time(tmp_path):
+    queue = IngestionQueue(tmp_path / "ingest.db")
+    first = queue.enqueue("batch", "a.txt", tmp_path / "a.txt", "doc-a", sha256="same")
+    copy = queue.enqueue("batch", "copy.txt", tmp_path / "copy.txt", "doc-b", sha256="same")
+    unhashed = queue.enqueue("batch", "c.txt", tmp_path / "c.txt", "doc-c")
+
+    assert queue.claim_next()["job_id"] == first["job_id"]
+    # The copy waits for the first file; a job without a hash does not
+    assert queue.claim_next()["job_id"] == unhashed["job_id"]
+    assert queue.claim_next() is None
+
+    queue.mark_done(first["job_id"], 1, 0.0, 0.0)
+    assert queue.claim_next()["job_id"] == copy["job_id"]
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.document_processor.PROCESSED_DIR", tmp_path)
+    vector_store = MemoryVectorStore()
+    pool = create_thread_pool("test", 2, 16)
+    worker = IngestionWorker(
+        IngestionQueue(tmp_path / "ingest.db"), DocumentIndex(tmp_path / "documents.db"), DocumentProcessor(),
+        vector_store, BulkWriter(vector_store, pool, batch_size=1000, max_delay=0.01), pool, pool, concurrency=1
+    )
+    yield worker
+    pool.shutdown()
+
+
+def ingest(worker, tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    worker.queue.enqueue("batch", "notes.txt", path, "doc-a", sha256=name, size_bytes=len(text))
+    return asyncio.run(worker._process(worker.queue.claim_next()))
+
+
+def test_failed_catalog_write_keeps_the_previous_version(worker, tmp_path, monkeypatch):
+    ingest(worker, tmp_path, "v1.txt", "First version of the notes.")
+    previous = dict(worker.vector_store.chunks)
+    assert set(previous) == worker.document_index.chunk_ids("doc-a")
+
+    def fail(*args):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(worker.document_index, "save_document", fail)
+    ingest(worker, tmp_path, "v2.txt", "Second version, with entirely different text.")
+
+    assert worker.vector_store.chunks == previous
+    assert worker.document_index.get_document("doc-a")["sha256"] == "v1.txt"
@@ -0,0 +1,124 @@
+import time
+import asyncio
+
+import pytest
+
+from app.services.llm_gateway import LLMGateway, TokenBucket, llm_stage
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == pytest.approx(0.0)
+
+
+def test_token_bucket_caps_oversized_requests_and_refunds():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    # More than the capacity only needs a full bucket
+    assert bucket.wait_time(1000, now) == 0.0
+    bucket.take(90)
+    assert bucket.wait_time(1, now) == pytest.approx(31.0)
+    bucket.give_back(1000)
+    assert bucket.level == bucket.capacity
+
+
+def test_queued_call_is_admitted_when_budget_refills():
+    gateway = LLMGateway(requests_per_minute=60, tokens_per_minute=0, max_concurrency=1, max_retries=0)
+    # Nearly empty: the second call needs about one second of refill
+    gateway.request_bucket.level = 1.0
+
+    async def call(model):
+        await asyncio.sleep(0.1)
+        return model
+
+    async def main():
+        start = time.monotonic()
+        first = asyncio.create_task(gateway.ainvoke(["a"], call, 1))
+        await asyncio.sleep(0.01)
+        # Queued behind the running call; when it finishes the bucket is still empty
+        second = await asyncio.wait_for(gateway.ainvoke(["b"], call, 1), timeout=5)
+        return await first, second, time.monotonic() - start
+
+    first, second, elapsed = asyncio.run(main())
+    assert (first, second) == ("a", "b")
+    assert 0.8 < elapsed < 3
+    assert gateway.stats()["queued"] == 0
+
+
+def test_waiting_calls_are_admitted_by_stage_priority():
+    gateway = LLMGateway(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1, max_retries=0)
+    order = []
+
+    async def call(model):
+        order.append(model)
+        await asyncio.sleep(0.01)
+
+    async def run(stage, name):
+        with llm_stage(stage):
+            await gateway.ainvoke([name], call, 1)
+
+    async def main():
+        blocker = asyncio.create_task(run("document", "first"))
+        await asyncio.sleep(0)
+        others = [asyncio.create_task(run("document", "extract")), asyncio.create_task(run("synthesis", "synthesis"))]
+        await asyncio.gather(blocker, *others)
+
+    asyncio.run(main())
+    assert order == ["first", "synthesis", "extract"]
+
+
+def test_retries_then_fails_over():
+    gateway = LLMGateway(requests_per_minute=0, tokens_per_minute=0, max_retries=1, base_delay=0.01, max_delay=0.01)
+    attempts = []
+
+    async def call(model):
+        attempts.append(model)
+        if model == "primary":
+            raise RateLimited()
+        return model
+
+    assert asyncio.run(gateway.ainvoke(["primary", "fallback"], call, 1)) == "fallback"
+    assert attempts == ["primary", "primary", "fallback"]
+    stats = gateway.stats()
+    assert (stats["retries"], stats["rate_limited"], stats["failovers"], stats["in_flight"]) == (1, 2, 1, 0)
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    gateway = LLMGateway(requests_per_minute=0, tokens_per_minute=0, max_retries=3)
+    attempts = []
+
+    async def call(model):
+        attempts.append(model)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(gateway.ainvoke(["primary", "fallback"], call, 1))
+    assert attempts == ["primary"]
+    assert gateway.stats()["failed"] == 1
+
+
+def test_timeout_applies_per_attempt_not_to_queueing():
+    gateway = LLMGateway(requests_per_minute=0, tokens_per_minute=0, max_concurrency=1, max_retries=1,
+                         base_delay=0.01, max_delay=0.01, attempt_timeout=0.3)
+    attempts = []
+
+    async def call(model):
+        attempts.append(model)
+        # The first attempt hangs and is retried
+        await asyncio.sleep(10 if len(attempts) == 1 else 0.2)
+        return model
+
+    async def main():
+        # Each call waits about 0.2s for the other, longer than half its own timeout
+        return await asyncio.gather(*[gateway.ainvoke([f"m{i}"], call, 1) for i in range(3)])
+
+    assert asyncio.run(main()) == ["m0", "m1", "m2"]
+    assert gateway.stats()["retries"] == 1
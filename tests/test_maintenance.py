@@ -0,0 +1,145 @@
+import os
+import time
+
+import pytest
+
+from app.services.document_index import DocumentIndex
+from app.services.ingestion import IngestionQueue
+from app.services.maintenance import StoreMaintenance
+
+
+class MemoryVectorStore:
+    """Just the chunk bookkeeping of a vector store."""
+
+    keyword_index = None
+
+    def __init__(self):
+        self.chunks = {}
+        self.metadata = {}
+
+    def add(self, doc_id, chunk_ids, metadata=None):
+        for chunk_id in chunk_ids:
+            self.chunks[chunk_id] = doc_id
+            self.metadata[chunk_id] = {"id": doc_id, **(metadata or {})}
+
+    def chunk_refs(self):
+        return list(self.chunks.items())
+
+    def chunk_metadata(self):
+        return [(chunk_id, self.metadata[chunk_id]) for chunk_id in self.chunks]
+
+    def delete_chunks(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            self.chunks.pop(chunk_id, None)
+
+    def delete_documents(self, doc_ids):
+        self.chunks = {chunk_id: doc_id for chunk_id, doc_id in self.chunks.items() if doc_id not in doc_ids}
+
+
+@pytest.fixture
+def stores(tmp_path):
+    for name in ("uploads", "processed", "db"):
+        (tmp_path / name).mkdir()
+    document_index = DocumentIndex(tmp_path / "db" / "documents.db")
+    vector_store = MemoryVectorStore()
+    queue = IngestionQueue(tmp_path / "db" / "ingest.db")
+    # A fresh install: the catalog is backfilled from an empty store when it is first opened
+    document_index.backfill(vector_store.chunk_metadata())
+    maintenance = StoreMaintenance(
+        document_index, vector_store, queue, upload_dir=tmp_path / "uploads", processed_dir=tmp_path / "processed",
+        db_dir=tmp_path / "db", file_grace_seconds=60
+    )
+    return tmp_path, document_index, vector_store, queue, maintenance
+
+
+def add_document(tmp_path, document_index, vector_store, doc_id, chunk_ids):
+    path, processed_path = tmp_path / "uploads" / doc_id, tmp_path / "processed" / f"{doc_id}.txt"
+    path.write_text("upload")
+    processed_path.write_text("text")
+    doc = {"id": doc_id, "filename": doc_id, "path": str(path), "processed_path": str(processed_path)}
+    document_index.save_document(doc, doc_id, 6, chunk_ids)
+    vector_store.add(doc_id, chunk_ids)
+
+
+def age(path, seconds=3600):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_delete_removes_chunks_files_and_catalog_entry(stores):
+    tmp_path, document_index, vector_store, queue, maintenance = stores
+    add_document(tmp_path, document_index, vector_store, "a", ["a:1", "a:2"])
+    add_document(tmp_path, document_index, vector_store, "b", ["b:1"])
+    queue.enqueue("batch", "b", tmp_path / "uploads" / "b", "b")
+
+    result = maintenance.delete_documents(["a", "b", "missing", "a"])
+    assert result == {"deleted": ["a"], "not_found": ["missing"], "busy": ["b"]}
+    assert vector_store.chunks == {"b:1": "b"}
+    assert document_index.get_document("a") is None
+    assert not (tmp_path / "uploads" / "a").exists() and not (tmp_path / "processed" / "a.txt").exists()
+
+
+def test_consistency_reports_and_repairs_stale_chunks_of_known_documents(stores):
+    tmp_path, document_index, vector_store, queue, maintenance = stores
+    add_document(tmp_path, document_index, vector_store, "a", ["a:1", "a:2"])
+    # Left over from an earlier version of a, and from a document that is gone
+    vector_store.add("a", ["a:old"])
+    vector_store.add("gone", ["gone:1"])
+
+    report = maintenance.check_consistency()
+    assert (report["orphan_chunks"], report["stale_chunks"], report["repaired"]) == (2, 1, False)
+
+    maintenance.check_consistency(repair=True)
+    assert set(vector_store.chunks) == {"a:1", "a:2"}
+    assert maintenance.check_consistency()["orphan_chunks"] == 0
+
+
+def test_consistency_leaves_ingesting_documents_and_new_files_alone(stores):
+    tmp_path, document_index, vector_store, queue, maintenance = stores
+    add_document(tmp_path, document_index, vector_store, "a", ["a:1"])
+    vector_store.add("ingesting", ["ingesting:1"])
+    queue.enqueue("batch", "ingesting", tmp_path / "uploads" / "ingesting", "ingesting")
+    # Saved a moment ago but not queued yet, and an old file nothing refers to
+    (tmp_path / "uploads" / "just-uploaded").write_text("new")
+    orphan = tmp_path / "uploads" / "orphan"
+    orphan.write_text("old")
+    age(orphan)
+
+    report = maintenance.check_consistency(repair=True)
+    assert report["orphan_chunks"] == 0
+    assert report["orphan_files"] == [str(orphan)]
+    assert not orphan.exists() and (tmp_path / "uploads" / "just-uploaded").exists()
+    assert "ingesting:1" in vector_store.chunks
+
+
+def test_consistency_reports_documents_missing_chunks_and_files(stores):
+    tmp_path, document_index, vector_store, queue, maintenance = stores
+    add_document(tmp_path, document_index, vector_store, "a", ["a:1", "a:2"])
+    vector_store.delete_chunks(["a:2"])
+    os.remove(tmp_path / "uploads" / "a")
+
+    report = maintenance.check_consistency()
+    assert report["documents_missing_chunks"] == ["a"]
+    assert report["documents_missing_files"] == ["a"]
+
+
+def test_consistency_catalogs_chunks_ingested_before_the_catalog_existed(tmp_path):
+    for name in ("uploads", "processed", "db"):
+        (tmp_path / name).mkdir()
+    upload = tmp_path / "uploads" / "old.pdf"
+    upload.write_text("upload")
+    age(upload)
+    vector_store = MemoryVectorStore()
+    # Chunks written before the catalog existed have random ids and carry the document's paths
+    vector_store.add("old.pdf", ["3f1c", "9a7e"], {"filename": "report.pdf", "path": str(upload)})
+    document_index = DocumentIndex(tmp_path / "db" / "documents.db")
+    maintenance = StoreMaintenance(
+        document_index, vector_store, IngestionQueue(tmp_path / "db" / "ingest.db"),
+        upload_dir=tmp_path / "uploads", processed_dir=tmp_path / "processed", db_dir=tmp_path / "db",
+        file_grace_seconds=60
+    )
+
+    report = maintenance.check_consistency(repair=True)
+    assert (report["documents"], report["orphan_chunks"], report["orphan_files"]) == (1, 0, [])
+    assert set(vector_store.chunks) == {"3f1c", "9a7e"} and upload.exists()
+    assert document_index.get_document("old.pdf")["filename"] == "report.pdf"
@@ -0,0 +1,61 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.middleware import TraceMiddleware
+from app.services.metrics import Counter, Histogram, get_trace, render_metrics, track_stage
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram("test_seconds", "Test durations", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, "extract")
+
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP queryquill_test_seconds Test durations", "# TYPE queryquill_test_seconds histogram"]
+    # A value equal to a bound counts in that bucket (le means "less than or equal")
+    assert lines[2:] == [
+        'queryquill_test_seconds_bucket{stage="extract",le="0.1"} 2',
+        'queryquill_test_seconds_bucket{stage="extract",le="1.0"} 3',
+        'queryquill_test_seconds_bucket{stage="extract",le="+Inf"} 4',
+        'queryquill_test_seconds_sum{stage="extract"} 2.65',
+        'queryquill_test_seconds_count{stage="extract"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("test_total", "Test counter", ("route",))
+    counter.inc(2, 'say "hi"\\now\n')
+    assert counter.render()[-1] == 'queryquill_test_total{route="say \\"hi\\"\\\\now\\n"} 2'
+
+
+def test_extra_families_skip_missing_values():
+    text = render_metrics([("pool_in_flight", "gauge", "Jobs in flight", [({"pool": "io"}, 3), ({"pool": "cpu"}, None)])])
+    assert '# TYPE queryquill_pool_in_flight gauge\nqueryquill_pool_in_flight{pool="io"} 3\n' in text
+    assert 'pool="cpu"' not in text
+    assert text.endswith("\n")
+
+
+def make_client():
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        with track_stage("query", "work"):
+            return {"ok": True}
+
+    app.add_middleware(TraceMiddleware)
+    return TestClient(app)
+
+
+def test_valid_trace_id_is_reused_and_records_the_request_stages():
+    reply = make_client().get("/work", headers={"X-Trace-Id": "client-trace_1.2"})
+    assert reply.headers["x-trace-id"] == "client-trace_1.2"
+    assert [span["name"] for span in get_trace("client-trace_1.2")["spans"]] == ["query.work"]
+
+
+def test_invalid_trace_id_is_replaced():
+    client = make_client()
+    for requested in ("bad id with spaces", "x" * 65, "<script>"):
+        trace_id = client.get("/work", headers={"X-Trace-Id": requested}).headers["x-trace-id"]
+        assert trace_id != requested and len(trace_id) == 32 and get_trace(trace_id) is not None
+    assert client.get("/work").headers["x-trace-id"] != trace_id
@@ -0,0 +1,116 @@
+import json
+import asyncio
+
+from app.services.context_budget import ContextBudget
+from app.services.query_processor import ERROR_ANSWER, QueryProcessor
+from benchmarks.bench_query_concurrency import StubVectorStore
+from benchmarks.fake_llm import BATCH_DOCUMENT_PATTERN, FakeChatModel
+
+QUERY = "What do the documents say?"
+
+
+class PartialBatchModel(FakeChatModel):
+    """Answers a batch with the second document under another id and without the third document."""
+
+    def _answer(self, prompt):
+        content = super()._answer(prompt)
+        if BATCH_DOCUMENT_PATTERN.search(prompt):
+            items = json.loads(content)
+            items[1]["doc_id"] = "doc-unknown"
+            return json.dumps(items[:2])
+        return content
+
+
+class FailingBatchModel(FakeChatModel):
+    """Replies to batched prompts with something that is not JSON."""
+
+    def _answer(self, prompt):
+        if BATCH_DOCUMENT_PATTERN.search(prompt):
+            return "I could not read these documents."
+        return super()._answer(prompt)
+
+
+class TrackingModel(FakeChatModel):
+    """Records the peak number of concurrent calls; calls about slow_doc hang, calls about failing_doc raise."""
+
+    in_flight: int = 0
+    peak: int = 0
+    slow_doc: str = ""
+    failing_doc: str = ""
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(m.content) for m in messages)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.failing_doc and f'"{self.failing_doc}"' in prompt:
+                raise RuntimeError("provider error")
+            if self.slow_doc and f'"{self.slow_doc}"' in prompt:
+                await asyncio.sleep(10)
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+def make_processor(llm, num_docs=3, **kwargs):
+    return QueryProcessor(
+        llm=llm, vector_store=StubVectorStore(num_docs), context_budget=ContextBudget(tokenizer=None),
+        theme_clustering=False, **kwargs
+    )
+
+
+def pending(*token_counts):
+    # Four characters per token with the approximate tokenizer
+    return {f"doc-{i}": {"chunks": ["x" * 4 * tokens], "filename": f"doc-{i}.pdf"}
+            for i, tokens in enumerate(token_counts)}
+
+
+def test_batches_are_cut_at_the_token_budget_in_retrieval_order():
+    processor = make_processor(FakeChatModel(latency=0), batch_context_tokens=100, batch_max_documents=10)
+    batches = processor._plan_batches(pending(40, 50, 20, 300, 10))
+    # doc-3 alone exceeds the budget and gets a batch of its own
+    assert [[doc_id for doc_id, _ in batch] for batch in batches] == [["doc-0", "doc-1"], ["doc-2"], ["doc-3"], ["doc-4"]]
+
+
+def test_batches_hold_at_most_batch_max_documents():
+    processor = make_processor(FakeChatModel(latency=0), batch_context_tokens=1000, batch_max_documents=2)
+    assert [len(batch) for batch in processor._plan_batches(pending(1, 1, 1, 1, 1))] == [2, 2, 1]
+
+
+def test_documents_missing_from_a_batch_reply_are_extracted_alone():
+    llm = PartialBatchModel(latency=0)
+    processor = make_processor(llm, batch_extraction=True, batch_max_documents=3)
+    responses = asyncio.run(processor.aprocess_query(QUERY))
+
+    assert sorted(response.doc_id for response in responses) == ["doc-0", "doc-1", "doc-2"]
+    assert all(response.extracted_answer.startswith("Fake answer") for response in responses)
+    # One batch call, then one call each for the mismatched and the missing document
+    assert (llm.calls, processor.batch_fallbacks) == (3, 2)
+
+
+def test_every_document_falls_back_when_the_batch_reply_cannot_be_parsed():
+    llm = FailingBatchModel(latency=0)
+    processor = make_processor(llm, batch_extraction=True, batch_max_documents=3, parse_fix=False)
+    responses = asyncio.run(processor.aprocess_query(QUERY))
+
+    assert all(response.extracted_answer.startswith("Fake answer") for response in responses)
+    assert (llm.calls, processor.batch_fallbacks) == (4, 3)
+    assert processor.parse_counters.stats()["batch"]["failed"] == 1
+
+
+def test_extractions_run_concurrently_up_to_max_concurrency():
+    llm = TrackingModel(latency=0.05)
+    processor = make_processor(llm, num_docs=6, max_concurrency=2, batch_extraction=False)
+    responses = asyncio.run(processor.aprocess_query(QUERY, top_k=6))
+    assert len(responses) == 6 and llm.calls == 6
+    assert llm.peak == 2
+
+
+def test_timed_out_and_failed_documents_get_error_answers_and_the_rest_are_kept():
+    llm = TrackingModel(latency=0, slow_doc="doc-1", failing_doc="doc-2")
+    processor = make_processor(llm, num_docs=4, call_timeout=0.2, batch_extraction=False, parse_fix=False)
+    responses = asyncio.run(processor.aprocess_query(QUERY))
+
+    # Failed documents rank last; the others keep their answers
+    assert [response.doc_id for response in responses] == ["doc-0", "doc-3", "doc-1", "doc-2"]
+    assert [response.extracted_answer == ERROR_ANSWER for response in responses] == [False, False, True, True]
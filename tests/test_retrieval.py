@@ -0,0 +1,40 @@
+import pytest
+
+from app.services.keyword_index import KeywordIndex, match_expression
+from app.services.retrieval import reciprocal_rank_fusion
+
+
+def test_reciprocal_rank_fusion_prefers_chunks_found_by_both_rankings():
+    dense = [("a", "doc a"), ("b", "doc b"), ("c", "doc c")]
+    keyword = [("c", "doc c"), ("d", "doc d")]
+    fused = reciprocal_rank_fusion([dense, keyword], k=60)
+
+    # b and d tie at rank 2 of one list; ties keep the order they were first seen in
+    assert [chunk_id for chunk_id, _, _ in fused] == ["c", "a", "b", "d"]
+    assert fused[0][2] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[0][1] == "doc c"
+
+
+def test_reciprocal_rank_fusion_of_nothing_is_empty():
+    assert reciprocal_rank_fusion([[], []]) == []
+
+
+def test_match_expression_quotes_terms():
+    assert match_expression('case CV-2021-0042, "urgent"?') == '"case" OR "CV-2021-0042" OR "urgent"'
+    assert match_expression(" ... ") == ""
+
+
+def test_keyword_search_finds_identifiers_and_filters_documents(tmp_path):
+    index = KeywordIndex(tmp_path / "keywords.db")
+    index.upsert(
+        ["a:1", "a:2", "b:1"],
+        ["Invoice CV-2021-0042 was paid late.", "Nothing to see here.", "Invoice CV-2021-0042 was disputed."],
+        [{"id": "a"}, {"id": "a"}, {"id": "b"}]
+    )
+    assert {chunk_id for chunk_id, *_ in index.search("CV-2021-0042")} == {"a:1", "b:1"}
+    assert [chunk_id for chunk_id, *_ in index.search("CV-2021-0042", document_ids=["b"])] == ["b:1"]
+
+    # Upserting a chunk id replaces its text
+    index.upsert(["a:1"], ["Replaced text."], [{"id": "a"}])
+    assert index.count() == 3
+    assert [chunk_id for chunk_id, *_ in index.search("CV-2021-0042")] == ["b:1"]
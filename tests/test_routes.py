@@ -0,0 +1,88 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import router
+from app.services.document_index import DocumentIndex
+from app.services.executors import PoolSaturatedError
+from app.services.query_processor import QueryProcessor
+from benchmarks.bench_query_concurrency import StubVectorStore
+from benchmarks.fake_llm import FakeChatModel
+
+
+def make_processor(num_docs=3):
+    return QueryProcessor(
+        llm=FakeChatModel(latency=0), vector_store=StubVectorStore(num_docs), batch_extraction=False,
+        theme_clustering=False
+    )
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    return TestClient(app)
+
+
+def sse_events(text):
+    events = []
+    for frame in text.strip().split("\n\n"):
+        event, data = frame.split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_stream_emits_documents_then_themes_then_tokens_then_done(client, monkeypatch):
+    monkeypatch.setattr("app.api.routes.get_query_processor", make_processor)
+    reply = client.post("/api/query/stream", json={"query": "What do the documents say?"})
+
+    assert reply.status_code == 200 and reply.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(reply.text)
+    names = [name for name, _ in events]
+    assert names[:4] == ["document", "document", "document", "themes"]
+    assert names[-1] == "done" and set(names[4:-1]) == {"token"}
+    assert {data["doc_id"] for name, data in events if name == "document"} == {"doc-0", "doc-1", "doc-2"}
+    assert events[3][1][0]["theme_name"] == "Fake theme"
+    done = events[-1][1]
+    assert done["synthesized_answer"] == "".join(data["text"] for name, data in events if name == "token")
+    assert len(done["document_responses"]) == 3
+
+
+def test_stream_ends_with_an_error_event_when_a_stage_raises(client, monkeypatch):
+    processor = make_processor()
+
+    async def fail(document_responses, query):
+        raise RuntimeError("theme stage failed")
+    processor.identify_themes = fail
+    monkeypatch.setattr("app.api.routes.get_query_processor", lambda: processor)
+
+    events = sse_events(client.post("/api/query/stream", json={"query": "What do the documents say?"}).text)
+    assert [name for name, _ in events] == ["document", "document", "document", "error"]
+    assert "theme stage failed" in events[-1][1]["detail"]
+
+
+class SaturatedPool:
+    async def run(self, fn, *args, **kwargs):
+        raise PoolSaturatedError("The io worker pool is saturated")
+
+
+def test_saturated_pool_is_reported_as_429_with_retry_after(client, monkeypatch, tmp_path):
+    monkeypatch.setattr("app.api.routes.get_io_pool", SaturatedPool)
+    monkeypatch.setattr("app.api.routes.get_document_index", lambda: DocumentIndex(tmp_path / "documents.db"))
+    reply = client.get("/api/documents")
+    assert reply.status_code == 429 and reply.headers["retry-after"] == "1"
+    assert "saturated" in reply.json()["detail"]
+
+
+def test_saturated_query_is_reported_as_429(client, monkeypatch):
+    processor = make_processor()
+
+    async def saturated(query, document_ids=None):
+        raise PoolSaturatedError("The io worker pool is saturated")
+    processor.aprocess_query_with_themes = saturated
+    monkeypatch.setattr("app.api.routes.get_query_processor", lambda: processor)
+
+    reply = client.post("/api/query", json={"query": "What do the documents say?"})
+    assert reply.status_code == 429 and reply.headers["retry-after"] == "1"
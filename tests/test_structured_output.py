@@ -0,0 +1,57 @@
+import pytest
+
+from app.services.structured_output import ParseCounters, extract_json_span, parse_json, repair_json
+
+EXPECTED = {"doc_id": "d1", "extracted_answer": "Rates rose", "relevance": 8}
+
+
+def test_extract_json_span_skips_prose_and_fences():
+    reply = 'Here you go:\n```json\n{"a": "}{", "b": [1, 2]}\n```\nHope this helps.'
+    assert extract_json_span(reply) == '{"a": "}{", "b": [1, 2]}'
+
+
+def test_extract_json_span_without_json_raises():
+    with pytest.raises(ValueError):
+        extract_json_span("I could not find anything relevant.")
+
+
+def test_valid_json_is_not_repaired():
+    assert parse_json('{"doc_id": "d1", "extracted_answer": "Rates rose", "relevance": 8}') == (EXPECTED, False)
+
+
+@pytest.mark.parametrize("reply", [
+    'Sure! {"doc_id": "d1", "extracted_answer": "Rates rose", "relevance": 8} Let me know.',
+    '```json\n{"doc_id": "d1", "extracted_answer": "Rates rose", "relevance": 8}\n```',
+    '{"doc_id": "d1", "extracted_answer": "Rates rose", "relevance": 8,}',
+    '{“doc_id”: “d1”, “extracted_answer”: “Rates rose”, “relevance”: 8}',
+    "{'doc_id': 'd1', 'extracted_answer': 'Rates rose', 'relevance': 8}",
+    '{"doc_id": "d1", "extracted_answer": "Rates rose", "relevance": 8',
+])
+def test_broken_replies_are_repaired(reply):
+    assert parse_json(reply) == (EXPECTED, True)
+
+
+def test_truncated_string_and_newlines_are_closed():
+    value, repaired = parse_json('[{"answer": "line one\nline two", "ok": True, "none": None}, {"answer": "cut off')
+    assert repaired
+    assert value == [{"answer": "line one\nline two", "ok": True, "none": None}, {"answer": "cut off"}]
+
+
+def test_repairs_leave_string_contents_alone():
+    text = '{"note": "True, None and trailing ,] stay as written",}'
+    assert repair_json(text) == '{"note": "True, None and trailing ,] stay as written"}'
+
+
+def test_unparseable_reply_raises():
+    with pytest.raises(ValueError):
+        parse_json("no json here")
+
+
+def test_parse_counters_count_paths_per_stage():
+    counters = ParseCounters()
+    counters.record("document", "direct")
+    counters.record("document", "direct")
+    counters.record("themes", "failed")
+    stats = counters.stats()
+    assert stats["document"]["direct"] == 2 and stats["document"]["native"] == 0
+    assert stats["themes"]["failed"] == 1
@@ -0,0 +1,59 @@
+import numpy as np
+
+from app.services.themes import ThemeClusterer, average_linkage_clusters
+
+
+class TopicEmbeddings:
+    """One axis per topic word found in the text."""
+
+    TOPICS = ("tax", "privacy", "shipping")
+
+    def embed_documents(self, texts):
+        return [[float(topic in text.lower()) + 0.01 for topic in self.TOPICS] for text in texts]
+
+
+def test_average_linkage_merges_similar_items_only():
+    similarity = np.array([
+        [1.0, 0.9, 0.1, 0.0],
+        [0.9, 1.0, 0.2, 0.1],
+        [0.1, 0.2, 1.0, 0.8],
+        [0.0, 0.1, 0.8, 1.0],
+    ])
+    assert average_linkage_clusters(similarity, 0.5) == [[0, 1], [2, 3]]
+    assert average_linkage_clusters(similarity, 0.95) == [[0], [1], [2], [3]]
+    # Average linkage: 0.1 to 0.9 between the pairs averages below the threshold
+    assert average_linkage_clusters(similarity, 0.3) == [[0, 1], [2, 3]]
+
+
+def test_clusters_shared_answers_into_named_themes():
+    answers = [
+        ("d1", "The tax rate rose in 2023.", 8),
+        ("d2", "A higher tax rate applies from 2023.", 7),
+        ("d3", "Privacy rules limit data sharing.", 6),
+        ("d4", "New privacy rules for data sharing.", 10),
+        ("d5", "Shipping is free.", 5),
+    ]
+    themes = ThemeClusterer(TopicEmbeddings(), threshold=0.5, max_themes=5, min_documents=2).cluster(answers)
+
+    assert [theme["supporting_documents"] for theme in themes] == [["d3", "d4"], ["d1", "d2"]]
+    assert themes[0]["theme_name"].lower().startswith(("data", "privacy", "rules", "sharing"))
+    assert "2023" in themes[1]["theme_name"] or "tax" in themes[1]["theme_name"].lower()
+    assert all(1 <= theme["confidence"] <= 10 for theme in themes)
+
+
+def test_single_document_themes_are_allowed():
+    answers = [("d1", "The tax rate rose.", 8), ("d2", "Shipping is free.", 5)]
+    themes = ThemeClusterer(TopicEmbeddings(), threshold=0.5, max_themes=5, min_documents=1).cluster(answers)
+
+    assert [theme["supporting_documents"] for theme in themes] == [["d1"], ["d2"]]
+    assert all(1 <= theme["confidence"] <= 10 for theme in themes)
+
+
+def test_too_few_answers_give_no_themes():
+    clusterer = ThemeClusterer(TopicEmbeddings(), min_documents=2)
+    assert clusterer.cluster([("d1", "The tax rate rose.", 8)]) == []
+
+
+def test_description_counts_documents_in_the_singular_for_one():
+    assert ThemeClusterer._describe("Rates  rose.", 1) == "Shared by 1 document, e.g.: Rates rose."
+    assert ThemeClusterer._describe("Rates rose.", 3) == "Shared by 3 documents, e.g.: Rates rose."